@@ -0,0 +1,246 @@
+"""Latency and memory benchmarks of the GUI's load, navigate, paint and save paths.
+
+Runs MainWindow on Qt's offscreen platform against synthetic directories that vary
+one of image resolution, faces per image, embedding size and candidate list size at
+a time. Results are written as JSON; pass an earlier result as --baseline to report
+operations that got slower.
+
+    python -m benchmarks.run [--quick] [--out FILE] [--baseline FILE] [--tolerance 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtCore import QEvent, QPointF, Qt
+from PyQt5.QtGui import QMouseEvent
+
+from benchmarks.synthetic import make_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+BASE = {'width': 1920, 'height': 1080, 'faces': 10, 'embedding_dim': 512, 'candidates': 1000}
+VARIANTS = {
+    'width': [(640, 480), (1920, 1080), (6000, 4000)],
+    'faces': [1, 10, 100],
+    'embedding_dim': [0, 512, 8631],
+    'candidates': [100, 1000, 100000]
+}
+
+# Slowdowns below this many milliseconds are considered noise
+NOISE_MS = 0.5
+
+
+def scenarios():
+    """Parameter sets varying one axis of BASE at a time, without duplicates."""
+    seen = []
+    for axis, values in VARIANTS.items():
+        for value in values:
+            params = dict(BASE)
+            if axis == 'width':
+                params['width'], params['height'] = value
+            else:
+                params[axis] = value
+            if params not in seen:
+                seen.append(params)
+    return seen
+
+
+def scenario_name(params):
+    return (f"{params['width']}x{params['height']}_faces{params['faces']}_dim{params['embedding_dim']}"
+            f"_cand{params['candidates']}")
+
+
+def spin(app, seconds=0.0, until=None, timeout=30):
+    """Process events for seconds, or until until() is true."""
+    end = time.perf_counter() + (timeout if until else seconds)
+    while time.perf_counter() < end:
+        app.processEvents()
+        if until and until():
+            return
+        time.sleep(0.005)
+
+
+def measure(operation, repeat, setup=None):
+    """Latency of operation() in ms over repeat runs and the peak of Python allocations of one run in KiB."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        operation()
+        times.append((time.perf_counter() - start) * 1000)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    operation()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'median_ms': round(statistics.median(times), 3),
+        'p95_ms': round(float(np.percentile(times, 95)), 3),
+        'peak_kib': round(peak / 1024, 1)
+    }
+
+
+def run_scenario(app, params, images, repeat):
+    from src.main_window import MainWindow
+
+    with tempfile.TemporaryDirectory(prefix='face_tool_bench_') as dir_name:
+        id_list = make_dataset(dir_name, images, **params)
+        QtWidgets.QFileDialog.getExistingDirectory = staticmethod(lambda *args, **kwargs: dir_name)
+
+        window = MainWindow(id_list)
+        window.resize(1280, 800)
+        window.show()
+        indexed = []
+        window.index_builder.finished.connect(lambda: indexed.append(True))
+        window.load_action()
+        spin(app, until=lambda: indexed and not window.file_scanner.running() and not window.dataset_indexer.running())
+
+        def go_to(idx):
+            # Cold load, as after a jump
+            window.prefetcher.cancel()
+            window.prefetcher.cache.clear()
+            window.tile_loader.clear()
+            window.img_file_idx = idx
+            window.process_image()
+            window.update_ui()
+            spin(app, 0.2)  # Let tiles arrive
+
+        results = {}
+        positions = iter(range(10 ** 9))
+
+        def next_position():
+            window.img_file_idx = next(positions) % (images - 1)
+            window.prefetcher.cancel()
+            window.prefetcher.cache.clear()
+
+        results['process_image'] = measure(window.process_image, repeat, next_position)
+        go_to(0)
+        results['next_image'] = measure(window.next_button_action, repeat,
+                                        lambda: go_to(next(positions) % (images - 1)))
+        go_to(0)
+        results['update_ui'] = measure(window.update_ui, repeat)
+
+        widget = window.imgWidget
+
+        def full_paint():
+            widget.invalidate_overlay()
+            widget.repaint()
+
+        results['paint'] = measure(full_paint, repeat)
+        results['paint_cached'] = measure(widget.repaint, repeat)
+
+        scale, offset = widget.transform()
+        box = window.img_bboxes.boxes[0]
+        center = QPointF(*((box[:2] + box[2:]) / 2 * scale + offset))
+
+        def press():
+            widget.mousePressEvent(QMouseEvent(QEvent.MouseButtonPress, center, Qt.LeftButton, Qt.LeftButton,
+                                               Qt.NoModifier))
+
+        def release():
+            widget.mouseReleaseEvent(QMouseEvent(QEvent.MouseButtonRelease, center, Qt.LeftButton, Qt.NoButton,
+                                                 Qt.NoModifier))
+
+        results['mouse_press'] = measure(press, repeat, release)
+        release()
+
+        results['save_action'] = measure(window.save_action, repeat, window.mark_dirty)
+        results['save_write'] = measure(window.writer.flush, repeat,
+                                        lambda: (window.mark_dirty(), window.save_action()))
+        window.close()
+        spin(app, 0.1)
+        window.deleteLater()
+        spin(app, 0.1)
+        return results
+
+
+def compare(results, baseline, tolerance):
+    """[(scenario, operation, old ms, new ms)] of operations slower than baseline by more than tolerance."""
+    regressions = []
+    for name, operations in results['scenarios'].items():
+        for operation, stats in operations.items():
+            old = baseline['scenarios'].get(name, {}).get(operation)
+            if old is None:
+                continue
+            new_ms, old_ms = stats['median_ms'], old['median_ms']
+            if new_ms > old_ms * (1 + tolerance) and new_ms - old_ms > NOISE_MS:
+                regressions.append((name, operation, old_ms, new_ms))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the GUI on synthetic annotation directories.")
+    parser.add_argument('--quick', action='store_true', help="fewer images and repetitions")
+    parser.add_argument('--images', type=int, default=None, help="images per scenario (default: 20, quick: 5)")
+    parser.add_argument('--repeat', type=int, default=None, help="runs per operation (default: 30, quick: 5)")
+    parser.add_argument('--only', help="run only scenarios whose name contains this text")
+    parser.add_argument('--out', help="result file (default: benchmarks/results/<time>.json)")
+    parser.add_argument('--baseline', help="earlier result file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative slowdown (default: 0.2)")
+    args = parser.parse_args()
+
+    images = args.images or (5 if args.quick else 20)
+    repeat = args.repeat or (5 if args.quick else 30)
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QtWidgets.QApplication(sys.argv[:1])
+
+    results = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': {
+            'python': platform.python_version(),
+            'qt': QtCore.QT_VERSION_STR,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor()
+        },
+        'settings': {'images': images, 'repeat': repeat},
+        'scenarios': {}
+    }
+    for params in scenarios():
+        name = scenario_name(params)
+        if args.only and args.only not in name:
+            continue
+        print(name, file=sys.stderr)
+        results['scenarios'][name] = operations = run_scenario(app, params, images, repeat)
+        for operation, stats in operations.items():
+            print(f"  {operation:14} {stats['median_ms']:9.2f} ms  p95 {stats['p95_ms']:9.2f} ms  "
+                  f"peak {stats['peak_kib']:10.1f} KiB", file=sys.stderr)
+
+    try:
+        import resource
+        results['max_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass  # Windows
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=4)
+    print(f"Results: {out}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for name, operation, old_ms, new_ms in regressions:
+            print(f"  slower: {name} {operation} {old_ms:.2f} -> {new_ms:.2f} ms")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Synthetic annotation directories for the benchmarks."""
+import os
+
+import cv2
+import numpy as np
+
+from src.annotation import face_result, new_annotation, write_annotation
+
+
+def write_image(img_file, width, height, rng):
+    """JPEG with smooth content, so it compresses and decodes like a photo rather than noise."""
+    small = rng.integers(0, 256, (max(height // 64, 2), max(width // 64, 2), 3), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    ok, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    data.tofile(img_file)
+
+
+def random_boxes(count, rng):
+    """count normalized boxes of 3 to 15% of the image size."""
+    size = rng.uniform(0.03, 0.15, (count, 2))
+    corner = rng.uniform(0, 1, (count, 2)) * (1 - size)
+    return np.hstack([corner, corner + size]).round(6).tolist()
+
+
+def make_dataset(dir_name, images, width, height, faces, embedding_dim, candidates, seed=0):
+    """Fill dir_name with images and annotations, returns the path of the candidate ID list.
+
+    Every other face gets an id from the candidate list, the others an unknown id.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(dir_name, exist_ok=True)
+    names = [f"person_{i}" for i in range(candidates)]
+
+    for i in range(images):
+        img_file = os.path.join(dir_name, f"img_{i:05d}.jpg")
+        write_image(img_file, width, height, rng)
+
+        doc = new_annotation(img_file)
+        result = face_result(doc)
+        result['bboxes'] = random_boxes(faces, rng)
+        result['ids'] = [names[rng.integers(candidates)] if j % 2 == 0 else str(rng.integers(10000))
+                         for j in range(faces)]
+        if embedding_dim:
+            # Rounded like the sample files, which is what makes them large
+            result['embeddings'] = rng.standard_normal((faces, embedding_dim)).astype(np.float32).round(4).tolist()
+        write_annotation(os.path.join(dir_name, f"img_{i:05d}.json"), doc)
+
+    id_list = os.path.join(dir_name, 'id_cand_list.txt')
+    with open(id_list, 'w', encoding='utf-8') as file:
+        file.write("\n".join(names) + "\n")
+    return id_list
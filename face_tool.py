@@ -1,3 +1,4 @@
+import argparse
 import sys
 import os
 
@@ -8,8 +9,12 @@ from src.main_window import MainWindow
 
 def main():
     os.environ['QT_IM_MODULE'] = 'fcitx'
-    app = QtWidgets.QApplication(sys.argv)
-    window = MainWindow()
+    parser = argparse.ArgumentParser(description="Face bounding box annotation tool.")
+    parser.add_argument('--id-list', default='id_cand_list.txt', help="file with one candidate ID per line")
+    args, qt_args = parser.parse_known_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+    window = MainWindow(args.id_list)
     window.show()
     sys.exit(app.exec())
 
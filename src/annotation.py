@@ -0,0 +1,157 @@
+import os
+import shutil
+import tempfile
+
+from . import instrument
+from .image_probe import image_size
+from .json_stream import dumps_with_raw, find_raw, load_partial
+
+# Id of boxes that were added but not labeled yet
+NEW_BOX_ID = "--추가해주세요--"
+
+# mkstemp creates files readable only by the owner, new annotations get the usual permissions instead
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def json_path_for(img_file):
+    """Path of the annotation JSON that belongs to an image file."""
+    dir_name = os.path.dirname(img_file)
+    file_root = os.path.splitext(os.path.basename(img_file))[0]
+    return os.path.join(dir_name, f"{file_root}.json")
+
+
+def face_result(doc):
+    """Shortcut to the face result block (bboxes, embeddings, ids, ...)."""
+    return doc['object_info']['face']['result']
+
+
+def new_annotation(img_file):
+    """Empty annotation document for img_file, the image size is read from its header."""
+    width, height = image_size(img_file)
+    file_root = os.path.splitext(os.path.basename(img_file))[0]
+    img_size = os.path.getsize(img_file)
+
+    return {
+        "dataset_info": {
+            "description": ".",
+            "dataset_version": "1.0",
+            "dateset_created": "",
+            "attributes": {
+                "image_augmented": "",
+                "answer_refined": ""
+            },
+            "dataset_created": ""
+        },
+        "image_info": {
+            "image_name": file_root,
+            "attributes": {
+                "color": 3,
+                "image_size": img_size,
+                "image_width": width,
+                "image_height": height,
+                "image_path": img_file
+            }
+        },
+        "object_info": {
+            "face": {
+                "algorithm": {
+                    "face_detect_algorithm": "",
+                    "face_recog_algorithm": "",
+                    "face_age_gender_algorithm": "",
+                    "face_detect_model": "",
+                    "face_recog_model": "",
+                    "face_age_gender_model": ""
+                },
+                "result": {
+                    "bboxes": [],
+                    "embeddings": [],
+                    "ids": [],
+                    "ages": [],
+                    "genders": []
+                }
+            },
+            "face_detect_algorithm": "",
+            "face_recog_algorithm": "",
+            "face_detect_model": "",
+            "face_recog_model": "",
+        }
+    }
+
+
+def load_annotation(json_file):
+    """Read an annotation document, accepting files with a UTF-8 BOM.
+
+    Inline embeddings are not decoded, they are kept as a json_stream.RawJSON.
+    """
+    return load_partial(json_file)
+
+
+def load_embedding_list(doc):
+    """Embeddings field of doc, decoding it if it was captured as raw JSON."""
+    raw = find_raw(doc)
+    return raw.load() if raw is not None else face_result(doc)['embeddings']
+
+
+def dump_annotation(json_file, doc):
+    """Write an annotation document in the tool's indented JSON layout.
+
+    Returns the (start, end) byte span the raw embeddings were copied to, or None.
+    """
+    data, raw_span = dumps_with_raw(doc, ensure_ascii=False, indent=4)
+    with open(json_file, 'wb') as file:
+        file.write(data)
+    return raw_span
+
+
+def write_annotation(json_file, doc, overwrite=True):
+    """Atomically replace json_file with doc.
+
+    The document is written to a temporary file in the same directory which is then
+    renamed over the original, so readers never see a half written file. With
+    overwrite=False an existing json_file is kept and FileExistsError raised.
+    """
+    dir_name = os.path.dirname(json_file) or '.'
+    fd, tmp_file = tempfile.mkstemp(dir=dir_name, prefix=f".{os.path.basename(json_file)}.", suffix='.tmp')
+    os.close(fd)
+    try:
+        raw_span = dump_annotation(tmp_file, doc)
+        if os.path.exists(json_file):
+            shutil.copymode(json_file, tmp_file)
+        else:
+            os.chmod(tmp_file, 0o666 & ~_UMASK)
+        if overwrite:
+            os.replace(tmp_file, json_file)
+        else:
+            # Unlike a rename, a hard link fails if json_file was created meanwhile
+            os.link(tmp_file, json_file)
+            os.remove(tmp_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+    if instrument.ENABLED:
+        instrument.add_written(os.path.getsize(json_file))
+
+    # The embeddings were copied byte for byte, later saves read them from the new file
+    if raw_span is not None:
+        find_raw(doc).rebind(json_file, *raw_span)
+
+
+def snapshot(doc):
+    """Copy of everything the GUI edits in doc, sharing all other (large) parts.
+
+    Used to hand a document to a background writer while the GUI keeps editing it.
+    """
+    copied = dict(doc)
+    copied['dataset_info'] = dict(doc['dataset_info'])
+    copied['dataset_info']['attributes'] = dict(doc['dataset_info']['attributes'])
+    copied['object_info'] = dict(doc['object_info'])
+    face = copied['object_info']['face'] = dict(doc['object_info']['face'])
+    if 'algorithm' in face:
+        face['algorithm'] = dict(face['algorithm'])
+    result = face['result'] = dict(face['result'])
+    result['ids'] = list(result['ids'])
+    result['bboxes'] = [list(bbox) for bbox in result['bboxes']]
+    return copied
@@ -0,0 +1,103 @@
+from .lazy_import import LazyModule
+
+np = LazyModule('numpy')
+
+# Corner order used for hit testing and resizing: top left, top right, bottom right, bottom left.
+# Each corner is given as the (x, y) columns of the (x1, y1, x2, y2) box it consists of.
+CORNER_COLUMNS = [[0, 1], [2, 1], [2, 3], [0, 3]]
+
+
+class BBoxStore:
+    """Bounding boxes of one image.
+
+    boxes is an (N, 4) array of x1, y1, x2, y2 in image pixels, ids the list of
+    box IDs (usually the very list stored in the annotation document).
+    """
+
+    def __init__(self, boxes, ids):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.ids = ids
+
+    @classmethod
+    def from_normalized(cls, bboxes, ids, width, height):
+        """Boxes from the JSON layout (x1, y1, x2, y2 relative to the image size)."""
+        return cls(np.asarray(bboxes, dtype=np.float64).reshape(-1, 4) * [width, height, width, height], ids)
+
+    def to_normalized(self, width, height):
+        """Boxes in the JSON layout."""
+        return (self.boxes / [width, height, width, height]).tolist()
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _check_index(self, idx):
+        # None or negative indices would silently address other rows in numpy
+        if idx is None or not 0 <= idx < len(self.boxes):
+            raise IndexError(f"Box index {idx} out of range")
+
+    def corners(self):
+        """(N, 4, 2) array of the corners of every box, see CORNER_COLUMNS."""
+        return self.boxes[:, CORNER_COLUMNS]
+
+    def append(self, box, name):
+        self.boxes = np.vstack([self.boxes, np.asarray(box, dtype=np.float64)])
+        self.ids.append(name)
+
+    def insert(self, idx, box, name):
+        if idx is None or not 0 <= idx <= len(self.boxes):
+            raise IndexError(f"Box index {idx} out of range")
+        self.boxes = np.insert(self.boxes, idx, np.asarray(box, dtype=np.float64), axis=0)
+        self.ids.insert(idx, name)
+
+    def delete(self, idx):
+        self._check_index(idx)
+        self.boxes = np.delete(self.boxes, idx, axis=0)
+        del self.ids[idx]
+
+    def set_box(self, idx, box):
+        self._check_index(idx)
+        self.boxes[idx] = box
+
+    def set_id(self, idx, name):
+        self._check_index(idx)
+        self.ids[idx] = name
+
+    def move(self, idx, dx, dy):
+        """Move a whole box by (dx, dy) image pixels."""
+        self.boxes[idx] += [dx, dy, dx, dy]
+
+    def move_corner(self, idx, corner, dx, dy):
+        """Move one corner by (dx, dy), the neighbouring corners follow along their edge."""
+        x_column, y_column = CORNER_COLUMNS[corner]
+        self.boxes[idx, x_column] += dx
+        self.boxes[idx, y_column] += dy
+
+    def hit_test(self, pos, radius, scale, offset):
+        """Box and corner under the widget position pos in one vectorized pass.
+
+        scale and offset map image to widget coordinates (widget = image * scale + offset).
+        Returns (box index, corner index) with corner None for a hit inside the box, or
+        None. Like drawing order, the first box wins; within a box the last corner does.
+        """
+        if not len(self.boxes):
+            return None
+
+        pos = np.asarray(pos, dtype=np.float64)
+        corners = self.corners() * scale + offset
+        corner_hits = ((corners - pos) ** 2).sum(axis=2) < radius ** 2
+
+        widget_boxes = self.boxes * np.tile(scale, 2) + np.tile(offset, 2)
+        x_min = np.minimum(widget_boxes[:, 0], widget_boxes[:, 2])
+        x_max = np.maximum(widget_boxes[:, 0], widget_boxes[:, 2])
+        y_min = np.minimum(widget_boxes[:, 1], widget_boxes[:, 3])
+        y_max = np.maximum(widget_boxes[:, 1], widget_boxes[:, 3])
+        inside = (x_min <= pos[0]) & (pos[0] <= x_max) & (y_min <= pos[1]) & (pos[1] <= y_max)
+
+        hits = corner_hits.any(axis=1) | inside
+        if not hits.any():
+            return None
+
+        idx = int(hits.argmax())
+        if corner_hits[idx].any():
+            return idx, int(3 - corner_hits[idx][::-1].argmax())
+        return idx, None
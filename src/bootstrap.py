@@ -0,0 +1,80 @@
+"""Creation of the missing annotation files of a directory ahead of time.
+
+Every image without a JSON file gets the empty document the GUI would otherwise
+create on its first visit. The image sizes are read from the headers by worker
+processes, files created by someone else in the meantime are left alone.
+
+    python -m src.bootstrap <dir> [--workers N]
+"""
+import argparse
+import os
+import sys
+
+from .annotation import json_path_for, new_annotation, write_annotation
+from .process_pool import process_pool
+
+
+def missing_annotations(img_files):
+    """The img_files that have no annotation file, listing each directory once."""
+    existing = {}
+    missing = []
+    for img_file in img_files:
+        json_file = json_path_for(img_file)
+        dir_name = os.path.dirname(json_file)
+        if dir_name not in existing:
+            with os.scandir(dir_name or '.') as entries:
+                existing[dir_name] = {entry.name for entry in entries if entry.name.endswith('.json')}
+        if os.path.basename(json_file) not in existing[dir_name]:
+            missing.append(img_file)
+    return missing
+
+
+def create_annotation(img_file):
+    """Write the empty annotation of img_file. Returns (img_file, created, error message or None)."""
+    try:
+        write_annotation(json_path_for(img_file), new_annotation(img_file), overwrite=False)
+        return img_file, True, None
+    except FileExistsError:
+        return img_file, False, None
+    except (OSError, ValueError) as e:
+        return img_file, False, str(e)
+
+
+def bootstrap(img_files, workers=None, progress=None):
+    """Create all missing annotations of img_files in parallel, returns (created, [(img_file, error)])."""
+    missing = missing_annotations(img_files)
+    created, errors = 0, []
+    if not missing:
+        return created, errors
+
+    with process_pool(workers) as pool:
+        for done, (img_file, was_created, error) in enumerate(pool.map(create_annotation, missing, chunksize=64), 1):
+            created += was_created
+            if error:
+                errors.append((img_file, error))
+            if progress and done % 1000 == 0:
+                progress(done, len(missing))
+    if progress:
+        progress(len(missing), len(missing))
+    return created, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the missing annotation files of an image directory.")
+    parser.add_argument('directory')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    # Imported here so the worker processes do not have to load Qt
+    from .file_scanner import is_image
+    img_files = sorted(os.path.join(args.directory, name) for name in os.listdir(args.directory) if is_image(name))
+    created, errors = bootstrap(img_files, args.workers,
+                                lambda done, total: print(f"{done}/{total}", end='\r', file=sys.stderr))
+    print(file=sys.stderr)
+    print(f"Created {created} annotation(s)")
+    for img_file, error in errors:
+        print(f"  error {img_file}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .bootstrap import bootstrap
+
+
+class BootstrapTask(QObject):
+    """Runs bootstrap on a thread for the GUI."""
+    # Emitted with the number of created annotations and the [(image file, error)] list
+    finished = pyqtSignal(int, list)
+
+    def __init__(self, workers=None):
+        super().__init__()
+        self.workers = workers
+        self._thread = None
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, img_files):
+        if self.running():
+            return
+        img_files = list(img_files)
+        self._thread = threading.Thread(target=lambda: self.finished.emit(*bootstrap(img_files, self.workers)),
+                                        name="BootstrapTask", daemon=True)
+        self._thread.start()
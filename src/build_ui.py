@@ -0,0 +1,27 @@
+"""Compile the .ui files into Python modules, see ui_loader.
+
+    python -m src.build_ui
+"""
+import os
+
+from PyQt5 import uic
+
+from .ui_loader import COMPILED_PACKAGE, compiled_module_name, ui_path
+
+UI_NAMES = ('main_window', 'id_dialog')
+
+
+def build(names=UI_NAMES):
+    out_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), COMPILED_PACKAGE)
+    os.makedirs(out_dir, exist_ok=True)
+    open(os.path.join(out_dir, '__init__.py'), 'a').close()
+
+    for name in names:
+        out_file = os.path.join(out_dir, f"{compiled_module_name(name)}.py")
+        with open(out_file, 'w', encoding='utf-8') as file:
+            uic.compileUi(ui_path(name), file)
+        print(f"{ui_path(name)} -> {out_file}")
+
+
+if __name__ == "__main__":
+    build()
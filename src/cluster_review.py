@@ -0,0 +1,87 @@
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .clustering import cluster_faces
+
+
+class ClusterReview(QObject):
+    """Runs the clustering on a thread and keeps the position while stepping through it."""
+    # Emitted with the number of faces assigned so far
+    progress = pyqtSignal(int)
+    finished = pyqtSignal()
+    # Emitted with the error message if clustering raised, result is left unchanged then
+    failed = pyqtSignal(str)
+
+    def __init__(self):
+        super().__init__()
+        self.result = None
+        self.cluster_idx = 0
+        self.member_idx = 0
+        self._thread = None
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, json_files, is_label, threshold):
+        """Cluster json_files in the background. is_label must be safe to call from a thread."""
+        if self.running():
+            return
+        self._thread = threading.Thread(target=self._run, args=(list(json_files), is_label, threshold),
+                                        name="ClusterReview", daemon=True)
+        self._thread.start()
+
+    def _run(self, json_files, is_label, threshold):
+        try:
+            result = cluster_faces(json_files, is_label, threshold, progress=self.progress.emit)
+        except Exception as e:  # Anything else would end the thread without a word, e.g. mismatched embeddings
+            self.failed.emit(f"{type(e).__name__}: {e}")
+            return
+        self.result = result
+        self.cluster_idx = 0
+        self.member_idx = 0
+        self.finished.emit()
+
+    def cluster(self):
+        """Current cluster or None."""
+        if not self.result:
+            return None
+        return self.result.clusters[self.cluster_idx]
+
+    def member(self):
+        """(JSON path, face index, id) of the current member or None."""
+        cluster = self.cluster()
+        return cluster['members'][self.member_idx] if cluster else None
+
+    def step_cluster(self, delta):
+        """Move to the first member of the next/previous cluster."""
+        if self.result:
+            self.cluster_idx = min(max(self.cluster_idx + delta, 0), len(self.result) - 1)
+            self.member_idx = 0
+        return self.member()
+
+    def step_member(self, delta):
+        """Move to the next/previous member of the current cluster."""
+        cluster = self.cluster()
+        if cluster:
+            self.member_idx = min(max(self.member_idx + delta, 0), len(cluster['members']) - 1)
+        return self.member()
+
+    def assign(self, name):
+        """Record that every member of the current cluster is now labeled name."""
+        cluster = self.cluster()
+        cluster['members'] = [(json_file, face, name) for json_file, face, _ in cluster['members']]
+        cluster['label'] = name
+        cluster['label_share'] = 1.0
+        cluster['unknown'] = []
+        cluster['outliers'] = []
+
+    def describe(self):
+        """Short status text for the current position."""
+        cluster = self.cluster()
+        if not cluster:
+            return ""
+        label = f"{cluster['label']} {cluster['label_share']:.0%}" if cluster['label'] else "unlabeled"
+        return (f"Cluster {self.cluster_idx + 1}/{len(self.result)} ({label}, "
+                f"{len(cluster['unknown'])} unknown, {len(cluster['outliers'])} outliers) - "
+                f"face {self.member_idx + 1}/{len(cluster['members'])}")
@@ -0,0 +1,227 @@
+"""Identity clustering of every face embedding in a directory.
+
+Faces are streamed from the annotation files in fixed size batches, so only one
+batch and the cluster centroids are in memory at a time:
+
+1. Leader clustering: each batch is compared to all centroids with one matrix
+   product, faces above the similarity threshold join their best cluster, the
+   others start new clusters.
+2. Every face is assigned again to its nearest final centroid.
+
+A cluster is labeled with the most common known id of its members. Members whose
+known id differs from that label are reported as outliers.
+"""
+import argparse
+import glob
+import json
+import os
+from collections import Counter
+
+from .annotation import face_result, load_annotation
+from .embedding_store import load_embeddings
+from .id_suggest import normalize_rows
+from .lazy_import import LazyModule
+
+np = LazyModule('numpy')
+
+
+def iter_face_batches(json_files, batch_size=4096):
+    """Yield (faces, ids, normalized embeddings) with up to batch_size rows.
+
+    faces holds (JSON path, face index) per row. Files whose embeddings do not line
+    up with their ids are skipped.
+    """
+    faces, ids, vectors, rows = [], [], [], 0
+    for json_file in json_files:
+        try:
+            doc = load_annotation(json_file)
+            embeddings = load_embeddings(json_file, doc)
+            file_ids = face_result(doc)['ids']
+        except (OSError, ValueError, KeyError):
+            continue
+        if len(embeddings) == 0 or len(embeddings) != len(file_ids):
+            continue
+
+        faces.extend((json_file, i) for i in range(len(file_ids)))
+        ids.extend(file_ids)
+        vectors.append(normalize_rows(embeddings))
+        rows += len(file_ids)
+
+        if rows >= batch_size:
+            yield faces, ids, np.concatenate(vectors)
+            faces, ids, vectors, rows = [], [], [], 0
+
+    if rows:
+        yield faces, ids, np.concatenate(vectors)
+
+
+class _Centroids:
+    """Growing set of cluster centroids kept as running sums.
+
+    The arrays grow geometrically, sums and counts are views of their used rows.
+    """
+
+    def __init__(self):
+        self._sums = None
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._size = 0
+        self._normalized = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def sums(self):
+        return self._sums[:self._size]
+
+    @property
+    def counts(self):
+        return self._counts[:self._size]
+
+    def normalized(self):
+        if self._normalized is None:
+            self._normalized = normalize_rows(self.sums)
+        return self._normalized
+
+    def add(self, vectors):
+        """Start one new cluster per row of vectors, returns their indices."""
+        start, end = self._size, self._size + len(vectors)
+        if self._sums is None or end > len(self._sums):
+            capacity = max(end, 2 * len(self._counts), 64)
+            sums = np.zeros((capacity, vectors.shape[1]), dtype=vectors.dtype)
+            counts = np.zeros(capacity, dtype=np.int64)
+            if self._sums is not None:
+                sums[:start] = self.sums
+                counts[:start] = self.counts
+            self._sums, self._counts = sums, counts
+        self._sums[start:end] = vectors
+        self._counts[start:end] = 1
+        self._size = end
+        self._normalized = None
+        return np.arange(start, end)
+
+    def update(self, clusters, vectors):
+        np.add.at(self.sums, clusters, vectors)
+        np.add.at(self.counts, clusters, 1)
+        self._normalized = None
+
+
+def _leader_pass(batches, threshold, centroids):
+    for _, _, vectors in batches:
+        if len(centroids):
+            similarities = vectors @ centroids.normalized().T
+            best = similarities.argmax(axis=1)
+            matched = similarities[np.arange(len(vectors)), best] >= threshold
+            centroids.update(best[matched], vectors[matched])
+            vectors = vectors[~matched]
+
+        if not len(vectors):
+            continue
+
+        # Faces without a cluster: in order, each face not taken yet starts a cluster
+        # and takes all remaining similar faces of the batch with it
+        similar = (vectors @ vectors.T) >= threshold
+        leader = np.full(len(vectors), -1)
+        for i in range(len(vectors)):
+            if leader[i] < 0:
+                leader[similar[i] & (leader < 0)] = i
+
+        leaders, clusters = np.unique(leader, return_inverse=True)
+        new = centroids.add(vectors[leaders])
+        followers = leader != np.arange(len(vectors))
+        centroids.update(new[clusters[followers]], vectors[followers])
+
+
+class ClusterResult:
+    """Clusters of one run. Each cluster is a dict with
+
+    members: list of (JSON path, face index, id)
+    label: most common known id of the members or None
+    label_share: fraction of the labeled members that carry label
+    unknown: members whose id is not a known candidate
+    outliers: members with a known id different from label
+    """
+
+    def __init__(self, clusters):
+        self.clusters = clusters
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def to_json(self):
+        return {'clusters': [
+            {
+                'label': cluster['label'],
+                'label_share': cluster['label_share'],
+                'members': [{'file': path, 'face': face, 'id': name} for path, face, name in cluster['members']],
+                'unknown': [{'file': path, 'face': face, 'id': name} for path, face, name in cluster['unknown']],
+                'outliers': [{'file': path, 'face': face, 'id': name} for path, face, name in cluster['outliers']]
+            } for cluster in self.clusters
+        ]}
+
+
+def cluster_faces(json_files, is_label, threshold=0.8, batch_size=4096, progress=None):
+    """Cluster all faces of json_files, see the module docstring.
+
+    Clusters are sorted so the ones that need review (unknown ids or outliers)
+    come first, larger ones before smaller ones.
+    """
+    json_files = list(json_files)
+    centroids = _Centroids()
+    _leader_pass(iter_face_batches(json_files, batch_size), threshold, centroids)
+    if not len(centroids):
+        return ClusterResult([])
+
+    members = [[] for _ in range(len(centroids))]
+    done = 0
+    for faces, ids, vectors in iter_face_batches(json_files, batch_size):
+        best = (vectors @ centroids.normalized().T).argmax(axis=1)
+        for (json_file, face), name, cluster in zip(faces, ids, best):
+            members[cluster].append((json_file, face, name))
+        done += len(faces)
+        if progress:
+            progress(done)
+
+    clusters = []
+    for cluster_members in members:
+        if not cluster_members:
+            continue
+        labels = Counter(name for _, _, name in cluster_members if is_label(name))
+        label, count = labels.most_common(1)[0] if labels else (None, 0)
+        clusters.append({
+            'members': cluster_members,
+            'label': label,
+            'label_share': count / sum(labels.values()) if labels else 0.0,
+            'unknown': [member for member in cluster_members if not is_label(member[2])],
+            'outliers': [member for member in cluster_members if is_label(member[2]) and member[2] != label]
+        })
+
+    clusters.sort(key=lambda c: (not (c['unknown'] or c['outliers']), -len(c['members'])))
+    return ClusterResult(clusters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster all face embeddings of an annotation directory.")
+    parser.add_argument('directory')
+    parser.add_argument('--id-list', default='id_cand_list.txt', help="file with one candidate ID per line")
+    parser.add_argument('--threshold', type=float, default=0.8, help="cosine similarity to join a cluster")
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--output', default='-', help="JSON report file (default: stdout)")
+    args = parser.parse_args()
+
+    with open(args.id_list, 'r', encoding='utf-8') as file:
+        candidates = set(file.read().splitlines())
+
+    json_files = sorted(glob.glob(os.path.join(args.directory, "*.json")))
+    result = cluster_faces(json_files, candidates.__contains__, args.threshold, args.batch_size)
+
+    report = json.dumps(result.to_json(), ensure_ascii=False, indent=4)
+    if args.output == '-':
+        print(report)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""On-disk index of every face of an image directory.
+
+A SQLite file in the directory holds one row per image and one per face, so
+questions like "which images still have unknown ids" or "where does X appear" are
+answered without opening the annotation files. Files are only re-indexed when the
+mtime of their annotation changed since they were last indexed. All writes happen
+on the DatasetIndexer thread, which also re-indexes files saved during a session.
+"""
+import os
+import sqlite3
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .annotation import face_result, json_path_for, load_annotation
+
+INDEX_FILE_NAME = '.face_tool_index.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    json_path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    face_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_json_path ON images(json_path);
+CREATE TABLE IF NOT EXISTS faces (
+    path TEXT NOT NULL,
+    face INTEGER NOT NULL,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL,
+    id TEXT NOT NULL,
+    known INTEGER NOT NULL,
+    PRIMARY KEY (path, face)
+);
+CREATE INDEX IF NOT EXISTS faces_id ON faces(id);
+CREATE INDEX IF NOT EXISTS faces_known ON faces(known, path);
+"""
+
+
+class DatasetIndex:
+    """Connection to the index database of one directory.
+
+    Connections must not be shared between threads; the background indexer opens its
+    own. The database runs in WAL mode, so reads are not blocked while it writes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    @classmethod
+    def for_directory(cls, dir_name):
+        return cls(os.path.join(dir_name, INDEX_FILE_NAME))
+
+    def close(self):
+        self._db.close()
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def mtimes(self):
+        """Image path -> mtime_ns of its annotation when it was indexed."""
+        return dict(self._db.execute("SELECT path, mtime_ns FROM images"))
+
+    def image_for_json(self, json_file):
+        row = self._db.execute("SELECT path FROM images WHERE json_path = ?", (json_file,)).fetchone()
+        return row[0] if row else None
+
+    def update_image(self, img_file, json_file, mtime_ns, doc, is_label):
+        """Replace the rows of one image with the faces of its annotation doc."""
+        result = face_result(doc)
+        faces = [(img_file, i, *bbox, name, is_label(name))
+                 for i, (bbox, name) in enumerate(zip(result['bboxes'], result['ids']))]
+        self._db.execute("DELETE FROM faces WHERE path = ?", (img_file,))
+        self._db.executemany("INSERT INTO faces VALUES (?, ?, ?, ?, ?, ?, ?, ?)", faces)
+        self._db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+                         (img_file, json_file, mtime_ns, len(faces)))
+
+    def index_file(self, img_file, is_label):
+        """(Re)index img_file from its annotation, returns False if there is none."""
+        json_file = json_path_for(img_file)
+        try:
+            mtime_ns = os.stat(json_file).st_mtime_ns
+            doc = load_annotation(json_file)
+        except (OSError, ValueError):
+            self.remove_images([img_file])
+            return False
+        self.update_image(img_file, json_file, mtime_ns, doc, is_label)
+        return True
+
+    def remove_images(self, img_files):
+        self._db.executemany("DELETE FROM faces WHERE path = ?", ((path,) for path in img_files))
+        self._db.executemany("DELETE FROM images WHERE path = ?", ((path,) for path in img_files))
+
+    def set_candidates(self, names):
+        """Recompute which faces are known after the candidate ID list changed."""
+        self._db.execute("CREATE TEMP TABLE IF NOT EXISTS candidates (id TEXT PRIMARY KEY)")
+        self._db.execute("DELETE FROM temp.candidates")
+        self._db.executemany("INSERT OR IGNORE INTO temp.candidates VALUES (?)", ((name,) for name in names))
+        self._db.execute("UPDATE faces SET known = id IN (SELECT id FROM temp.candidates)")
+        self._db.commit()
+
+    def images_with_unknown(self):
+        """Set of image paths with at least one face whose id is not a candidate."""
+        return {path for path, in self._db.execute("SELECT DISTINCT path FROM faces WHERE known = 0")}
+
+    def faces_of(self, name):
+        """(image path, face index) of every face labeled name."""
+        return self._db.execute("SELECT path, face FROM faces WHERE id = ? ORDER BY path, face", (name,)).fetchall()
+
+    def identity_counts(self):
+        """(id, faces, images) per id, most frequent first."""
+        return self._db.execute(
+            "SELECT id, COUNT(*), COUNT(DISTINCT path) FROM faces GROUP BY id ORDER BY COUNT(*) DESC, id"
+        ).fetchall()
+
+
+class DatasetIndexer(QObject):
+    """Brings the index database of a directory up to date on a thread.
+
+    After the initial scan the thread stays and applies reindex() and set_candidates()
+    requests until cancelled, so the GUI never waits for a write transaction.
+    """
+    # Emitted with the number of checked and total files
+    progress = pyqtSignal(int, int)
+    # Emitted with the number of files that had to be (re)indexed
+    finished = pyqtSignal(int)
+
+    # Files indexed per transaction
+    COMMIT_EVERY = 500
+
+    def __init__(self):
+        super().__init__()
+        self._thread = None
+        self._cancelled = threading.Event()
+        self._cond = threading.Condition()
+        self._queued = {}  # Image path -> None, files to re-index in request order
+        self._candidates = None  # Candidate IDs to apply, or None
+        self._idle = False  # Waiting for requests after the initial scan
+
+    def start(self, db_path, img_files, candidates):
+        """Index img_files into db_path, faces are known if their id is in the set candidates."""
+        self.cancel()
+        self._cancelled = threading.Event()
+        with self._cond:
+            self._queued.clear()
+            self._candidates = None
+            self._idle = False
+        self._thread = threading.Thread(target=self._run,
+                                        args=(db_path, list(img_files), frozenset(candidates), self._cancelled),
+                                        name="DatasetIndexer", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def running(self):
+        """True while files are scanned or requests are applied."""
+        with self._cond:
+            return self._thread is not None and self._thread.is_alive() and not self._idle
+
+    def reindex(self, img_file):
+        """Queue img_file to be indexed again, e.g. after its annotation was saved."""
+        with self._cond:
+            self._queued[img_file] = None
+            self._idle = False
+            self._cond.notify_all()
+
+    def set_candidates(self, candidates):
+        """Queue recomputing which faces are known after the candidate IDs changed."""
+        with self._cond:
+            self._candidates = frozenset(candidates)
+            self._idle = False
+            self._cond.notify_all()
+
+    def _run(self, db_path, img_files, candidates, cancelled):
+        is_label = candidates.__contains__
+        index = DatasetIndex(db_path)
+        try:
+            indexed = index.mtimes()
+            present = set()  # Images that still have an annotation
+            updated = 0
+            for i, img_file in enumerate(img_files):
+                if cancelled.is_set():
+                    return
+
+                json_file = json_path_for(img_file)
+                try:
+                    mtime_ns = os.stat(json_file).st_mtime_ns
+                except OSError:
+                    continue
+                present.add(img_file)
+                if indexed.get(img_file) == mtime_ns:
+                    continue
+
+                try:
+                    doc = load_annotation(json_file)
+                except (OSError, ValueError):
+                    continue
+                index.update_image(img_file, json_file, mtime_ns, doc, is_label)
+                updated += 1
+                if updated % DatasetIndexer.COMMIT_EVERY == 0:
+                    index.commit()
+                    self.progress.emit(i, len(img_files))
+
+            # Images that were deleted or lost their annotation
+            index.remove_images([img_file for img_file in indexed if img_file not in present])
+            index.commit()
+            # The candidate list may have been edited since unchanged files were indexed
+            index.set_candidates(candidates)
+
+            self.progress.emit(len(img_files), len(img_files))
+            self.finished.emit(updated)
+            self._serve(index, candidates, cancelled)
+        finally:
+            index.close()
+
+    def _serve(self, index, candidates, cancelled):
+        """Apply reindex() and set_candidates() requests until cancelled."""
+        while True:
+            with self._cond:
+                self._idle = not self._queued and self._candidates is None
+                self._cond.wait_for(lambda: self._queued or self._candidates is not None or cancelled.is_set())
+                if cancelled.is_set():
+                    return
+                img_files, self._queued = list(self._queued), {}
+                new_candidates, self._candidates = self._candidates, None
+
+            try:
+                if new_candidates is not None:
+                    candidates = new_candidates
+                    index.set_candidates(candidates)
+                for img_file in img_files:
+                    index.index_file(img_file, candidates.__contains__)
+                index.commit()
+            except sqlite3.Error:
+                # E.g. locked by another instance; rescanning on the next load catches up
+                index.rollback()
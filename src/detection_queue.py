@@ -0,0 +1,86 @@
+import threading
+from functools import partial
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .face_detect import create_detector, detect_faces
+from .process_pool import process_pool
+
+
+class DetectionQueue(QObject):
+    """Detects faces of the images ahead of the current one on a process pool.
+
+    Every image is detected at most once per directory; images whose annotation was
+    already detected or labeled are skipped by the workers.
+    """
+    # Emitted with image file, normalized boxes, algorithm, model and error message (or '')
+    detected = pyqtSignal(str, list, str, str, str)
+
+    def __init__(self, ahead=20, workers=2):
+        super().__init__()
+        self.ahead = ahead
+        self.workers = workers
+        self._spec = None
+        self._pool = None
+        self._futures = {}  # image file -> Future
+        self._seen = set()  # Image files submitted since the last reset
+        self._lock = threading.RLock()  # Done callbacks of cancelled futures run inside request() and reset()
+
+    def start(self, name, options):
+        """Start detecting with the detector name(**options), raises if it cannot be created."""
+        create_detector(name, **options)
+        self.stop()
+        self._spec = (name, dict(options))
+        self._pool = process_pool(self.workers)
+
+    def stop(self):
+        self.reset()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def running(self):
+        return self._pool is not None
+
+    def reset(self):
+        """Cancel pending work and forget submitted files, e.g. when another directory is loaded."""
+        with self._lock:
+            for future in list(self._futures.values()):
+                future.cancel()
+            self._futures.clear()
+            self._seen.clear()
+
+    def request(self, img_files, idx):
+        """Schedule detection of idx and the images after it, dropping queued work outside that window."""
+        if self._pool is None:
+            return
+        wanted = [img_files[i] for i in range(idx, min(idx + self.ahead + 1, len(img_files)))]
+
+        with self._lock:
+            for img_file in list(self._futures):
+                if img_file not in wanted and self._futures[img_file].cancel():
+                    self._futures.pop(img_file, None)
+                    self._seen.discard(img_file)
+
+            for img_file in wanted:
+                if img_file in self._seen:
+                    continue
+                self._seen.add(img_file)
+                future = self._pool.submit(detect_faces, img_file, self._spec)
+                self._futures[img_file] = future
+                future.add_done_callback(partial(self._done, img_file))
+
+    def _done(self, img_file, future):
+        with self._lock:
+            if self._futures.get(img_file) is not future:
+                return
+            del self._futures[img_file]
+        if future.cancelled():
+            return
+        try:
+            result = future.result()
+        except Exception as e:  # Worker process died, e.g. while the pool shuts down
+            result = img_file, [], None, None, str(e)
+        if result is not None:
+            img_file, boxes, algorithm, model, error = result
+            self.detected.emit(img_file, boxes, algorithm or '', model or '', error or '')
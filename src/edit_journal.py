@@ -0,0 +1,261 @@
+"""Append-only journal of the box and id edits of a session.
+
+Every edit of the current image is appended as one JSON line to a journal file in the
+loaded directory, boxes normalized like in the annotation files:
+
+    {"op": "set_box", "index": 0, "old": [x1, y1, x2, y2], "new": [...], "file": "/data/a.json", "seq": 7}
+    {"op": "insert", "index": 3, "box": [...], "id": "하정우", ...}    also "delete" with the same fields
+    {"op": "set_id", "index": 1, "old": "1063", "new": "하정우", ...}
+
+Lines are written right away and fsync'd in batches by a background thread, so a crash
+loses at most the edits of the last sync interval. The first edit of a file records the
+mtime of its annotation file ("base"); once the annotation file is saved, a "saved"
+record makes the edits up to that sequence number obsolete. Journals of sessions that
+did not end cleanly are replayed by recover_file() on top of the annotation files, and
+a journal that mostly consists of obsolete lines is rewritten with only the unsaved
+edits. Since each edit records the old value as well, inverse() turns it into its undo.
+"""
+import json
+import os
+import threading
+import time
+
+from .annotation import face_result, load_annotation
+from .bbox_store import BBoxStore
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows, journals of other running sessions cannot be told apart then
+
+JOURNAL_PREFIX = '.face_tool_journal_'
+# Appended to journals whose edits could not be recovered, they are kept but not offered again
+FAILED_SUFFIX = '.failed'
+
+# Obsolete lines a journal may hold before it is rewritten
+COMPACT_LINES = 1000
+
+
+def normalize_box(box, width, height):
+    """Pixel box as the normalized list stored in annotations and journals."""
+    return [float(value) / size for value, size in zip(box, (width, height, width, height))]
+
+
+def inverse(edit):
+    """The edit undoing edit."""
+    op = edit['op']
+    if op in ('set_box', 'set_id'):
+        return dict(edit, old=edit['new'], new=edit['old'])
+    return dict(edit, op='delete' if op == 'insert' else 'insert')
+
+
+def apply_edit(store, edit, width=1, height=1):
+    """Apply edit to a BBoxStore in pixels of a width x height image (normalized by default)."""
+    scale = [width, height, width, height]
+    op, idx = edit['op'], edit['index']
+    if op == 'set_box':
+        store.set_box(idx, [value * size for value, size in zip(edit['new'], scale)])
+    elif op == 'insert':
+        store.insert(idx, [value * size for value, size in zip(edit['box'], scale)], edit['id'])
+    elif op == 'delete':
+        store.delete(idx)
+    elif op == 'set_id':
+        store.set_id(idx, edit['new'])
+    else:
+        raise ValueError(f"Unknown edit {op!r}")
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _fold(files, record):
+    """Update files (JSON path -> {'base': mtime, 'edits': [...]}) with one journal record."""
+    json_file, op = record['file'], record['op']
+    entry = files.get(json_file)
+    if op == 'base':
+        if entry is None:
+            files[json_file] = {'base': record['mtime_ns'], 'edits': []}
+    elif op == 'saved':
+        if entry is not None:
+            entry['edits'] = [edit for edit in entry['edits'] if edit['seq'] > record['seq']]
+            entry['base'] = record['mtime_ns']
+            if not entry['edits']:
+                del files[json_file]
+    else:
+        if entry is None:
+            files[json_file] = entry = {'base': None, 'edits': []}
+        entry['edits'].append(record)
+
+
+class EditJournal:
+    """Journal file of one session, see the module documentation."""
+
+    def __init__(self, dir_name, sync_interval=1.0):
+        self.path = os.path.join(dir_name, f"{JOURNAL_PREFIX}{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.jsonl")
+        self.sync_interval = sync_interval
+        self._file = self._open()
+        self._files = {}  # JSON path -> unsaved edits, see _fold
+        self._seq = 0
+        self._lines = 0  # Lines in the journal file
+        self._unsynced = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="EditJournal", daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        file = open(self.path, 'a', encoding='utf-8')
+        if fcntl is not None:
+            # Held while the session runs, so other instances do not recover its edits
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return file
+
+    def append(self, json_file, edit):
+        """Record an edit of json_file, returns its sequence number."""
+        with self._cond:
+            if json_file not in self._files:
+                self._write({'op': 'base', 'file': json_file, 'mtime_ns': _mtime_ns(json_file)})
+            self._seq += 1
+            self._write(dict(edit, file=json_file, seq=self._seq))
+            return self._seq
+
+    def last_seq(self):
+        with self._cond:
+            return self._seq
+
+    def saved(self, json_file, seq):
+        """Mark the edits of json_file up to seq as written to its annotation file."""
+        with self._cond:
+            if json_file in self._files:
+                self._write({'op': 'saved', 'file': json_file, 'seq': seq, 'mtime_ns': _mtime_ns(json_file)})
+
+    def unsaved_count(self):
+        with self._cond:
+            return sum(len(entry['edits']) for entry in self._files.values())
+
+    def close(self):
+        """Sync and close the journal, which is deleted if it holds no unsaved edits."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        if not self._files:
+            retire_journal(self.path)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        _fold(self._files, record)
+        self._lines += 1
+        self._unsynced = True
+        self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._unsynced or self._closed)
+                # Edits of the next interval share one fsync
+                self._cond.wait_for(lambda: self._closed, self.sync_interval)
+                if self._closed:
+                    return  # close() syncs
+                self._file.flush()
+                self._unsynced = False
+                fd = self._file.fileno()
+                live = sum(len(entry['edits']) + 1 for entry in self._files.values())
+                compact = self._lines - live >= COMPACT_LINES
+            try:
+                os.fsync(fd)
+                if compact:
+                    with self._cond:
+                        self._compact()
+            except OSError:
+                pass  # E.g. a full disk, the next sync tries again
+
+    def _compact(self):
+        """Rewrite the journal with only the unsaved edits."""
+        records = []
+        for json_file, entry in self._files.items():
+            records.append({'op': 'base', 'file': json_file, 'mtime_ns': entry['base']})
+            records.extend(entry['edits'])
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        self._file.close()
+        self._file = self._open()
+        self._lines = len(records)
+
+
+def find_journals(dir_name):
+    """Journal files in dir_name that no running session holds, oldest first."""
+    try:
+        names = sorted(name for name in os.listdir(dir_name)
+                       if name.startswith(JOURNAL_PREFIX) and name.endswith('.jsonl'))
+    except OSError:
+        return []
+
+    journals = []
+    for name in names:
+        path = os.path.join(dir_name, name)
+        if fcntl is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue  # Held by a running session
+        journals.append(path)
+    return journals
+
+
+def retire_journal(path, failed=False):
+    """Delete a recovered or discarded journal, or set one that failed aside. Returns False on errors."""
+    try:
+        if failed:
+            os.replace(path, path + FAILED_SUFFIX)
+        else:
+            os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+def read_journal(path):
+    """Unsaved edits of a journal file, {JSON path: (base mtime or None, [edits])}."""
+    files = {}
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # Torn last line of a crash
+            _fold(files, record)
+    return {json_file: (entry['base'], entry['edits']) for json_file, entry in files.items()}
+
+
+def recover_file(json_file, base, edits):
+    """Annotation document of json_file with edits replayed.
+
+    Raises ValueError if the file changed since the edits were made, IndexError if they
+    do not fit its boxes.
+    """
+    if base is not None and _mtime_ns(json_file) != base:
+        raise ValueError("Changed since the edits were made")
+
+    doc = load_annotation(json_file)
+    result = face_result(doc)
+    store = BBoxStore.from_normalized(result['bboxes'], result['ids'], 1, 1)
+    for edit in edits:
+        apply_edit(store, edit)
+    result['bboxes'] = store.to_normalized(1, 1)
+    doc['dataset_info']['attributes']['answer_refined'] = True
+    return doc
@@ -0,0 +1,132 @@
+"""Binary sidecar storage for face embeddings.
+
+In sidecar mode ``result.embeddings`` no longer holds the vectors as JSON text.
+It holds a small reference instead:
+
+    {"sidecar": "multiface.embeddings.npy", "dtype": "float32", "shape": [6, 8631]}
+
+and the vectors live in a ``.npy`` file next to the JSON which is opened as a
+memory map. Loading or saving an annotation then only touches the bbox/id
+metadata. Use ``python -m src.embedding_store`` to migrate a directory.
+"""
+import argparse
+import glob
+import os
+
+from .annotation import face_result, load_annotation, load_embedding_list, write_annotation
+from .lazy_import import LazyModule
+
+np = LazyModule('numpy')
+
+SIDECAR_SUFFIX = ".embeddings.npy"
+
+
+def is_sidecar_ref(embeddings):
+    """True if the embeddings field is a reference to a sidecar file."""
+    return isinstance(embeddings, dict) and 'sidecar' in embeddings
+
+
+def sidecar_path(json_file, ref):
+    """Absolute path of the sidecar file referenced from json_file."""
+    return os.path.join(os.path.dirname(json_file), ref['sidecar'])
+
+
+def load_embeddings(json_file, doc):
+    """Return the embeddings of a document as an (N, D) array.
+
+    Sidecar embeddings are memory-mapped read-only, inline embeddings are
+    converted from the JSON lists.
+    """
+    embeddings = load_embedding_list(doc)
+    if is_sidecar_ref(embeddings):
+        return np.load(sidecar_path(json_file, embeddings), mmap_mode='r')
+
+    if len(embeddings) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def _write_array(npy_file, array):
+    """Atomically write array to npy_file."""
+    tmp_file = f"{npy_file}.tmp"
+    # np.save appends ".npy" to names without that extension, so save through a file object
+    with open(tmp_file, 'wb') as file:
+        np.save(file, array)
+    os.replace(tmp_file, npy_file)
+
+
+def to_sidecar(json_file, dtype='float32'):
+    """Move inline embeddings of one document into a sidecar file.
+
+    Returns False if the document already uses a sidecar.
+    """
+    doc = load_annotation(json_file)
+    result = face_result(doc)
+    if is_sidecar_ref(result['embeddings']):
+        return False
+
+    embeddings = load_embedding_list(doc)
+    array = np.asarray(embeddings, dtype=dtype)
+    if array.ndim != 2:
+        array = array.reshape(len(embeddings), 0)
+
+    file_root = os.path.splitext(os.path.basename(json_file))[0]
+    ref = {
+        'sidecar': f"{file_root}{SIDECAR_SUFFIX}",
+        'dtype': array.dtype.name,
+        'shape': list(array.shape)
+    }
+
+    _write_array(sidecar_path(json_file, ref), array)
+
+    result['embeddings'] = ref
+    write_annotation(json_file, doc)
+    return True
+
+
+def to_inline(json_file):
+    """Move sidecar embeddings of one document back into the JSON.
+
+    Returns False if the document already stores its embeddings inline.
+    """
+    doc = load_annotation(json_file)
+    result = face_result(doc)
+    ref = result['embeddings']
+    if not is_sidecar_ref(ref):
+        return False
+
+    npy_file = sidecar_path(json_file, ref)
+    # str() of a float32 scalar is its shortest round-tripping repr (-0.1209, not -0.120899997...)
+    result['embeddings'] = [[float(str(value)) for value in row] for row in np.load(npy_file)]
+    write_annotation(json_file, doc)
+    os.remove(npy_file)
+    return True
+
+
+def convert_directory(dir_name, mode, dtype='float32'):
+    """Convert every annotation in dir_name, returns the number of changed files."""
+    changed = 0
+    for json_file in sorted(glob.glob(os.path.join(dir_name, "*.json"))):
+        if mode == 'sidecar':
+            changed += to_sidecar(json_file, dtype)
+        else:
+            changed += to_inline(json_file)
+
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert embedding storage of an annotation directory.")
+    parser.add_argument('mode', choices=['sidecar', 'inline'],
+                        help="sidecar: move embeddings into .npy files, inline: move them back into the JSON")
+    parser.add_argument('directory')
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'float16', 'float64'],
+                        help="sidecar element type (default: float32)")
+    args = parser.parse_args()
+
+    changed = convert_directory(args.directory, args.mode, args.dtype)
+    print(f"Converted {changed} file(s)")
+
+
+if __name__ == "__main__":
+    main()
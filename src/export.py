@@ -0,0 +1,199 @@
+"""Export of face crops and a manifest for training jobs.
+
+Every annotated image below a directory is cropped on a process pool: each box is
+padded, made square and optionally resized. The crops mirror the directory layout of
+the source, the manifest is written as JSON lines while the results stream in:
+
+    {"crop": "a/img_0.jpg", "id": "하정우", "image": "a/img.jpg", "bbox": [x1, y1, x2, y2], "embedding": 0}
+
+bbox is in pixels of the source image. With --embeddings the vectors are appended to
+embeddings.f32 (raw float32 rows) and "embedding" is the row of the face, or null if
+it has none; export.json records the settings and the embedding size.
+
+    python -m src.export <dir> <out dir> [--padding 0.2] [--size 112] [--embeddings] [--workers N]
+"""
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from functools import partial
+
+import cv2
+import numpy as np
+
+from .annotation import face_result, json_path_for, load_annotation
+from .bbox_store import BBoxStore
+from .embedding_store import load_embeddings
+from .file_scanner import is_image
+from .image_pyramid import LEVELS, decode_array
+from .process_pool import process_pool
+
+MANIFEST_FILE = 'manifest.jsonl'
+EMBEDDINGS_FILE = 'embeddings.f32'
+SUMMARY_FILE = 'export.json'
+JPEG_QUALITY = 95
+
+
+def annotated_images(root):
+    """Paths of all images below root that have an annotation, relative to root, sorted."""
+    img_files = []
+    for dir_name, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if not name.startswith('.')]
+        names = set(file_names)
+        for name in file_names:
+            if is_image(name) and os.path.basename(json_path_for(name)) in names:
+                img_files.append(os.path.relpath(os.path.join(dir_name, name), root))
+    return sorted(img_files)
+
+
+def crop_square(image, box, padding):
+    """Square crop around box, grown by padding times its size on each side, filled black outside image."""
+    x1, y1, x2, y2 = box
+    side = max(x2 - x1, y2 - y1) * (1 + 2 * padding)
+    left, top = int(round((x1 + x2 - side) / 2)), int(round((y1 + y2 - side) / 2))
+    right, bottom = left + max(int(round(side)), 1), top + max(int(round(side)), 1)
+
+    height, width = image.shape[:2]
+    crop = image[max(top, 0):min(bottom, height), max(left, 0):min(right, width)]
+    return cv2.copyMakeBorder(crop, max(-top, 0), max(bottom - height, 0), max(-left, 0), max(right - width, 0),
+                              cv2.BORDER_CONSTANT, value=(0, 0, 0))
+
+
+def _reduction(boxes, padding, size):
+    """Coarsest decoding level at which every crop is still at least size pixels wide."""
+    if not size or not len(boxes):
+        return 1
+    smallest = (np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) * (1 + 2 * padding)).min()
+    return max([factor for factor in LEVELS if smallest / factor >= size] or [1])
+
+
+def export_image(img_rel, root, out_dir, padding=0.2, size=None, embeddings=False):
+    """Write the crops of one image.
+
+    Returns (img_rel, [(crop path, id, [x1, y1, x2, y2], embedding or None)], error message or None),
+    crop paths relative to out_dir.
+    """
+    img_file = os.path.join(root, img_rel)
+    json_file = json_path_for(img_file)
+    try:
+        doc = load_annotation(json_file)
+        result = face_result(doc)
+        attributes = doc['image_info']['attributes']
+        width, height = attributes['image_width'], attributes['image_height']
+        # Same pixel boxes the GUI edits
+        store = BBoxStore.from_normalized(result['bboxes'], list(result['ids']), width, height)
+        if not len(store):
+            return img_rel, [], None
+
+        factor = _reduction(store.boxes, padding, size)
+        image = decode_array(img_file, factor)
+        if image is None:
+            raise OSError(f"Cannot decode {img_file}")
+        # Scale from annotation pixels to decoded pixels, which also absorbs a stale image size
+        scale = np.array([image.shape[1] / width, image.shape[0] / height] * 2)
+
+        vectors = load_embeddings(json_file, doc) if embeddings else None
+
+        root_name = os.path.splitext(img_rel)[0]
+        os.makedirs(os.path.join(out_dir, os.path.dirname(img_rel)), exist_ok=True)
+        faces = []
+        for i, (box, name) in enumerate(zip(store.boxes, store.ids)):
+            crop = crop_square(image, box * scale, padding)
+            if size:
+                crop = cv2.resize(crop, (size, size), interpolation=cv2.INTER_AREA)
+            crop_rel = f"{root_name}_{i}.jpg"
+            # imencode and tofile instead of imwrite, which cannot write non-ASCII paths on every platform
+            ok, data = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ok:
+                raise ValueError(f"Cannot encode {crop_rel}")
+            data.tofile(os.path.join(out_dir, crop_rel))
+
+            vector = None
+            if vectors is not None and i < len(vectors) and vectors.shape[1]:
+                vector = np.asarray(vectors[i], dtype=np.float32)
+            faces.append((crop_rel, name, [round(float(value), 2) for value in box], vector))
+        return img_rel, faces, None
+    except (OSError, ValueError, KeyError, TypeError, cv2.error) as e:
+        return img_rel, [], str(e)
+
+
+def _bounded_map(pool, worker, items, window):
+    """pool.map that keeps at most window results in flight, so memory stays bounded."""
+    futures = deque()
+    for item in items:
+        futures.append(pool.submit(worker, item))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def export(root, out_dir, img_files, padding=0.2, size=None, embeddings=False, workers=None, progress=None):
+    """Export the crops of img_files (relative to root), returns (crop count, [(image, error)])."""
+    os.makedirs(out_dir, exist_ok=True)
+    worker = partial(export_image, root=root, out_dir=out_dir, padding=padding, size=size, embeddings=embeddings)
+    count, errors = 0, []
+    dim = None  # Embedding size, set by the first face that has an embedding
+    rows = 0
+    window = 4 * (workers or os.cpu_count() or 1)
+
+    embeddings_file = open(os.path.join(out_dir, EMBEDDINGS_FILE), 'wb') if embeddings else None
+    try:
+        with open(os.path.join(out_dir, MANIFEST_FILE), 'w', encoding='utf-8') as manifest, \
+                process_pool(workers) as pool:
+            for done, (img_rel, faces, error) in enumerate(_bounded_map(pool, worker, img_files, window), 1):
+                if error:
+                    errors.append((img_rel, error))
+                for crop_rel, name, bbox, vector in faces:
+                    entry = {'crop': crop_rel, 'id': name, 'image': img_rel, 'bbox': bbox}
+                    if embeddings:
+                        entry['embedding'] = None
+                        if vector is not None and dim in (None, len(vector)):
+                            dim = len(vector)
+                            embeddings_file.write(vector.tobytes())
+                            entry['embedding'] = rows
+                            rows += 1
+                    manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    count += 1
+                if progress and done % 1000 == 0:
+                    progress(done, len(img_files))
+    finally:
+        if embeddings_file is not None:
+            embeddings_file.close()
+
+    summary = {
+        'source': os.path.abspath(root),
+        'padding': padding,
+        'size': size,
+        'crops': count,
+        'embeddings': {'file': EMBEDDINGS_FILE, 'dtype': 'float32', 'shape': [rows, dim or 0]} if embeddings else None
+    }
+    with open(os.path.join(out_dir, SUMMARY_FILE), 'w', encoding='utf-8') as file:
+        json.dump(summary, file, ensure_ascii=False, indent=4)
+    if progress:
+        progress(len(img_files), len(img_files))
+    return count, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export face crops and a manifest of all annotated images.")
+    parser.add_argument('directory')
+    parser.add_argument('out_dir')
+    parser.add_argument('--padding', type=float, default=0.2, help="margin around each box relative to its size")
+    parser.add_argument('--size', type=int, default=None, help="edge length of the crops (default: unscaled)")
+    parser.add_argument('--embeddings', action='store_true', help=f"also write the embeddings to {EMBEDDINGS_FILE}")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    img_files = annotated_images(args.directory)
+    count, errors = export(args.directory, args.out_dir, img_files, args.padding, args.size, args.embeddings,
+                           args.workers, lambda done, total: print(f"{done}/{total}", end='\r', file=sys.stderr))
+    print(file=sys.stderr)
+    print(f"Exported {count} crop(s) of {len(img_files)} image(s)")
+    for img_rel, error in errors:
+        print(f"  error {img_rel}: {error}")
+
+
+if __name__ == "__main__":
+    main()
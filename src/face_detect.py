@@ -0,0 +1,154 @@
+"""Offline face detection with the detectors bundled with OpenCV.
+
+Detectors are registered in DETECTORS by name and created from a picklable spec
+(name, options), so worker processes can build their own instance:
+
+- 'haar': Haar cascade (haarcascade_frontalface_default.xml of the OpenCV install,
+  or options['model']). Its score is the cascade's level weight.
+- 'dnn': ResNet-10 SSD Caffe model (options['model'] = .caffemodel,
+  options['config'] = deploy.prototxt). Its score is the detection confidence.
+
+Boxes are returned normalized like the annotation bboxes.
+"""
+import glob
+import os
+import sys
+
+from .annotation import NEW_BOX_ID, face_result, json_path_for, load_annotation
+from .image_probe import image_size
+from .image_pyramid import LEVELS, decode_array
+from .lazy_import import LazyModule
+
+cv2 = LazyModule('cv2')
+np = LazyModule('numpy')
+
+# Images are reduced while their longer side stays at least this long
+DETECT_SIZE = 1280
+
+HAAR_CASCADE = 'haarcascade_frontalface_default.xml'
+
+
+def _find_cascade():
+    """Path of the frontal face cascade of the OpenCV install."""
+    dirs = []
+    if hasattr(cv2, 'data'):
+        dirs.append(cv2.data.haarcascades)
+    for share in ('OpenCV', 'opencv4', 'opencv'):
+        dirs.append(os.path.join(sys.prefix, 'share', share, 'haarcascades'))
+        dirs.append(os.path.join(sys.prefix, 'Library', 'etc', 'haarcascades'))
+    for dir_name in dirs:
+        path = os.path.join(dir_name, HAAR_CASCADE)
+        if os.path.exists(path):
+            return path
+    matches = glob.glob(os.path.join(sys.prefix, '**', HAAR_CASCADE), recursive=True)
+    if matches:
+        return matches[0]
+    raise FileNotFoundError(f"{HAAR_CASCADE} not found, pass its path as model")
+
+
+class HaarDetector:
+    algorithm = 'opencv_haar_cascade'
+
+    def __init__(self, model=None, threshold=None, min_size=0.03):
+        self.model = model or _find_cascade()
+        self.threshold = threshold
+        self.min_size = min_size  # Smallest face relative to the shorter image side
+        self._cascade = cv2.CascadeClassifier(self.model)
+        if self._cascade.empty():
+            raise ValueError(f"Cannot load cascade {self.model}")
+
+    def detect(self, image):
+        """[(x1, y1, x2, y2, score)] in pixels of image."""
+        gray = cv2.equalizeHist(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        side = max(int(min(gray.shape) * self.min_size), 20)
+        rects, _, weights = self._cascade.detectMultiScale3(gray, scaleFactor=1.1, minNeighbors=5,
+                                                            minSize=(side, side), outputRejectLevels=True)
+        faces = []
+        for (x, y, w, h), weight in zip(rects, np.ravel(weights)):
+            if self.threshold is None or weight >= self.threshold:
+                faces.append((x, y, x + w, y + h, float(weight)))
+        return faces
+
+
+class DnnDetector:
+    algorithm = 'opencv_dnn_ssd'
+
+    def __init__(self, model, config, threshold=0.5, input_size=300):
+        self.model = model
+        self.threshold = 0.5 if threshold is None else threshold
+        self.input_size = input_size
+        self._net = cv2.dnn.readNetFromCaffe(config, model)
+
+    def detect(self, image):
+        """[(x1, y1, x2, y2, score)] in pixels of image."""
+        height, width = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, (self.input_size, self.input_size)), 1.0,
+                                     (self.input_size, self.input_size), (104.0, 177.0, 123.0))
+        self._net.setInput(blob)
+        detections = self._net.forward()[0, 0]
+        detections = detections[detections[:, 2] >= self.threshold]
+        boxes = np.clip(detections[:, 3:7], 0, 1) * [width, height, width, height]
+        return [(*box, float(score)) for box, score in zip(boxes.tolist(), detections[:, 2])]
+
+
+DETECTORS = {
+    'haar': HaarDetector,
+    'dnn': DnnDetector
+}
+
+_instances = {}  # Detectors created in this process, by spec
+
+
+def create_detector(name, **options):
+    return DETECTORS[name](**options)
+
+
+def _detector(spec):
+    key = repr(spec)
+    if key not in _instances:
+        name, options = spec
+        _instances[key] = create_detector(name, **options)
+    return _instances[key]
+
+
+def detect_faces(img_file, spec):
+    """Detect the faces of img_file with the detector of spec = (name, options).
+
+    Returns (img_file, normalized [x1, y1, x2, y2] boxes, algorithm, model, error), or
+    None if img_file already has an annotation that needs no detection.
+    """
+    try:
+        json_file = json_path_for(img_file)
+        if os.path.exists(json_file) and not needs_detection(load_annotation(json_file)):
+            return None
+
+        detector = _detector(spec)
+        width, height = image_size(img_file)
+        factor = max([factor for factor in LEVELS if max(width, height) / factor >= DETECT_SIZE] or [1])
+        image = decode_array(img_file, factor)
+        if image is None:
+            raise OSError(f"Cannot decode {img_file}")
+
+        faces = detector.detect(image)
+        scale = np.array([image.shape[1], image.shape[0]] * 2, dtype=np.float64)
+        boxes = [(np.array(face[:4]) / scale).tolist() for face in faces]
+        return img_file, boxes, detector.algorithm, os.path.basename(detector.model), None
+    except (OSError, ValueError, KeyError, cv2.error) as e:
+        return img_file, [], None, None, str(e)
+
+
+def needs_detection(doc):
+    """Whether doc was never detected nor labeled."""
+    algorithm = doc['object_info']['face'].get('algorithm', {})
+    return (not face_result(doc)['bboxes'] and not algorithm.get('face_detect_algorithm')
+            and doc['dataset_info']['attributes']['answer_refined'] is not True)
+
+
+def set_detection(doc, boxes, algorithm, model):
+    """Store detected boxes (with unlabeled ids) and the detector in doc."""
+    result = face_result(doc)
+    result['bboxes'] = [list(box) for box in boxes]
+    result['ids'] = [NEW_BOX_ID] * len(boxes)
+    for block in (doc['object_info']['face'].setdefault('algorithm', {}), doc['object_info']):
+        block['face_detect_algorithm'] = algorithm
+        block['face_detect_model'] = model
@@ -0,0 +1,101 @@
+import os
+from bisect import bisect_left
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt
+
+from .file_scanner import natural_key
+
+
+class FileListModel(QAbstractListModel):
+    """Naturally sorted image files of one directory, filled while the directory is scanned.
+
+    Only file names and their sort keys are kept; the directory is stored once. The
+    model can be used like a list of absolute paths (len, indexing, iteration).
+    With a ThumbnailLoader set, rows are decorated with the thumbnails it has loaded.
+    """
+
+    def __init__(self, dir_name, parent=None):
+        super().__init__(parent)
+        self.dir_name = dir_name
+        self._keys = []  # Natural sort key of each row, see file_scanner.natural_key
+        self._names = []  # File name of each row
+        self.thumbnails = None  # ThumbnailLoader providing the row decorations, or None
+
+    def set_thumbnails(self, loader):
+        """Decorate rows with the thumbnails of loader (None to show names only)."""
+        if self.thumbnails is not None:
+            self.thumbnails.thumbnailReady.disconnect(self._thumbnail_ready)
+        self.thumbnails = loader
+        if loader is not None:
+            loader.thumbnailReady.connect(self._thumbnail_ready)
+        if self._names:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self._names) - 1, 0), [Qt.DecorationRole])
+
+    def _thumbnail_ready(self, img_file):
+        if os.path.dirname(img_file) == self.dir_name:
+            row = self.index_of(img_file)
+            if row is not None:
+                self.dataChanged.emit(self.index(row, 0), self.index(row, 0), [Qt.DecorationRole])
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, row):
+        return os.path.join(self.dir_name, self._names[row])
+
+    def __iter__(self):
+        return (os.path.join(self.dir_name, name) for name in self._names)
+
+    def index_of(self, img_file):
+        """Row of img_file or None."""
+        name = os.path.basename(img_file)
+        row = bisect_left(self._keys, natural_key(name))
+        if row < len(self._keys) and self._names[row] == name:
+            return row
+        return None
+
+    def add_files(self, entries):
+        """Merge [(natural key, file name)] into the sorted rows.
+
+        Views keep their current and selected files, persistent indexes are moved
+        along with the rows they point to.
+        """
+        if not entries:
+            return
+        entries = sorted(entries)
+
+        if not self._keys or entries[0][0] > self._keys[-1]:
+            # Common case of an already sorted listing, simply append
+            self.beginInsertRows(QModelIndex(), len(self._keys), len(self._keys) + len(entries) - 1)
+            self._keys.extend(key for key, _ in entries)
+            self._names.extend(name for _, name in entries)
+            self.endInsertRows()
+            return
+
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        old_keys = [self._keys[index.row()] for index in persistent]
+
+        # Both lists are sorted, which timsort merges in linear time
+        merged = sorted(list(zip(self._keys, self._names)) + entries)
+        self._keys = [key for key, _ in merged]
+        self._names = [name for _, name in merged]
+
+        self.changePersistentIndexList(
+            persistent, [self.createIndex(bisect_left(self._keys, key), 0) for key in old_keys])
+        self.layoutChanged.emit()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole, Qt.DecorationRole):
+            return None
+        if role == Qt.DecorationRole:
+            if self.thumbnails is None:
+                return None
+            image = self.thumbnails.thumbnail(self[index.row()])
+            return image if image is not None and not image.isNull() else None
+        if role == Qt.ToolTipRole:
+            return self[index.row()]
+        return self._names[index.row()]
@@ -0,0 +1,85 @@
+"""Streaming scan of an image directory.
+
+os.scandir yields entries as the directory is read, so the file list can be filled
+batch by batch while a large directory is still being listed.
+"""
+import os
+import re
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+IMAGE_EXTENSIONS = frozenset(['.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'])
+
+_DIGITS = re.compile('([0-9]+)')
+
+
+def natural_key(name):
+    """Sort key ordering the numbers within name numerically, e.g. img2 before img10.
+
+    Splitting always yields text at even and numbers at odd positions, so keys of any
+    two names compare without mixing str and int. The name itself breaks ties between
+    names that only differ in case or leading zeros.
+    """
+    chunks = _DIGITS.split(name)
+    return tuple(int(chunk) if i % 2 else chunk.lower() for i, chunk in enumerate(chunks)), name
+
+
+def is_image(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+class FileScanner(QObject):
+    """Lists the images of a directory on a thread, emitting them in batches."""
+    # Emitted with a list of (natural key, file name) per batch
+    batchFound = pyqtSignal(list)
+    # Emitted with the number of images found once the directory was read completely
+    finished = pyqtSignal(int)
+
+    BATCH_SIZE = 2000
+
+    def __init__(self):
+        super().__init__()
+        self._thread = None
+        self._cancelled = threading.Event()
+
+    def start(self, dir_name):
+        """Scan dir_name, cancelling a scan still running."""
+        self.cancel()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(dir_name, self._cancelled),
+                                        name="FileScanner", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self, dir_name, cancelled):
+        batch, count = [], 0
+        try:
+            with os.scandir(dir_name) as entries:
+                for entry in entries:
+                    if cancelled.is_set():
+                        return
+                    if not is_image(entry.name) or not entry.is_file():
+                        continue
+                    batch.append((natural_key(entry.name), entry.name))
+                    if len(batch) >= FileScanner.BATCH_SIZE:
+                        self.batchFound.emit(batch)
+                        count += len(batch)
+                        batch = []
+        except OSError:
+            # Unreadable directory, report what was found so far
+            pass
+
+        if batch and not cancelled.is_set():
+            self.batchFound.emit(batch)
+            count += len(batch)
+        if not cancelled.is_set():
+            self.finished.emit(count)
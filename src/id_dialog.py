@@ -1,46 +1,65 @@
-from PyQt5 import QtGui, uic
 from PyQt5.QtWidgets import QDialog, QAbstractItemView
-from PyQt5.QtGui import QStandardItem, QStandardItemModel
+
+from .id_list_model import IDListModel
+from .ui_loader import setup_ui
 
 
 class IDDialog(QDialog):
+    """Dialog choosing the id of the selected box, created once and reused by edit_box()."""
+
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
 
-        uic.loadUi("id_dialog.ui", self)
+        setup_ui(self, 'id_dialog')
 
         self.idList.setEditTriggers(QAbstractItemView.NoEditTriggers)  # Make list non-editable
+        self.idList.setUniformItemSizes(True)  # Lets the view skip measuring every row
         self.idList.selectionChanged = self.selection_changed
         self.idFilter.textChanged.connect(self.text_changed)
 
-        with open('id_cand_list.txt', 'r') as file:  # TODO don't hardcode list path
-            self.items = file.read().splitlines()
+        self.model = IDListModel(self.parent.id_registry.search_index(), (), self)
+        self.update_ui()
+
+    def edit_box(self):
+        """Show the candidates for the selected box of the main window and run the dialog."""
+        # Most similar known faces first, so a suggestion only has to be confirmed
+        pinned = [(name, f"{name} ({score:.2f})")
+                  for name, score in self.parent.box_suggestions(self.parent.img_bbox_idx)]
 
         # Add current id if not present in list
-        if self.parent.img_ids[self.parent.img_bbox_idx] not in self.items:
-            self.items.insert(0, self.parent.img_ids[self.parent.img_bbox_idx])
+        current_id = self.parent.img_ids[self.parent.img_bbox_idx]
+        if current_id not in self.parent.id_registry:
+            pinned.insert(0, (current_id, current_id))
 
-        self.update_ui()
+        # The filter of the last box must not be applied to the new list
+        self.idFilter.blockSignals(True)
+        self.idFilter.clear()
+        self.idFilter.blockSignals(False)
+        self.model.reset(self.parent.id_registry.search_index(), pinned)
+        self.idList.scrollToTop()
+        self.idFilter.setFocus()
+        return self.exec_()
 
     def update_ui(self):
         """Update all ui elements."""
-        model = QStandardItemModel()
-        for item in self.items:
-            model.appendRow(QStandardItem(item))
-
-        self.idList.setModel(model)
+        self.idList.setModel(self.model)
 
     def selection_changed(self, selected, _):
         """Set img id to current selected item in list."""
         if len(selected.indexes()) > 0:
-            self.parent.img_ids[self.parent.img_bbox_idx] = self.items[selected.indexes()[0].row()]
+            idx = self.parent.img_bbox_idx
+            old, new = self.parent.img_ids[idx], self.model.name(selected.indexes()[0].row())
+            if new != old:
+                self.parent.img_ids[idx] = new
+                # Marks the image dirty, choosing the current id again does not
+                self.parent.record_edit({'op': 'set_id', 'index': idx, 'old': old, 'new': new})
             self.parent.update_id_list_ui()
+            self.parent.imgWidget.invalidate_overlay()
 
     def text_changed(self, text):
         """Filter img list for specific string."""
         if text.isspace():
             return
 
-        for (i, item) in enumerate(self.items):
-            self.idList.setRowHidden(i, text.lower() not in item.lower())
+        self.model.set_filter(text)
@@ -0,0 +1,73 @@
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt
+
+from .id_search import normalize
+
+
+class IDListModel(QAbstractListModel):
+    """List model showing the matches of an IDSearchIndex for the current filter.
+
+    Pinned names (e.g. the current id or suggestions) are shown before the indexed
+    names. Rows are handed to the view in batches (canFetchMore/fetchMore), so even an
+    unfiltered list of 50k names costs only what is visible.
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self, search_index, pinned=(), parent=None):
+        super().__init__(parent)
+        self.search_index = search_index
+        self.pinned = list(pinned)  # (name, display text) shown before the indexed names
+
+        self._pinned_rows = list(self.pinned)
+        self._rows = self.search_index.search('')
+        self._fetched = 0
+        self._fetch_first_batch()
+
+    def _fetch_first_batch(self):
+        self._fetched = min(len(self._pinned_rows) + len(self._rows), IDListModel.BATCH_SIZE)
+
+    def name(self, row):
+        """ID shown at row."""
+        if row < len(self._pinned_rows):
+            return self._pinned_rows[row][0]
+        return self.search_index.names[self._rows[row - len(self._pinned_rows)]]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._fetched
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        if index.row() < len(self._pinned_rows):
+            return self._pinned_rows[index.row()][1]
+        return self.name(index.row())
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._fetched < len(self._pinned_rows) + len(self._rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        total = len(self._pinned_rows) + len(self._rows)
+        count = min(IDListModel.BATCH_SIZE, total - self._fetched)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._fetched, self._fetched + count - 1)
+        self._fetched += count
+        self.endInsertRows()
+
+    def reset(self, search_index, pinned=()):
+        """Show the unfiltered names of another search index and pinned list."""
+        self.beginResetModel()
+        self.search_index = search_index
+        self.pinned = list(pinned)
+        self._pinned_rows = list(self.pinned)
+        self._rows = self.search_index.search('')
+        self._fetch_first_batch()
+        self.endResetModel()
+
+    def set_filter(self, text):
+        """Show only names containing text."""
+        self.beginResetModel()
+        key = normalize(text.strip())
+        self._pinned_rows = [row for row in self.pinned if key in normalize(row[0])]
+        self._rows = self.search_index.search(text)
+        self._fetch_first_batch()
+        self.endResetModel()
@@ -0,0 +1,87 @@
+import os
+
+from PyQt5.QtCore import QFileSystemWatcher, QObject, pyqtSignal
+
+from .id_search import IDSearchIndex
+
+
+class IDRegistry(QObject):
+    """Candidate ID list, read once and reloaded only after the file changed.
+
+    Membership tests use a set, so they stay O(1) for very long lists.
+    """
+    # Emitted when the file changed on disk, the list itself is reloaded on next access
+    changed = pyqtSignal()
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = os.path.abspath(path)
+
+        self._names = []  # IDs in file order
+        self._name_set = frozenset()
+        self._search_index = None  # Built on first use, dropped on reload
+        self._mtime = None
+        self._stale = True
+
+        # Editors often replace the file instead of writing it, so the directory is watched too
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.addPath(os.path.dirname(self.path))
+        self._watcher.fileChanged.connect(self._path_changed)
+        self._watcher.directoryChanged.connect(self._path_changed)
+
+    def __contains__(self, name):
+        self._reload_if_stale()
+        return name in self._name_set
+
+    def __len__(self):
+        self._reload_if_stale()
+        return len(self._names)
+
+    @property
+    def names(self):
+        """All IDs in file order, do not modify."""
+        self._reload_if_stale()
+        return self._names
+
+    @property
+    def name_set(self):
+        """All IDs as a frozenset, safe to hand to other threads."""
+        self._reload_if_stale()
+        return self._name_set
+
+    def search_index(self):
+        """IDSearchIndex over names, built once per version of the file."""
+        self._reload_if_stale()
+        if self._search_index is None:
+            self._search_index = IDSearchIndex(self._names)
+        return self._search_index
+
+    def reload(self):
+        """Read the list from disk, a missing file gives an empty list."""
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self._names = file.read().splitlines()
+        except FileNotFoundError:
+            self._mtime = None
+            self._names = []
+
+        self._name_set = frozenset(self._names)
+        self._search_index = None
+        self._stale = False
+        if os.path.exists(self.path) and self.path not in self._watcher.files():
+            self._watcher.addPath(self.path)
+
+    def _reload_if_stale(self):
+        if self._stale:
+            self.reload()
+
+    def _path_changed(self, _):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime != self._mtime:
+            self._stale = True
+            self.changed.emit()
@@ -0,0 +1,241 @@
+"""Batch renaming and merging of ids across annotation files.
+
+A mapping {old id: new id} is applied to the ids of every annotation file below a
+directory tree on a process pool. Files that cannot contain an old id are never
+parsed: directories with an up to date dataset index (see dataset_index) only check
+the files the index lists for those ids, all other files are first searched for the
+quoted ids as raw bytes. Every changed file is replaced atomically and the changes
+are recorded in a manifest that undo() reverts.
+
+    python -m src.id_rename apply <dir> --map 1063=하정우 [--map ...] [--dry-run]
+    python -m src.id_rename undo <manifest>
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from functools import partial
+
+from .annotation import face_result, load_annotation, write_annotation
+from .dataset_index import INDEX_FILE_NAME
+from .process_pool import process_pool
+
+MANIFEST_PREFIX = '.face_tool_rename_'
+
+
+def find_json_files(root):
+    """All annotation files below root, sorted."""
+    json_files = []
+    for dir_name, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if not name.startswith('.')]
+        json_files.extend(os.path.join(dir_name, name) for name in file_names
+                          if name.endswith('.json') and not name.startswith('.'))
+    return sorted(json_files)
+
+
+def candidate_files(json_files, names):
+    """The subset of json_files that may contain one of names, using dataset indexes where present."""
+    by_dir = {}
+    for json_file in json_files:
+        # The index stores absolute paths, the files may be given relative to the working directory
+        by_dir.setdefault(os.path.dirname(os.path.abspath(json_file)), []).append(json_file)
+
+    candidates = []
+    for dir_name, dir_files in by_dir.items():
+        db_path = os.path.join(dir_name, INDEX_FILE_NAME)
+        if not os.path.exists(db_path):
+            candidates.extend(dir_files)
+            continue
+        try:
+            db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            try:
+                indexed = dict(db.execute("SELECT json_path, mtime_ns FROM images"))
+                placeholders = ','.join('?' * len(names))
+                hits = {path for path, in db.execute(
+                    f"SELECT DISTINCT images.json_path FROM faces JOIN images ON faces.path = images.path "
+                    f"WHERE faces.id IN ({placeholders})", list(names))}
+            finally:
+                db.close()
+        except sqlite3.Error:
+            candidates.extend(dir_files)
+            continue
+
+        for json_file in dir_files:
+            # Files changed since they were indexed have to be checked anyway
+            json_path = os.path.abspath(json_file)
+            try:
+                stale = indexed.get(json_path) != os.stat(json_file).st_mtime_ns
+            except OSError:
+                continue
+            if stale or json_path in hits:
+                candidates.append(json_file)
+    return candidates
+
+
+def _needles(names):
+    """Byte strings one of which a file containing any of names must contain."""
+    needles = set()
+    for name in names:
+        needles.add(json.dumps(name, ensure_ascii=False).encode('utf-8'))
+        needles.add(json.dumps(name).encode('ascii'))
+    return needles
+
+
+def rename_file(json_file, mapping, dry_run=False, needles=None):
+    """Apply mapping to the ids of one file.
+
+    Returns (json_file, [(face index, old id, new id)], error message or None).
+    """
+    try:
+        if needles is not None:
+            with open(json_file, 'rb') as file:
+                data = file.read()
+            if not any(needle in data for needle in needles):
+                return json_file, [], None
+
+        doc = load_annotation(json_file)
+        ids = face_result(doc)['ids']
+        changes = [(i, name, mapping[name]) for i, name in enumerate(ids) if name in mapping]
+        if changes and not dry_run:
+            for i, _, new in changes:
+                ids[i] = new
+            write_annotation(json_file, doc)
+        return json_file, changes, None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return json_file, [], str(e)
+
+
+def _revert_file(entry, dry_run=False):
+    """Undo the changes of one manifest entry where the id was not changed again since."""
+    json_file, faces = entry['file'], entry['faces']
+    try:
+        doc = load_annotation(json_file)
+        ids = face_result(doc)['ids']
+        changes = [(i, new, old) for i, old, new in faces if i < len(ids) and ids[i] == new]
+        if changes and not dry_run:
+            for i, _, old in changes:
+                ids[i] = old
+            write_annotation(json_file, doc)
+        return json_file, changes, None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return json_file, [], str(e)
+
+
+def rename_ids(json_files, mapping, dry_run=False, workers=None, use_index=True, progress=None):
+    """Apply mapping to json_files on a process pool, returns the results of rename_file for changed files."""
+    files = candidate_files(json_files, list(mapping)) if use_index else list(json_files)
+    worker = partial(rename_file, mapping=mapping, dry_run=dry_run, needles=_needles(mapping))
+    return _run_pool(worker, files, workers, progress)
+
+
+def undo(manifest_file, exclude=(), dry_run=False, workers=None, progress=None):
+    """Revert the changes recorded in a manifest, except for the files in exclude."""
+    with open(manifest_file, 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+    entries = [entry for entry in manifest['files'] if entry['file'] not in exclude]
+    return _run_pool(partial(_revert_file, dry_run=dry_run), entries, workers, progress)
+
+
+def _run_pool(worker, items, workers, progress):
+    results = []
+    with process_pool(workers) as pool:
+        for done, result in enumerate(pool.map(worker, items, chunksize=64), 1):
+            if result[1] or result[2]:
+                results.append(result)
+            if progress and done % 1000 == 0:
+                progress(done, len(items))
+    if progress:
+        progress(len(items), len(items))
+    return results
+
+
+def default_manifest_path(root):
+    return os.path.join(root, f"{MANIFEST_PREFIX}{time.strftime('%Y%m%d_%H%M%S')}.json")
+
+
+def write_manifest(manifest_file, mapping, results):
+    """Record the changed faces of results so undo() can revert them."""
+    manifest = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'mapping': mapping,
+        'files': [{'file': json_file, 'faces': changes} for json_file, changes, _ in results if changes]
+    }
+    with open(manifest_file, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=4)
+
+
+def summarize(results):
+    """Report text with changed files and faces per renamed id and the errors."""
+    counts = {}
+    for _, changes, _ in results:
+        for _, old, new in changes:
+            counts[(old, new)] = counts.get((old, new), 0) + 1
+    files = sum(1 for _, changes, _ in results if changes)
+    lines = [f"{sum(counts.values())} face(s) in {files} file(s)"]
+    lines += [f"  {old} -> {new}: {count}" for (old, new), count in sorted(counts.items())]
+    errors = [(json_file, error) for json_file, _, error in results if error]
+    lines += [f"  error {json_file}: {error}" for json_file, error in errors]
+    return "\n".join(lines)
+
+
+def _parse_mapping(args):
+    mapping = {}
+    pairs = list(args.map or [])
+    if args.map_file:
+        with open(args.map_file, 'r', encoding='utf-8') as file:
+            pairs.extend(line.strip() for line in file if line.strip() and not line.startswith('#'))
+    for pair in pairs:
+        old, sep, new = pair.partition('\t' if '\t' in pair else '=')
+        if not sep or not old or not new:
+            raise ValueError(f"Invalid mapping {pair!r}, expected OLD=NEW")
+        mapping[old] = new
+    return mapping
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rename or merge ids in all annotation files of a directory tree.")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    apply_parser = commands.add_parser('apply', help="rename ids")
+    apply_parser.add_argument('root')
+    apply_parser.add_argument('--map', action='append', metavar='OLD=NEW', help="may be given several times")
+    apply_parser.add_argument('--map-file', help="file with one OLD=NEW (or tab separated) pair per line")
+    apply_parser.add_argument('--dry-run', action='store_true', help="only report what would change")
+    apply_parser.add_argument('--manifest', help="undo manifest (default: a new file in root)")
+    apply_parser.add_argument('--no-index', action='store_true', help="ignore dataset index files")
+    apply_parser.add_argument('--workers', type=int, default=None)
+
+    undo_parser = commands.add_parser('undo', help="revert a previous rename")
+    undo_parser.add_argument('manifest')
+    undo_parser.add_argument('--dry-run', action='store_true')
+    undo_parser.add_argument('--workers', type=int, default=None)
+
+    args = parser.parse_args()
+
+    def progress(done, total):
+        print(f"{done}/{total} files checked", end='\r', file=sys.stderr)
+
+    if args.command == 'undo':
+        results = undo(args.manifest, dry_run=args.dry_run, workers=args.workers, progress=progress)
+        print(file=sys.stderr)
+        print(summarize(results))
+        return
+
+    mapping = _parse_mapping(args)
+    if not mapping:
+        parser.error("no mapping given, use --map or --map-file")
+
+    results = rename_ids(find_json_files(args.root), mapping, args.dry_run, args.workers, not args.no_index, progress)
+    print(file=sys.stderr)
+    print(("Dry run, would change " if args.dry_run else "Changed ") + summarize(results))
+    if not args.dry_run and any(changes for _, changes, _ in results):
+        manifest_file = args.manifest or default_manifest_path(args.root)
+        write_manifest(manifest_file, mapping, results)
+        print(f"Undo manifest: {manifest_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .id_rename import rename_ids, undo
+
+
+class IDRenameTask(QObject):
+    """Runs id_rename on a thread for the GUI."""
+    # Emitted with the number of checked and total files
+    progress = pyqtSignal(int, int)
+    # Emitted with the results (see id_rename.rename_file) and whether it was a dry run
+    finished = pyqtSignal(list, bool)
+    # Emitted with the error message if the rename or undo raised
+    failed = pyqtSignal(str)
+
+    def __init__(self, workers=None):
+        super().__init__()
+        self.workers = workers
+        self._thread = None
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start_rename(self, json_files, mapping, dry_run):
+        self._start(lambda: rename_ids(json_files, mapping, dry_run, self.workers, progress=self.progress.emit),
+                    dry_run)
+
+    def start_undo(self, manifest_file, exclude):
+        self._start(lambda: undo(manifest_file, exclude, workers=self.workers, progress=self.progress.emit), False)
+
+    def _start(self, run, dry_run):
+        if self.running():
+            return
+        self._thread = threading.Thread(target=self._run, args=(run, dry_run), name="IDRenameTask", daemon=True)
+        self._thread.start()
+
+    def _run(self, run, dry_run):
+        try:
+            results = run()
+        except Exception as e:  # E.g. a corrupt manifest or a broken process pool, the GUI waits otherwise
+            self.failed.emit(f"{type(e).__name__}: {e}")
+            return
+        self.finished.emit(results, dry_run)
@@ -0,0 +1,88 @@
+"""Substring search over large ID lists.
+
+Names are normalized once (lowercase, Hangul syllables split into single jamo) and an
+index maps every character and every pair of adjacent characters to the names
+containing it. A query then only has to check the names in its rarest bigram.
+Splitting into jamo lets an incomplete syllable still match while the input method
+is composing it, e.g. "핮" (ㅎㅏㅈ) already matches "하정우" (ㅎㅏㅈㅓㅇㅇㅜ).
+"""
+from array import array
+from functools import lru_cache
+
+_HANGUL_BASE = 0xAC00
+_HANGUL_LAST = 0xD7A3
+_INITIALS = 'ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ'
+_VOWELS = 'ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ'
+_FINALS = ['', 'ㄱ', 'ㄲ', 'ㄳ', 'ㄴ', 'ㄵ', 'ㄶ', 'ㄷ', 'ㄹ', 'ㄺ', 'ㄻ', 'ㄼ', 'ㄽ', 'ㄾ', 'ㄿ', 'ㅀ',
+           'ㅁ', 'ㅂ', 'ㅄ', 'ㅅ', 'ㅆ', 'ㅇ', 'ㅈ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ', 'ㅎ']
+# Compound jamo are typed as two keys, so they are split to match half typed input
+_COMPOUNDS = {
+    'ㄳ': 'ㄱㅅ', 'ㄵ': 'ㄴㅈ', 'ㄶ': 'ㄴㅎ', 'ㄺ': 'ㄹㄱ', 'ㄻ': 'ㄹㅁ', 'ㄼ': 'ㄹㅂ', 'ㄽ': 'ㄹㅅ',
+    'ㄾ': 'ㄹㅌ', 'ㄿ': 'ㄹㅍ', 'ㅀ': 'ㄹㅎ', 'ㅄ': 'ㅂㅅ',
+    'ㅘ': 'ㅗㅏ', 'ㅙ': 'ㅗㅐ', 'ㅚ': 'ㅗㅣ', 'ㅝ': 'ㅜㅓ', 'ㅞ': 'ㅜㅔ', 'ㅟ': 'ㅜㅣ', 'ㅢ': 'ㅡㅣ'
+}
+
+
+@lru_cache(maxsize=None)
+def _jamo_table():
+    """str.translate table from syllables and compound jamo to single jamo, built on first use."""
+    table = {ord(char): jamo for char, jamo in _COMPOUNDS.items()}
+    for code in range(_HANGUL_BASE, _HANGUL_LAST + 1):
+        offset = code - _HANGUL_BASE
+        initial, vowel, final = offset // (21 * 28), offset // 28 % 21, offset % 28
+        jamo = _INITIALS[initial] + _VOWELS[vowel] + _FINALS[final]
+        table[code] = ''.join(_COMPOUNDS.get(j, j) for j in jamo)
+    return table
+
+
+def normalize(text):
+    """Search key of text: lowercase with Hangul split into single jamo."""
+    return text.lower().translate(_jamo_table())
+
+
+class IDSearchIndex:
+    """Bigram index over a list of names, searches return indices in list order."""
+
+    def __init__(self, names):
+        self.names = names
+        self.keys = [normalize(name) for name in names]
+
+        postings = {}
+        for i, key in enumerate(self.keys):
+            for gram in set(key).union(self._bigrams(key)):
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('l')
+                posting.append(i)
+        self._postings = postings
+
+        # Last query and its result, reused while the query keeps growing
+        self._last_key = None
+        self._last_result = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def _bigrams(key):
+        return [key[i:i + 2] for i in range(len(key) - 1)]
+
+    def search(self, query):
+        """Indices of all names containing query (case and jamo insensitive)."""
+        key = normalize(query.strip())
+        if not key:
+            return range(len(self.names))
+
+        if self._last_key is not None and self._last_key in key:
+            # Narrowing the previous query, only its matches can still match
+            candidates = self._last_result
+        elif len(key) == 1:
+            candidates = self._postings.get(key, [])
+        else:
+            postings = [self._postings.get(gram) for gram in self._bigrams(key)]
+            candidates = min(postings, key=len) if all(postings) else []
+
+        result = [i for i in candidates if key in self.keys[i]]
+        self._last_key = key
+        self._last_result = result
+        return result
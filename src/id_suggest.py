@@ -0,0 +1,285 @@
+"""Ranking of candidate IDs by embedding similarity.
+
+Every face in the loaded directory whose id is a known candidate serves as a labeled
+example. Embeddings are L2 normalized once and kept as float16, so the index takes
+about 2 * faces * dimensions bytes (twice that while the stacked matrix exists, e.g.
+400 MB for 100k faces of 1024 dimensions); cosine similarities are computed in float32
+chunks of RANK_CHUNK examples. SuggestionRanker ranks the faces of the current image
+on a thread and caches the results per image.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .annotation import json_path_for, load_annotation
+from .embedding_store import load_embeddings
+from .instrument import timed
+from .lazy_import import LazyModule
+
+np = LazyModule('numpy')
+
+# Examples converted to float32 at a time when ranking
+RANK_CHUNK = 65536
+
+
+def normalize_rows(vectors):
+    """Rows of vectors scaled to unit length (zero rows stay zero)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class EmbeddingIndex:
+    """Normalized embeddings of all faces, grouped by annotation file.
+
+    Label changes only touch the id lists; the stacked matrix is rebuilt lazily when
+    embeddings of a file were added or removed.
+    """
+
+    def __init__(self):
+        self._blocks = {}  # JSON path -> (normalized embeddings, ids)
+        self._lock = threading.Lock()
+
+        self._matrix = None  # Stacked embeddings of all blocks
+        self._row_keys = None  # JSON path of each row in _matrix
+        self._row_ids = None  # (distinct ids, id code of each row in _matrix)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(ids) for _, ids in self._blocks.values())
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._matrix = None
+
+    def set_image(self, key, embeddings, ids):
+        """Add or replace the faces of one file.
+
+        Files whose embeddings do not line up with their ids, or whose dimension differs
+        from the files added before, are left out.
+        """
+        with self._lock:
+            self._blocks.pop(key, None)
+            self._matrix = None
+            if len(embeddings) == 0 or len(embeddings) != len(ids):
+                return
+            vectors = normalize_rows(embeddings)
+            other = next(iter(self._blocks.values()), None)
+            if vectors.ndim != 2 or (other is not None and other[0].shape[1] != vectors.shape[1]):
+                return
+            self._blocks[key] = (vectors.astype(np.float16), list(ids))
+
+    def update_ids(self, key, ids):
+        """Relabel the faces of one file, e.g. after an id was changed."""
+        with self._lock:
+            if key not in self._blocks:
+                return
+            vectors, _ = self._blocks[key]
+            if len(ids) != len(vectors):
+                # Boxes were added or deleted, the rows no longer match the faces
+                del self._blocks[key]
+                self._matrix = None
+                return
+            self._blocks[key] = (vectors, list(ids))
+            self._row_ids = None
+
+    def relabel(self, key, faces):
+        """Change single ids of one file, faces maps face index -> id."""
+        with self._lock:
+            if key not in self._blocks:
+                return
+            vectors, ids = self._blocks[key]
+            ids = list(ids)
+            for face, name in faces.items():
+                if face < len(ids):
+                    ids[face] = name
+            self._blocks[key] = (vectors, ids)
+            self._row_ids = None
+
+    def has_image(self, key):
+        with self._lock:
+            return key in self._blocks
+
+    def _stacked(self):
+        """Stacked matrix, row keys, distinct names and the name code of each row."""
+        if self._matrix is None:
+            blocks = list(self._blocks.items())
+            if blocks:
+                self._matrix = np.concatenate([vectors for _, (vectors, _) in blocks])
+            else:
+                self._matrix = np.zeros((0, 0), dtype=np.float16)
+            self._row_keys = np.array([key for key, (vectors, _) in blocks for _ in range(len(vectors))],
+                                      dtype=object)
+            self._row_ids = None
+
+        if self._row_ids is None:
+            row_ids = [name for _, (_, ids) in self._blocks.items() for name in ids]
+            self._row_ids = np.unique(np.array(row_ids, dtype=object), return_inverse=True)
+
+        return self._matrix, self._row_keys, self._row_ids[0], self._row_ids[1]
+
+    def rank(self, queries, is_label, k=5, exclude_key=None):
+        """Best matching labels for each query embedding.
+
+        Returns one list of (name, similarity) per query, best first. A name scores
+        with its most similar example; only rows whose id passes is_label count.
+        """
+        with self._lock:
+            matrix, row_keys, names, codes = self._stacked()
+
+        empty = [[] for _ in range(len(queries))]
+        if len(matrix) == 0 or len(queries) == 0:
+            return empty
+
+        queries = normalize_rows(queries)
+        if queries.shape[1] != matrix.shape[1]:
+            return empty
+
+        mask = np.array([is_label(name) for name in names], dtype=bool)[codes]
+        if exclude_key is not None:
+            mask &= row_keys != exclude_key
+        if not mask.any():
+            return empty
+
+        labeled = np.flatnonzero(mask)
+        similarities = np.empty((len(queries), len(labeled)), dtype=np.float32)  # (queries, labeled examples)
+        for start in range(0, len(labeled), RANK_CHUNK):
+            rows = labeled[start:start + RANK_CHUNK]
+            similarities[:, start:start + len(rows)] = queries @ matrix[rows].astype(np.float32).T
+        codes = codes[mask]
+
+        # Best similarity per name: sort examples by name and take the max of each run
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        per_name = np.maximum.reduceat(similarities[:, order], starts, axis=1)
+        name_codes = sorted_codes[starts]
+
+        results = []
+        for scores in per_name:
+            best = np.argsort(-scores)[:k]
+            results.append([(names[name_codes[i]], float(scores[i])) for i in best])
+        return results
+
+
+class SuggestionRanker(QObject):
+    """Ranks the faces of one image against an EmbeddingIndex on a thread.
+
+    Results are cached per annotation file until clear() is called, e.g. after labels
+    of the index changed.
+    """
+    # Emitted with the JSON path whose suggestions are ready
+    ranked = pyqtSignal(str)
+
+    def __init__(self, index, k=5, cache_size=256):
+        super().__init__()
+        self.index = index
+        self.k = k
+        self.cache_size = cache_size
+        self._results = OrderedDict()  # JSON path -> [[(id, similarity)] per embedding row]
+        self._pending = {}  # JSON path -> Future
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def result(self, json_file):
+        """Cached suggestions of json_file, one list per embedding row, or None."""
+        with self._lock:
+            if json_file in self._results:
+                self._results.move_to_end(json_file)
+            return self._results.get(json_file)
+
+    def request(self, json_file, doc, is_label):
+        """Rank the faces of doc in the background, dropping queued requests of other files.
+
+        is_label must be safe to call from a thread. The embeddings field of doc must not
+        be replaced meanwhile.
+        """
+        with self._lock:
+            for key in list(self._pending):
+                if key != json_file and self._pending[key].cancel():
+                    del self._pending[key]
+            if json_file not in self._pending:
+                self._pending[json_file] = self._executor.submit(self._rank, json_file, doc, is_label)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def shutdown(self):
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self._executor.shutdown(wait=False)
+
+    @timed()
+    def _rank(self, json_file, doc, is_label):
+        try:
+            embeddings = load_embeddings(json_file, doc)
+        except (OSError, ValueError):
+            embeddings = []
+        try:
+            results = self.index.rank(embeddings, is_label, self.k, exclude_key=json_file) if len(embeddings) else []
+        finally:
+            # Also after errors, the next request of the file ranks it again
+            with self._lock:
+                self._pending.pop(json_file, None)
+        with self._lock:
+            self._results[json_file] = results
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        self.ranked.emit(json_file)
+
+
+class EmbeddingIndexBuilder(QObject):
+    """Fills an EmbeddingIndex from all annotation files of a directory on a thread."""
+    # Emitted with the number of processed and total files
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal()
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self._thread = None
+        self._cancelled = threading.Event()
+
+    def start(self, img_files):
+        """(Re)build the index for img_files, cancelling a build still running."""
+        self.cancel()
+        self._cancelled = threading.Event()
+        self.index.clear()
+        self._thread = threading.Thread(target=self._run, args=(list(img_files), self._cancelled),
+                                        name="EmbeddingIndexBuilder", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, img_files, cancelled):
+        for i, img_file in enumerate(img_files):
+            if cancelled.is_set():
+                return
+
+            json_file = json_path_for(img_file)
+            try:
+                doc = load_annotation(json_file)
+                embeddings = load_embeddings(json_file, doc)
+                ids = doc['object_info']['face']['result']['ids']
+            except (OSError, ValueError, KeyError):
+                # Missing or broken files simply do not contribute examples
+                continue
+
+            if not self.index.has_image(json_file):
+                self.index.set_image(json_file, embeddings, ids)
+            if i % 100 == 0:
+                self.progress.emit(i, len(img_files))
+
+        self.progress.emit(len(img_files), len(img_files))
+        self.finished.emit()
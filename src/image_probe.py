@@ -0,0 +1,117 @@
+"""Image dimensions read from file headers, without decoding any pixels.
+
+The size is reported the way OpenCV decodes the image, i.e. JPEGs whose EXIF
+orientation rotates them by 90 degrees have width and height swapped.
+"""
+import struct
+
+from .lazy_import import LazyModule
+
+cv2 = LazyModule('cv2')
+
+# JPEG start of frame markers, which hold the image size
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# EXIF orientations that rotate the image by 90 or 270 degrees
+_TRANSPOSING_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def _exif_orientation(data):
+    """Orientation tag of an EXIF APP1 payload or None."""
+    if not data.startswith(b'Exif\0\0') or len(data) < 14:
+        return None
+    tiff = data[6:]
+    order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if order is None:
+        return None
+    ifd_offset, = struct.unpack(order + 'I', tiff[4:8])
+    if ifd_offset + 2 > len(tiff):
+        return None
+    count, = struct.unpack(order + 'H', tiff[ifd_offset:ifd_offset + 2])
+    for i in range(count):
+        entry = ifd_offset + 2 + 12 * i
+        if entry + 12 > len(tiff):
+            break
+        tag, _, _, value = struct.unpack(order + 'HHIH', tiff[entry:entry + 10])
+        if tag == 0x0112:
+            return value
+    return None
+
+
+def _jpeg_size(file):
+    file.seek(2)
+    orientation = None
+    while True:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        # Fill bytes may precede a marker
+        while marker[1] == 0xFF:
+            marker = marker[1:] + file.read(1)
+        if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+            continue
+
+        length, = struct.unpack('>H', file.read(2))
+        if marker[1] in _SOF_MARKERS:
+            height, width = struct.unpack('>xHH', file.read(5))
+            if orientation in _TRANSPOSING_ORIENTATIONS:
+                return height, width
+            return width, height
+        if marker[1] == 0xE1 and orientation is None:
+            orientation = _exif_orientation(file.read(length - 2))
+        else:
+            file.seek(length - 2, 1)
+
+
+def _png_size(header):
+    if header[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', header[16:24])
+
+
+def _bmp_size(header):
+    width, height = struct.unpack('<ii', header[18:26])
+    return width, abs(height)
+
+
+def _webp_size(header):
+    chunk = header[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        bits, = struct.unpack('<I', header[21:25])
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        return (int.from_bytes(header[24:27], 'little') + 1,
+                int.from_bytes(header[27:30], 'little') + 1)
+    return None
+
+
+def image_size(img_file):
+    """(width, height) of img_file from its header.
+
+    Formats without a known header (e.g. TIFF) are decoded with OpenCV as before.
+    Raises OSError if the file cannot be read or decoded.
+    """
+    with open(img_file, 'rb') as file:
+        header = file.read(32)
+        size = None
+        try:
+            if header[:2] == b'\xff\xd8':
+                size = _jpeg_size(file)
+            elif header[:8] == b'\x89PNG\r\n\x1a\n':
+                size = _png_size(header)
+            elif header[:2] == b'BM':
+                size = _bmp_size(header)
+            elif header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+                size = _webp_size(header)
+        except struct.error:
+            # Truncated header, let OpenCV decide
+            size = None
+
+    if size is None:
+        image = cv2.imread(img_file)
+        if image is None:
+            raise OSError(f"Cannot read image size of {img_file}")
+        size = image.shape[1], image.shape[0]
+    return size
@@ -0,0 +1,170 @@
+"""Tiled multi-resolution access to large images.
+
+Level f of an image is the image reduced by factor f, decoded directly at that size
+with OpenCV's reduced JPEG decoding (other formats are decoded and then resized).
+Decoding always produces a whole level: zooming out never touches full resolution,
+but the tiles of the finest level come from the full resolution image. Decoded levels
+are kept in a bounded cache keyed by (image, factor), so panning cuts new tiles from
+memory instead of decoding the image again; a level larger than that cache is decoded
+again for every request. The tiles around the viewport are kept in a second bounded
+cache, and the coarsest level doubles as overview that is drawn while finer tiles are
+still being decoded.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5 import QtGui
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .instrument import add_read, timed
+from .lazy_import import LazyModule
+
+cv2 = LazyModule('cv2')
+np = LazyModule('numpy')
+
+# Reduction factors of the pyramid levels, finest first
+LEVELS = (1, 2, 4, 8)
+OVERVIEW_FACTOR = LEVELS[-1]
+
+# Edge length of a tile in level pixels
+TILE_SIZE = 512
+
+# Names of the cv2 flags, looked up when decoding so cv2 is only imported then
+_REDUCED_FLAGS = {
+    1: 'IMREAD_COLOR',
+    2: 'IMREAD_REDUCED_COLOR_2',
+    4: 'IMREAD_REDUCED_COLOR_4',
+    8: 'IMREAD_REDUCED_COLOR_8'
+}
+
+
+def level_for(scale):
+    """Coarsest level that still has at least one level pixel per screen pixel at scale."""
+    for factor in reversed(LEVELS):
+        if factor * scale <= 1:
+            return factor
+    return LEVELS[0]
+
+
+def decode_array(img_file, factor):
+    """BGR array of img_file reduced by factor, or None if it cannot be decoded."""
+    # imdecode instead of imread, since imread cannot open non-ASCII paths on every platform
+    try:
+        data = np.fromfile(img_file, dtype=np.uint8)
+    except OSError:
+        return None
+    add_read(data.nbytes)
+    return cv2.imdecode(data, getattr(cv2, _REDUCED_FLAGS[factor]))
+
+
+def decode_level(img_file, factor):
+    """QImage of img_file reduced by factor, or None if it cannot be decoded."""
+    array = decode_array(img_file, factor)
+    return to_qimage(array) if array is not None else None
+
+
+def to_qimage(array):
+    """QImage copy of a BGR OpenCV image."""
+    rgb = np.ascontiguousarray(cv2.cvtColor(array, cv2.COLOR_BGR2RGB))
+    height, width = rgb.shape[:2]
+    return QtGui.QImage(rgb.data, width, height, rgb.strides[0], QtGui.QImage.Format_RGB888).copy()
+
+
+def tile_range(rect, factor):
+    """(columns, rows) of the tiles at level factor covering rect (x1, y1, x2, y2 in image pixels)."""
+    span = TILE_SIZE * factor
+    x1, y1, x2, y2 = rect
+    return (range(int(x1 // span), int(np.ceil(x2 / span))),
+            range(int(y1 // span), int(np.ceil(y2 / span))))
+
+
+class TileLoader(QObject):
+    """Decodes pyramid levels on a thread pool and caches the requested tiles.
+
+    The cache is an LRUCache keyed by (image file, factor, column, row); tiles that do
+    not exist because they lie outside the level are cached as None. level_cache, an
+    LRUCache keyed by (image file, factor), keeps the decoded levels tiles are cut from.
+    """
+    # Emitted with the image file and factor of freshly cached tiles
+    tilesReady = pyqtSignal(str, int)
+
+    def __init__(self, cache, level_cache, workers=2):
+        super().__init__()
+        self.cache = cache
+        self.level_cache = level_cache
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = {}  # (image file, factor) -> (Future, set of wanted (column, row))
+        self._lock = threading.Lock()
+
+    def tile(self, img_file, factor, column, row):
+        return self.cache.get((img_file, factor, column, row))
+
+    def has_tile(self, img_file, factor, column, row):
+        return (img_file, factor, column, row) in self.cache
+
+    def has_level(self, img_file, factor):
+        """Whether (at least the first tile of) a level is cached."""
+        return self.has_tile(img_file, factor, 0, 0)
+
+    def request(self, img_file, factor, tiles):
+        """Decode the tiles [(column, row)] of one level, dropping queued work of other images."""
+        with self._lock:
+            for key in list(self._pending):
+                if key[0] != img_file and self._pending[key][0].cancel():
+                    del self._pending[key]
+
+            key = (img_file, factor)
+            if key in self._pending:
+                # The level is being decoded already, just cut these tiles as well
+                self._pending[key][1].update(tiles)
+                return
+
+            future = self._executor.submit(self._load, img_file, factor)
+            self._pending[key] = (future, set(tiles))
+
+    def load_level(self, img_file, factor):
+        """Decode a whole level and cache all of its tiles right away, e.g. from a prefetch thread."""
+        image = self._level(img_file, factor)
+        if image is not None:
+            columns = range((image.width() + TILE_SIZE - 1) // TILE_SIZE)
+            rows = range((image.height() + TILE_SIZE - 1) // TILE_SIZE)
+            self._cache_tiles(img_file, factor, image, [(column, row) for column in columns for row in rows])
+
+    def clear(self):
+        """Drop all cached tiles and levels."""
+        self.cache.clear()
+        self.level_cache.clear()
+
+    def shutdown(self):
+        with self._lock:
+            for future, _ in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self._executor.shutdown(wait=False)
+
+    @timed()
+    def _load(self, img_file, factor):
+        """Worker: decode one level (unless it is cached) and cache the wanted tiles."""
+        image = self._level(img_file, factor)
+        with self._lock:
+            _, wanted = self._pending.pop((img_file, factor), (None, set()))
+        self._cache_tiles(img_file, factor, image, wanted)
+
+    def _level(self, img_file, factor):
+        """Decoded level from the level cache, decoding and caching it if needed."""
+        image = self.level_cache.get((img_file, factor))
+        if image is None:
+            image = decode_level(img_file, factor)
+            if image is not None:
+                self.level_cache.put((img_file, factor), image, image.byteCount(), replace=False)
+        return image
+
+    def _cache_tiles(self, img_file, factor, image, tiles):
+        for column, row in tiles:
+            tile = None
+            if image is not None:
+                x, y = column * TILE_SIZE, row * TILE_SIZE
+                if x < image.width() and y < image.height():
+                    tile = image.copy(x, y, min(TILE_SIZE, image.width() - x), min(TILE_SIZE, image.height() - y))
+            self.cache.put((img_file, factor, column, row), tile, tile.byteCount() if tile is not None else 0)
+        self.tilesReady.emit(img_file, factor)
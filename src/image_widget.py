@@ -1,8 +1,12 @@
 from PyQt5 import QtWidgets, QtGui
-from PyQt5.QtCore import Qt, QPoint
-from PyQt5.QtGui import QPolygon
+from PyQt5.QtCore import Qt, QPointF, QRectF, QTimer
+from PyQt5.QtGui import QPolygonF
 
-from .point import Point
+from .image_pyramid import OVERVIEW_FACTOR, TILE_SIZE, level_for, tile_range
+from .instrument import timed
+from .lazy_import import LazyModule
+
+np = LazyModule('numpy')
 
 
 class _DragMode:
@@ -30,15 +34,41 @@ class _PositionMode(_DragMode):
         self.bbox_idx = bbox_idx
 
 
+class _PanMode(_DragMode):
+    """Dragging the view itself, no bounding box is modified."""
+
+
 class ImageWidget(QtWidgets.QLabel):
-    """Widget that displays the image along with bounding boxes."""
+    """Zoomable view of the image along with bounding boxes.
+
+    The image is drawn from pyramid tiles (see image_pyramid) of the level matching the
+    zoom, with the overview level filling in until finer tiles are decoded. Painting is
+    layered: the composed image and all boxes that are not being dragged are cached as
+    pixmaps, so a drag only redraws the dragged box and repaints the area it covered
+    before and after the move.
+    """
     # Radius of the drag handle
     DRAG_RADIUS = 6
 
+    # Width of the box outline
+    PEN_WIDTH = 3
+
+    # Position of the ID text relative to the top left corner of its box
+    TEXT_OFFSET = (10, 20)
+
     # We need to add a margin around the image since having a bbox around the entire image
     # caused drawing issues
     MARGIN = 5
 
+    # Fallback if the screen does not report its refresh rate
+    DEFAULT_REFRESH_RATE = 60
+
+    # Zoom factor of one mouse wheel step
+    ZOOM_STEP = 1.25
+
+    # Largest zoom in screen pixels per image pixel
+    MAX_SCALE = 8
+
     def __init__(self, parent, *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
         self.setFrameStyle(QtWidgets.QFrame.Box)
@@ -55,138 +85,364 @@ class ImageWidget(QtWidgets.QLabel):
         # Previous location of mouse, used for finding delta position when changing position of bbox
         self.last_mouse_pos = None
 
-    def img_to_qt(self, point):
-        """Scale point from image dimension to qt dimension."""
-        new_x = point.x / self.pixmap().rect().width() \
-            * (self.rect().width() - 2 * ImageWidget.MARGIN) + ImageWidget.MARGIN
-        new_y = point.y / self.pixmap().rect().height() \
-            * (self.rect().height() - 2 * ImageWidget.MARGIN) + ImageWidget.MARGIN
-        return Point(new_x, new_y)
-
-    def qt_to_img(self, point):
-        """Scale point from qt dimension to image dimension."""
-        new_x = (point.x - ImageWidget.MARGIN) \
-            / (self.rect().width() - 2 * ImageWidget.MARGIN) * self.pixmap().rect().width()
-        new_y = (point.y - ImageWidget.MARGIN) \
-            / (self.rect().height() - 2 * ImageWidget.MARGIN) * self.pixmap().rect().height()
-        return Point(new_x, new_y)
-
-    def bbox_to_polygon(self, bbox):
-        """Unscaled bounding box to QPolygon"""
-        scaled = [self.img_to_qt(point) for point in bbox]
-        return QPolygon([QPoint(p.x, p.y) for p in scaled])
+        # Latest mouse position not applied to the dragged box yet
+        self._pending_mouse_pos = None
 
-    def paintEvent(self, event):
-        """Draws bounding box and dragging handle."""
-        super().paintEvent(event)
-        painter = QtGui.QPainter(self)
+        # Pixel box being dragged as it was when the drag started, journaled on release
+        self._drag_start_box = None
+
+        # Mouse moves are applied at most once per screen refresh
+        self._drag_timer = QTimer(self)
+        self._drag_timer.setSingleShot(True)
+        self._drag_timer.timeout.connect(self._apply_drag)
+
+        # Shown image file and its (width, height), pixels are loaded as tiles
+        self._img_file = None
+        self._image_size = None
+
+        # View: zoom relative to fitting the whole image and image point at the view center
+        self._zoom = 1.0
+        self._center = None
+
+        # Visible tiles composed at widget size, rebuilt after view changes and new tiles
+        self._base = None
+
+        # Boxes except the dragged one and the index of the box left out
+        self._overlay = None
+        self._overlay_excluded = None
 
-        with open('id_cand_list.txt', 'r') as file:
-            items = file.read().splitlines()
+        # (scale, offset) mapping image to widget coordinates, recomputed after view changes
+        self._transform = None
 
-        for i, bbox in enumerate(self.parent.img_bboxes):
-            if self.parent.color_change[i] == 0:
-                painter.setPen(QtGui.QPen(Qt.blue, 3))
-                # Draw bounding box
-                painter.setBrush(Qt.NoBrush)  # No fill
-                painter.drawPolygon(self.bbox_to_polygon(bbox))
+        self.parent.tile_loader.tilesReady.connect(self._tiles_ready)
 
-                # Draw dragging handles
-                painter.setBrush(QtGui.QBrush(Qt.blue))  # Fill blue
+    def set_image(self, img_file, width, height):
+        """Show img_file of the given size, fitted to the widget."""
+        self._img_file = img_file
+        self._image_size = (width, height)
+        self.setText("")
+        self.reset_view()
 
-            elif self.parent.color_change[i] == 1:
-                painter.setPen(QtGui.QPen(Qt.green, 3))
-                painter.setBrush(QtGui.QBrush(Qt.green))
+    def clear_image(self):
+        """Show no image, e.g. while a new directory is being scanned."""
+        self._img_file = None
+        self._image_size = None
+        self.setText("Upload Image")
+        self._view_changed()
+
+    def reset_view(self):
+        """Fit the whole image into the widget."""
+        self._zoom = 1.0
+        self._center = None
+        self._view_changed()
+
+    def _view_changed(self):
+        self._transform = None
+        self._base = None
+        self._overlay = None
+        self.update()
+
+    def _tiles_ready(self, img_file, _):
+        if img_file == self._img_file:
+            self._base = None
+            self.update()
+
+    def invalidate_overlay(self):
+        """Redraw all boxes on the next paint, call after boxes, ids or colors changed."""
+        self._overlay = None
+        self.update()
+
+    def resizeEvent(self, event):
+        self._transform = None
+        self._base = None
+        self._overlay = None
+        super().resizeEvent(event)
+
+    def has_image(self):
+        return self._img_file is not None and min(self._image_size) > 0
+
+    def _content_size(self):
+        return np.array([self.rect().width() - 2 * ImageWidget.MARGIN, self.rect().height() - 2 * ImageWidget.MARGIN],
+                        dtype=np.float64)
+
+    def _fit_scale(self):
+        return max(min(self._content_size() / self._image_size), 1e-6)
+
+    def transform(self):
+        """Cached (scale, offset) arrays with widget = image * scale + offset.
+
+        The scale is the same for both axes; the view center is clamped so that a
+        zoomed in image always covers the widget.
+        """
+        if self._transform is None:
+            content = self._content_size()
+            image_size = np.array(self._image_size, dtype=np.float64)
+            scale = self._fit_scale() * self._zoom
+
+            center = image_size / 2 if self._center is None else np.asarray(self._center, dtype=np.float64)
+            half_view = content / 2 / scale
+            self._center = np.where(image_size <= 2 * half_view, image_size / 2,
+                                    np.clip(center, half_view, image_size - half_view))
+
+            offset = ImageWidget.MARGIN + content / 2 - self._center * scale
+            self._transform = (np.array([scale, scale]), offset)
+        return self._transform
+
+    def img_to_qt(self, points):
+        """Scale points (array with x, y in the last axis) from image dimension to qt dimension."""
+        scale, offset = self.transform()
+        return np.asarray(points) * scale + offset
+
+    def qt_to_img(self, points):
+        """Scale points (array with x, y in the last axis) from qt dimension to image dimension."""
+        scale, offset = self.transform()
+        return (np.asarray(points) - offset) / scale
+
+    def _new_layer(self, size):
+        """Transparent pixmap of size (widget pixels) at the device pixel ratio of the screen."""
+        ratio = self.devicePixelRatioF()
+        layer = QtGui.QPixmap(size * ratio)
+        layer.setDevicePixelRatio(ratio)
+        layer.fill(Qt.transparent)
+        return layer
+
+    def _visible_rect(self):
+        """Part of the image inside the widget as x1, y1, x2, y2 in image pixels."""
+        content = self._content_size()
+        x1, y1 = np.maximum(self.qt_to_img([ImageWidget.MARGIN, ImageWidget.MARGIN]), 0)
+        x2, y2 = np.minimum(self.qt_to_img(ImageWidget.MARGIN + content), self._image_size)
+        return x1, y1, x2, y2
+
+    def _composed_base(self):
+        """Cached layer with the visible tiles, requesting the ones not decoded yet."""
+        if self._base is None:
+            self._base = self._new_layer(self.size())
+            painter = QtGui.QPainter(self._base)
+            painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+            painter.setClipRect(QRectF(ImageWidget.MARGIN, ImageWidget.MARGIN, *self._content_size()))
+
+            scale, _ = self.transform()
+            visible = self._visible_rect()
+            factor = level_for(scale[0] * self.devicePixelRatioF())
+
+            # Overview first, finer tiles are drawn over it as far as they are available
+            for level in sorted({OVERVIEW_FACTOR, factor}, reverse=True):
+                missing = self._draw_level(painter, level, visible)
+                if missing:
+                    self.parent.tile_loader.request(self._img_file, level, missing)
+            painter.end()
+        return self._base
+
+    def _draw_level(self, painter, factor, visible):
+        """Draws the cached tiles of one level covering visible, returns the missing ones."""
+        missing = []
+        span = TILE_SIZE * factor
+        columns, rows = tile_range(visible, factor)
+        for column in columns:
+            for row in rows:
+                if not self.parent.tile_loader.has_tile(self._img_file, factor, column, row):
+                    missing.append((column, row))
+                    continue
+                tile = self.parent.tile_loader.tile(self._img_file, factor, column, row)
+                if tile is None:
+                    continue
+                x1, y1 = self.img_to_qt([column * span, row * span])
+                x2, y2 = self.img_to_qt([column * span + tile.width() * factor, row * span + tile.height() * factor])
+                painter.drawImage(QRectF(x1, y1, x2 - x1, y2 - y1), tile)
+        return missing
+
+    def _dragged_idx(self):
+        return self.drag_mode.bbox_idx if self.drag_mode else None
+
+    def _static_overlay(self):
+        """Cached layer with every box except the dragged one."""
+        excluded = self._dragged_idx()
+        if self._overlay is None or self._overlay_excluded != excluded:
+            self._overlay = self._new_layer(self.size())
+            self._overlay_excluded = excluded
+            painter = QtGui.QPainter(self._overlay)
+            painter.setFont(self.font())
+            corners = self.img_to_qt(self.parent.img_bboxes.corners())
+            for i, box_corners in enumerate(corners):
+                if i != excluded:
+                    self._draw_box(painter, i, box_corners)
+            painter.end()
+        return self._overlay
+
+    def _draw_box(self, painter, i, box_corners):
+        """Draws bounding box i with its dragging handles and ID."""
+        if self.parent.color_change[i] == 0:
+            painter.setPen(QtGui.QPen(Qt.blue, ImageWidget.PEN_WIDTH))
+        elif self.parent.color_change[i] == 1:
+            painter.setPen(QtGui.QPen(Qt.green, ImageWidget.PEN_WIDTH))
+        else:
+            painter.setPen(QtGui.QPen(Qt.red, ImageWidget.PEN_WIDTH))
+
+        # Draw bounding box
+        painter.setBrush(Qt.NoBrush)  # No fill
+        painter.drawPolygon(QPolygonF([QPointF(x, y) for x, y in box_corners]))
+
+        # Draw dragging handles
+        for x, y in box_corners:
+            painter.drawEllipse(QPointF(x, y), ImageWidget.DRAG_RADIUS, ImageWidget.DRAG_RADIUS)
+
+        # Draw text ID
+        painter.setPen(QtGui.QPen(Qt.black))
+        painter.drawText(self._text_pos(box_corners), self.parent.img_ids[i])
+
+    @staticmethod
+    def _text_pos(box_corners):
+        return QPointF(box_corners[0][0] + ImageWidget.TEXT_OFFSET[0], box_corners[0][1] + ImageWidget.TEXT_OFFSET[1])
+
+    def _box_rect(self, i):
+        """Widget area covered by box i including handles, outline and ID text."""
+        box_corners = self.img_to_qt(self.parent.img_bboxes.corners()[i])
+        x_min, y_min = box_corners.min(axis=0)
+        x_max, y_max = box_corners.max(axis=0)
+        rect = QRectF(x_min, y_min, x_max - x_min, y_max - y_min)
+
+        text_rect = QRectF(self.fontMetrics().boundingRect(self.parent.img_ids[i]))
+        rect = rect.united(text_rect.translated(self._text_pos(box_corners)))
+
+        margin = ImageWidget.DRAG_RADIUS + ImageWidget.PEN_WIDTH
+        return rect.adjusted(-margin, -margin, margin, margin).toAlignedRect()
+
+    @timed()
+    def paintEvent(self, event):
+        """Draws the cached image and box layers and the box being dragged.
 
-            else:
-                painter.setPen(QtGui.QPen(Qt.red, 3))
-                painter.setBrush(QtGui.QBrush(Qt.red))
+        QPainter is clipped to the update region, so during a drag only the area of the
+        dragged box is actually composited.
+        """
+        super().paintEvent(event)
+        if not self.has_image():
+            return
 
-                # Draw bounding box
-            painter.setBrush(Qt.NoBrush)  # No fill
-            painter.drawPolygon(self.bbox_to_polygon(bbox))
+        painter = QtGui.QPainter(self)
+        painter.drawPixmap(QPointF(0, 0), self._composed_base())
+        if not len(self.parent.img_bboxes):
+            return
 
-            for point in bbox:
-                scaled = self.img_to_qt(point)
-                painter.drawEllipse(scaled.x - ImageWidget.DRAG_RADIUS,
-                                    scaled.y - ImageWidget.DRAG_RADIUS,
-                                    ImageWidget.DRAG_RADIUS * 2,
-                                    ImageWidget.DRAG_RADIUS * 2)
+        painter.drawPixmap(QPointF(0, 0), self._static_overlay())
 
-            # Draw text ID
-            scaled = self.img_to_qt(bbox[0])
-            painter.setPen(QtGui.QPen(Qt.black))
-            painter.drawText(scaled.x + 10, scaled.y + 20, self.parent.img_ids[i])
+        i = self._dragged_idx()
+        if i is not None and i < len(self.parent.img_bboxes):
+            self._draw_box(painter, i, self.img_to_qt(self.parent.img_bboxes.corners()[i]))
 
+    @timed()
     def mousePressEvent(self, event):
         """Checks if the drag is changing size, position, or neither when mouse is pressed.
 
         Also updates the currently selected bbox in the main window.
         """
         super().mousePressEvent(event)
-        for i, bbox in enumerate(self.parent.img_bboxes):
-            selected = False
-            for j, point in enumerate(bbox):
-                # If cursor is in dragging circle
-                scaled = self.img_to_qt(point)
-                radius = (((event.pos().x() - scaled.x) ** 2 +
-                           (event.pos().y() - scaled.y) ** 2))
-
-                if radius < ImageWidget.DRAG_RADIUS ** 2:
-                    self.drag_mode = _SizeMode(i, j)
-                    selected = True
-
-            # If cursor is within rectangle
-            if not selected and self.bbox_to_polygon(bbox).containsPoint(event.pos(), Qt.OddEvenFill):
-                self.drag_mode = _PositionMode(i)
-                selected = True
-
-            if selected:
-                self.parent.color_change = len(self.parent.img_bboxes)*[False]
-                self.parent.color_change[i] = True
-                self.parent.img_bbox_idx = i
-                self.parent.update_id_list_ui()
-                self.parent.update_ui()
-                break
+        if not self.has_image():
+            return
+
+        hit = self.parent.img_bboxes.hit_test((event.pos().x(), event.pos().y()), ImageWidget.DRAG_RADIUS,
+                                              *self.transform())
+        if hit is None:
+            if self._zoom > 1:
+                self.drag_mode = _PanMode()
+                self._drag_timer.setInterval(self._frame_interval())
+            return
+
+        i, corner = hit
+        self.drag_mode = _PositionMode(i) if corner is None else _SizeMode(i, corner)
+        self._drag_start_box = self.parent.img_bboxes.boxes[i].copy()
+        self._drag_timer.setInterval(self._frame_interval())
+        self.parent.color_change = len(self.parent.img_bboxes)*[False]
+        self.parent.color_change[i] = True
+        self.parent.img_bbox_idx = i
+        self.parent.update_id_list_ui()
+        self.parent.update_ui()
 
     def mouseReleaseEvent(self, event):
         """Stops size/position change and update MainWindow when mouse is released."""
         super().mouseReleaseEvent(event)
+        if self._drag_timer.isActive():
+            self._drag_timer.stop()
+            self._apply_drag()
+        if self.drag_mode:
+            self.invalidate_overlay()
+        i = self._dragged_idx()
+        if (i is not None and self._drag_start_box is not None and i < len(self.parent.img_bboxes)
+                and (self.parent.img_bboxes.boxes[i] != self._drag_start_box).any()):
+            self.parent.record_box_change(i, self._drag_start_box)
+        self._drag_start_box = None
         self.drag_mode = None
         self.last_mouse_pos = None
-
+        self._pending_mouse_pos = None
+
+    def mouseDoubleClickEvent(self, event):
+        """Double click outside of the boxes fits the image into the widget again."""
+        super().mouseDoubleClickEvent(event)
+        if self.has_image() and self.parent.img_bboxes.hit_test(
+                (event.pos().x(), event.pos().y()), ImageWidget.DRAG_RADIUS, *self.transform()) is None:
+            self.reset_view()
+
+    def wheelEvent(self, event):
+        """Zoom in or out, keeping the image point under the mouse in place."""
+        if not self.has_image():
+            super().wheelEvent(event)
+            return
+
+        steps = event.angleDelta().y() / 120
+        max_zoom = max(ImageWidget.MAX_SCALE / self._fit_scale(), 1)
+        zoom = min(max(self._zoom * ImageWidget.ZOOM_STEP ** steps, 1), max_zoom)
+        if zoom == self._zoom:
+            return
+
+        mouse = np.array([event.pos().x(), event.pos().y()], dtype=np.float64)
+        anchor = self.qt_to_img(mouse)
+        self._zoom = zoom
+        self._center = anchor - (mouse - ImageWidget.MARGIN - self._content_size() / 2) / (self._fit_scale() * zoom)
+        self._view_changed()
+
+    @timed()
     def mouseMoveEvent(self, event):
-        """Update bounding box to mouse while dragging."""
+        """Queue the mouse position while dragging, the box follows on the next frame."""
         super().mouseMoveEvent(event)
+        pos = (event.pos().x(), event.pos().y())
         if self.drag_mode and self.last_mouse_pos:
-            bbox = self.parent.img_bboxes[self.drag_mode.bbox_idx]
-            delta = Point(
-                event.pos().x() - self.last_mouse_pos[0],
-                event.pos().y() - self.last_mouse_pos[1]
-            )
-
-            corners = []
-
-            if isinstance(self.drag_mode, _SizeMode):
-                corners = [
-                    (self.drag_mode.corner_idx, delta),
-                    (
-                        (self.drag_mode.corner_idx + 1) % 4,
-                        Point(delta.x, 0) if self.drag_mode.corner_idx % 2 else Point(0, delta.y)
-
-                    ),
-                    (
-                        (self.drag_mode.corner_idx - 1) % 4,
-                        Point(0, delta.y) if self.drag_mode.corner_idx % 2 else Point(delta.x, 0)
-                    )
-                ]
-
-            elif isinstance(self.drag_mode, _PositionMode):
-                corners = [(i, delta) for i in range(len(bbox))]
-
-            for corner in corners:
-                bbox[corner[0]] = self.qt_to_img(self.img_to_qt(bbox[corner[0]]) + corner[1])
-
-            self.update()
-
-        self.last_mouse_pos = (event.pos().x(), event.pos().y())
+            self._pending_mouse_pos = pos
+            if not self._drag_timer.isActive():
+                self._drag_timer.start()
+        else:
+            self.last_mouse_pos = pos
+
+    def _frame_interval(self):
+        """Milliseconds between two screen refreshes."""
+        window = self.window().windowHandle()
+        screen = window.screen() if window else QtGui.QGuiApplication.primaryScreen()
+        rate = screen.refreshRate() if screen else 0
+        return int(1000 / (rate if rate > 0 else ImageWidget.DEFAULT_REFRESH_RATE))
+
+    @timed()
+    def _apply_drag(self):
+        """Update bounding box to the latest mouse position and repaint only where it moved."""
+        if not self.drag_mode or self._pending_mouse_pos is None:
+            return
+
+        scale, _ = self.transform()
+        dx = (self._pending_mouse_pos[0] - self.last_mouse_pos[0]) / scale[0]
+        dy = (self._pending_mouse_pos[1] - self.last_mouse_pos[1]) / scale[1]
+        self.last_mouse_pos = self._pending_mouse_pos
+        self._pending_mouse_pos = None
+
+        if isinstance(self.drag_mode, _PanMode):
+            self._center = self._center - [dx, dy]
+            self._view_changed()
+            return
+
+        i = self.drag_mode.bbox_idx
+        old_rect = self._box_rect(i)
+
+        if isinstance(self.drag_mode, _SizeMode):
+            self.parent.img_bboxes.move_corner(i, self.drag_mode.corner_idx, dx, dy)
+
+        elif isinstance(self.drag_mode, _PositionMode):
+            self.parent.img_bboxes.move(i, dx, dy)
+
+        self.parent.mark_dirty()
+        self.update(old_rect.united(self._box_rect(i)))
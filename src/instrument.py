@@ -0,0 +1,136 @@
+"""Opt-in timing of the GUI's hot paths.
+
+Set FACE_TOOL_TRACE=1 before starting the tool to record every call of the functions
+decorated with @timed, along with the bytes of annotation and image files read and
+written during the call. Records are kept in ring buffers (FACE_TOOL_TRACE_SIZE calls
+in total), summarized by stats() and exported by export_chrome_trace() for
+chrome://tracing or Perfetto. When disabled, @timed returns the function unchanged and
+the byte counters return right away.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+from inspect import CO_VARARGS
+
+ENABLED = os.environ.get('FACE_TOOL_TRACE', '') not in ('', '0')
+RING_SIZE = int(os.environ.get('FACE_TOOL_TRACE_SIZE', 100000))
+
+# Durations kept per operation for the percentiles of stats()
+STATS_SIZE = 1000
+
+_T0 = time.perf_counter_ns()
+_events = deque(maxlen=RING_SIZE)  # (name, thread id, start ns, duration ns, bytes read, bytes written)
+_operations = {}  # name -> _Operation
+_thread_names = {}  # thread id -> name
+_local = threading.local()  # Bytes read and written by the current thread
+_totals = {'read': 0, 'written': 0}
+_lock = threading.Lock()  # Guards the operation statistics and _totals, updated from several threads
+
+
+class _Operation:
+    def __init__(self):
+        self.count = 0
+        self.durations = deque(maxlen=STATS_SIZE)  # Latest durations in ns
+        self.read = 0
+        self.written = 0
+
+
+def _counters():
+    if not hasattr(_local, 'read'):
+        _local.read = _local.written = 0
+        _thread_names[threading.get_ident()] = threading.current_thread().name
+    return _local
+
+
+def add_read(size):
+    """Count size bytes read from disk by the current thread."""
+    if ENABLED:
+        _counters().read += size
+        with _lock:
+            _totals['read'] += size
+
+
+def add_written(size):
+    """Count size bytes written to disk by the current thread."""
+    if ENABLED:
+        _counters().written += size
+        with _lock:
+            _totals['written'] += size
+
+
+def timed(name=None):
+    """Decorator recording each call of a function as operation name (default: its qualified name)."""
+    def decorate(function):
+        if not ENABLED:
+            return function
+
+        operation_name = name or function.__qualname__
+        operation = _operations.setdefault(operation_name, _Operation())
+        # PyQt drops signal arguments a slot does not take (e.g. checked of QAction.triggered),
+        # which it cannot tell for this wrapper, so they are dropped here
+        code = function.__code__
+        max_args = None if code.co_flags & CO_VARARGS else code.co_argcount
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if max_args is not None:
+                args = args[:max_args]
+            counters = _counters()
+            read, written = counters.read, counters.written
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                duration = time.perf_counter_ns() - start
+                read, written = counters.read - read, counters.written - written
+                with _lock:
+                    operation.count += 1
+                    operation.durations.append(duration)
+                    operation.read += read
+                    operation.written += written
+                _events.append((operation_name, threading.get_ident(), start, duration, read, written))
+        return wrapper
+    return decorate
+
+
+def stats():
+    """[(name, calls, mean ms, p95 ms, max ms, bytes read, bytes written)] sorted by name.
+
+    Mean, p95 and max are taken over the latest STATS_SIZE calls.
+    """
+    rows = []
+    for name, operation in sorted(_operations.items()):
+        with _lock:
+            durations = sorted(operation.durations)
+            count, read, written = operation.count, operation.read, operation.written
+        if not durations:
+            continue
+        p95 = durations[min(int(len(durations) * 0.95), len(durations) - 1)]
+        rows.append((name, count, sum(durations) / len(durations) / 1e6, p95 / 1e6, durations[-1] / 1e6,
+                     read, written))
+    return rows
+
+
+def totals():
+    """Bytes read and written since start up."""
+    with _lock:
+        return dict(_totals)
+
+
+def export_chrome_trace(path):
+    """Write the recorded calls in the Chrome trace event format, returns the number of events."""
+    pid = os.getpid()
+    events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+              for tid, name in list(_thread_names.items())]
+    for name, tid, start, duration, read, written in list(_events):
+        events.append({
+            'name': name, 'cat': 'face_tool', 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': (start - _T0) / 1000, 'dur': duration / 1000,
+            'args': {'bytes_read': read, 'bytes_written': written}
+        })
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+    return len(events) - len(_thread_names)
@@ -0,0 +1,210 @@
+"""Partial reader for annotation JSON files that never decodes the embeddings.
+
+The file is memory-mapped and walked structurally. Every value is decoded with the
+json module except ``object_info.face.result.embeddings``, whose byte span is only
+located (by searching for the closing bracket of each row) and captured as a RawJSON.
+Saving a document that holds a RawJSON copies those bytes back unchanged.
+"""
+import json
+import mmap
+import os
+import re
+import threading
+
+from .instrument import add_read
+
+EMBEDDINGS_PATH = ('object_info', 'face', 'result', 'embeddings')
+
+_BOM = b'\xef\xbb\xbf'
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR = re.compile(rb'[^,\]}\s]+')
+_STRUCTURE = re.compile(rb'[\[\]{}"]')
+
+
+class StaleRawJSONError(OSError):
+    """The file a RawJSON points into was changed by someone else."""
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class RawJSON:
+    """Byte span of a JSON value inside a file, decoded only on demand."""
+
+    def __init__(self, path, start, end):
+        self._lock = threading.Lock()
+        self.path = path
+        self.start = start
+        self.end = end
+        self.stamp = _stamp(path)
+
+    def __repr__(self):
+        return f"RawJSON({self.path!r}, {self.start}, {self.end})"
+
+    def read_bytes(self):
+        """The raw bytes of the value, exactly as they are in the file."""
+        with self._lock:
+            if _stamp(self.path) != self.stamp:
+                raise StaleRawJSONError(f"{self.path} changed since it was read")
+            with open(self.path, 'rb') as file:
+                file.seek(self.start)
+                return file.read(self.end - self.start)
+
+    def load(self):
+        """Decode the value."""
+        return json.loads(self.read_bytes())
+
+    def rebind(self, path, start, end):
+        """Point to the copy of the value at start:end in the rewritten path."""
+        with self._lock:
+            self.path = path
+            self.start = start
+            self.end = end
+            self.stamp = _stamp(path)
+
+
+def _skip_whitespace(buf, pos):
+    return _WHITESPACE.match(buf, pos).end()
+
+
+def _skip_value(buf, pos):
+    """Position right after the JSON value that starts at pos."""
+    first = buf[pos:pos + 1]
+    if first == b'"':
+        match = _STRING.match(buf, pos)
+        if not match:
+            raise ValueError(f"Unterminated string at byte {pos}")
+        return match.end()
+
+    if first not in (b'[', b'{'):
+        match = _SCALAR.match(buf, pos)
+        if not match:
+            raise ValueError(f"Expected value at byte {pos}")
+        return match.end()
+
+    # Only brackets and strings matter for finding the end of a container
+    depth = 0
+    while True:
+        match = _STRUCTURE.search(buf, pos)
+        if not match:
+            raise ValueError("Unexpected end of file")
+        char = match.group()
+        if char == b'"':
+            string = _STRING.match(buf, match.start())
+            if not string:
+                raise ValueError(f"Unterminated string at byte {match.start()}")
+            pos = string.end()
+            continue
+
+        depth += 1 if char in (b'[', b'{') else -1
+        pos = match.end()
+        if depth == 0:
+            return pos
+
+
+def _skip_number_lists(buf, pos):
+    """Position right after the list of number lists (the embeddings) that starts at pos.
+
+    Each row ends at the next "]", found with a memchr-speed find instead of a regex over
+    every byte. Rows holding anything but numbers fall back to _skip_value.
+    """
+    start = pos
+    pos = _skip_whitespace(buf, pos + 1)
+    if buf[pos:pos + 1] == b']':
+        return pos + 1
+    while True:
+        if buf[pos:pos + 1] != b'[':
+            return _skip_value(buf, start)
+        end = buf.find(b']', pos + 1)
+        if end < 0:
+            raise ValueError("Unexpected end of file")
+        if any(buf.find(char, pos + 1, end) >= 0 for char in (b'[', b'{', b'"')):
+            return _skip_value(buf, start)
+        pos = _skip_whitespace(buf, end + 1)
+        char = buf[pos:pos + 1]
+        if char == b']':
+            return pos + 1
+        if char != b',':
+            return _skip_value(buf, start)
+        pos = _skip_whitespace(buf, pos + 1)
+
+
+def _expect(buf, pos, char):
+    if buf[pos:pos + 1] != char:
+        raise ValueError(f"Expected {char.decode()} at byte {pos}")
+    return pos + 1
+
+
+def _parse_object(buf, pos, path, json_file):
+    """Decode the object at pos, descending only along EMBEDDINGS_PATH."""
+    obj = {}
+    pos = _skip_whitespace(buf, _expect(buf, pos, b'{'))
+    if buf[pos:pos + 1] == b'}':
+        return obj, pos + 1
+
+    while True:
+        key_end = _skip_value(buf, pos)
+        key = json.loads(buf[pos:key_end])
+        pos = _skip_whitespace(buf, _expect(buf, _skip_whitespace(buf, key_end), b':'))
+
+        key_path = path + (key,)
+        first = buf[pos:pos + 1]
+        if key_path == EMBEDDINGS_PATH and first == b'[':
+            end = _skip_number_lists(buf, pos)
+            obj[key] = RawJSON(json_file, pos, end)
+        elif key_path == EMBEDDINGS_PATH[:len(key_path)] and first == b'{':
+            obj[key], end = _parse_object(buf, pos, key_path, json_file)
+        else:
+            end = _skip_value(buf, pos)
+            obj[key] = json.loads(buf[pos:end])
+
+        pos = _skip_whitespace(buf, end)
+        if buf[pos:pos + 1] == b'}':
+            return obj, pos + 1
+        pos = _skip_whitespace(buf, _expect(buf, pos, b','))
+
+
+def load_partial(json_file):
+    """Read an annotation document, capturing the embeddings as a RawJSON."""
+    with open(json_file, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            raise ValueError(f"{json_file} is empty")
+        add_read(size)
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            pos = len(_BOM) if buf[:len(_BOM)] == _BOM else 0
+            doc, _ = _parse_object(buf, _skip_whitespace(buf, pos), (), json_file)
+            return doc
+
+
+def find_raw(doc):
+    """The RawJSON held by doc or None."""
+    try:
+        value = doc['object_info']['face']['result']['embeddings']
+    except (KeyError, TypeError):
+        return None
+    return value if isinstance(value, RawJSON) else None
+
+
+def dumps_with_raw(doc, **kwargs):
+    """Serialize doc to bytes, copying the RawJSON span of the embeddings unchanged.
+
+    Returns the bytes and the (start, end) of the raw span in them, or None.
+    """
+    raw = find_raw(doc)
+    if raw is None:
+        return json.dumps(doc, **kwargs).encode('utf-8'), None
+
+    marker = f"__raw_json_{id(raw)}__"
+    text = json.dumps(doc, default=lambda value: marker if value is raw else _unserializable(value), **kwargs)
+    prefix, suffix = text.split(f'"{marker}"')
+    prefix = prefix.encode('utf-8')
+    data = raw.read_bytes()
+    return b''.join((prefix, data, suffix.encode('utf-8'))), (len(prefix), len(prefix) + len(data))
+
+
+def _unserializable(value):
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
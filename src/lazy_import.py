@@ -0,0 +1,19 @@
+import importlib
+
+
+class LazyModule:
+    """Stand-in for a module that is only imported on first attribute access.
+
+    Used as ``np = LazyModule('numpy')`` for heavy modules, so they are not loaded while
+    the window starts up. importlib's module locks make the first access safe from any
+    thread.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        # Later lookups of attr find it directly instead of going through __getattr__
+        setattr(self, attr, value)
+        return value
@@ -1,35 +1,131 @@
-import glob
-import re
 import json
 import os
-import codecs
-import shutil
-import cv2
-from PyQt5 import QtGui, uic
-from PyQt5.QtWidgets import QFileDialog, QMainWindow, QAbstractItemView
+import sqlite3
+from PyQt5 import QtGui
+from PyQt5.QtCore import QSize, Qt, QTimer
+from PyQt5.QtWidgets import QFileDialog, QMainWindow, QAbstractItemView, QLabel, QInputDialog, QMessageBox, \
+    QProgressDialog
 
+from . import instrument
+from .annotation import (NEW_BOX_ID, face_result, json_path_for, load_annotation, new_annotation, snapshot,
+                         write_annotation)
+from .bbox_store import BBoxStore
+from .bootstrap_task import BootstrapTask
+from .cluster_review import ClusterReview
+from .dataset_index import DatasetIndex, DatasetIndexer
+from .detection_queue import DetectionQueue
+from .edit_journal import (FAILED_SUFFIX, EditJournal, apply_edit, find_journals, inverse, normalize_box,
+                           read_journal, recover_file, retire_journal)
+from .face_detect import needs_detection, set_detection
+from .file_list_model import FileListModel
+from .file_scanner import FileScanner
 from .id_dialog import IDDialog
-from .point import Point
+from .id_registry import IDRegistry
+from .id_rename import default_manifest_path, summarize, write_manifest
+from .id_rename_task import IDRenameTask
+from .id_suggest import EmbeddingIndex, EmbeddingIndexBuilder, SuggestionRanker
+from .image_pyramid import TileLoader
 from .image_widget import ImageWidget
+from .prefetch import LRUCache, Prefetcher
+from .thumbnail_cache import ThumbnailCache, default_cache_dir
+from .thumbnail_loader import ThumbnailLoader
+from .ui_loader import setup_ui
+from .writer import AnnotationWriter
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    # Number of images before and after the current one that are loaded in the background
+    PREFETCH_RADIUS = 2
+    PREFETCH_WORKERS = 2
+    # Upper bound for parsed annotations kept in memory
+    PREFETCH_CACHE_BYTES = 512 * 1024 * 1024
+    # Upper bound for decoded image tiles kept in memory
+    TILE_CACHE_BYTES = 256 * 1024 * 1024
+    # Upper bound for decoded pyramid levels tiles are cut from; a 100 megapixel photo takes 300 MB
+    LEVEL_CACHE_BYTES = 512 * 1024 * 1024
+    TILE_WORKERS = 2
+    # Backup of the JSON file before saving, one of AnnotationWriter.BACKUP_POLICIES
+    BACKUP_POLICY = 'always'
+    # Number of similar IDs suggested per box
+    SUGGESTION_COUNT = 5
+    # Cosine similarity a face needs to join a cluster in Cluster > Cluster Directory
+    CLUSTER_THRESHOLD = 0.8
+    # Processes used by Edit > Rename IDs, None for one per CPU
+    RENAME_WORKERS = None
+    # Processes creating missing annotations on load (File > Create Missing Annotations on Load)
+    BOOTSTRAP_WORKERS = None
+    # Face detector of File > Detect Faces in New Images, see face_detect.DETECTORS, and its options
+    # (e.g. {'model': ..., 'config': ...} for 'dnn')
+    DETECTOR = 'haar'
+    DETECTOR_OPTIONS = {}
+    # Minimum detection score, None for the detector's default
+    DETECT_THRESHOLD = None
+    # Processes detecting faces and number of images after the current one they work on
+    DETECT_WORKERS = 2
+    DETECT_AHEAD = 20
+    # Edge length of the file list thumbnails (View > Show Thumbnails), size of their on-disk cache
+    # and of the decoded thumbnails kept in memory
+    THUMBNAIL_SIZE = 96
+    THUMBNAIL_CACHE_BYTES = 1024 * 1024 * 1024
+    THUMBNAIL_MEMORY_BYTES = 64 * 1024 * 1024
+    THUMBNAIL_WORKERS = 2
+    # Seconds of edits that share one fsync of the edit journal, at most this much is lost in a crash
+    JOURNAL_SYNC_INTERVAL = 1.0
+
+    def __init__(self, id_list_path='id_cand_list.txt'):
         super().__init__()
-        uic.loadUi("main_window.ui", self)
+        setup_ui(self, 'main_window')
+
+        self.id_registry = IDRegistry(id_list_path)  # Candidate IDs shared by all widgets
+        self.id_registry.changed.connect(self.id_registry_changed)
 
-        self.img_files = []  # List of absolute paths to all image files
+        self.img_files = []  # FileListModel of absolute paths to all image files
         self.img_file_idx = None  # Current selected image file index
         self.img_json_file = ''  # Current selected image JSON file absolute path
         self.img_json = {}  # Current selected image JSON data
+        self.shown_img_file = None  # Image file currently set on the image widget
+        self.img_dirty = False  # Whether bboxes or ids of the current image were changed
 
         self.img_height = 0  # Current selected image height
         self.img_width = 0  # Current selected image width
-        self.img_bboxes = []  # Current selected image bboxes
+        self.img_bboxes = None  # Current selected image bboxes, a BBoxStore once an image is loaded
         self.img_ids = []  # Current selected image bbox IDs
         self.img_bbox_idx = None  # Current selected image - selected box
+        self.img_suggestions = None  # Current selected image ranked (id, similarity) per box
+        self.undo_stack = []  # Journaled edits of the current image, latest last
+        self.redo_stack = []  # Undone edits of the current image, latest last
 
         self.color_change = []
+        self.tile_loader = TileLoader(LRUCache(MainWindow.TILE_CACHE_BYTES), LRUCache(MainWindow.LEVEL_CACHE_BYTES),
+                                      MainWindow.TILE_WORKERS)
+        self.prefetcher = Prefetcher(self.tile_loader, MainWindow.PREFETCH_RADIUS, MainWindow.PREFETCH_WORKERS,
+                                     MainWindow.PREFETCH_CACHE_BYTES)
+        self.writer = AnnotationWriter(MainWindow.BACKUP_POLICY)
+        self.embedding_index = EmbeddingIndex()  # Labeled faces of the loaded directory
+        self.index_builder = EmbeddingIndexBuilder(self.embedding_index)
+        self.suggestion_ranker = SuggestionRanker(self.embedding_index, MainWindow.SUGGESTION_COUNT)
+        self.cluster_review = ClusterReview()
+        self.file_scanner = FileScanner()
+        self.dataset_index = None  # DatasetIndex of the loaded directory, None if it cannot be written
+        self.dataset_indexer = DatasetIndexer()
+        self.identity_faces = []  # (image path, face index) of the identity jumped to last
+        self.identity_face_idx = 0
+        self.rename_task = IDRenameTask(MainWindow.RENAME_WORKERS)
+        self.rename_plan = None  # (mapping, dry run results) waiting for confirmation
+        self.rename_manifest = None  # Undo manifest of the last rename
+        self.rename_progress = None  # QProgressDialog while a rename runs
+        self.bootstrap_task = BootstrapTask(MainWindow.BOOTSTRAP_WORKERS)
+        self.id_dialog = None  # IDDialog, created when it is first opened
+        self.detection_queue = DetectionQueue(MainWindow.DETECT_AHEAD, MainWindow.DETECT_WORKERS)
+        self.thumbnail_loader = ThumbnailLoader(ThumbnailCache(default_cache_dir(), MainWindow.THUMBNAIL_CACHE_BYTES),
+                                                LRUCache(MainWindow.THUMBNAIL_MEMORY_BYTES),
+                                                MainWindow.THUMBNAIL_SIZE, MainWindow.THUMBNAIL_WORKERS)
+        # Coalesces scroll events into one thumbnail request for the visible rows
+        self.thumbnail_timer = QTimer(self)
+        self.thumbnail_timer.setSingleShot(True)
+        self.thumbnail_timer.setInterval(50)
+        self.journal = None  # EditJournal of the loaded directory, None if it cannot be written
+        self.saved_seq = {}  # JSON path -> last journal sequence number of its latest save
         self.init_widgets()
 
     def init_widgets(self):
@@ -37,125 +133,382 @@ class MainWindow(QMainWindow):
         self.imgWidget = ImageWidget(self, objectName="img")
         self.mainLayout.insertWidget(0, self.imgWidget)
 
+        if instrument.ENABLED:
+            # Imported here, the panel only exists with FACE_TOOL_TRACE set
+            from .stats_dock import StatsDock
+            self.statsDock = StatsDock(self)
+            self.addDockWidget(Qt.RightDockWidgetArea, self.statsDock)
+            self.menuView.addSeparator()
+            self.menuView.addAction(self.statsDock.toggleViewAction())
+
+        self.writeStatusLabel = QLabel(self)
+        self.statusbar.addPermanentWidget(self.writeStatusLabel)
+        self.writer.statusChanged.connect(self.update_write_status)
+        self.index_builder.finished.connect(self.embedding_index_changed)
+        self.suggestion_ranker.ranked.connect(self.suggestions_ranked)
+        self.cluster_review.finished.connect(self.clustering_finished)
+        self.cluster_review.failed.connect(self.clustering_failed)
+        self.file_scanner.batchFound.connect(self.files_found)
+        self.file_scanner.finished.connect(self.scan_finished)
+        self.writer.written.connect(self.annotation_written)
+        self.dataset_indexer.finished.connect(self.dataset_indexed)
+        self.rename_task.progress.connect(self.rename_progress_changed)
+        self.rename_task.finished.connect(self.rename_finished)
+        self.rename_task.failed.connect(self.rename_failed)
+        self.bootstrap_task.finished.connect(self.bootstrap_finished)
+        self.detection_queue.detected.connect(self.faces_detected)
+
         # Make list items non-editable
         self.fileList.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.idList.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # All rows have the same height, which spares the view from measuring every row
+        self.fileList.setUniformItemSizes(True)
+        self.fileList.verticalScrollBar().valueChanged.connect(self.thumbnail_timer.start)
+        self.fileList.verticalScrollBar().rangeChanged.connect(self.thumbnail_timer.start)
+        self.thumbnail_timer.timeout.connect(self.request_visible_thumbnails)
 
         self.loadAction.triggered.connect(self.load_action)
         self.saveAction.triggered.connect(self.save_action)
         self.deleteAction.triggered.connect(self.delete_action)
         self.newBoxAction.triggered.connect(self.new_box_action)
         self.entireImageAction.triggered.connect(self.entire_image_action)
+        self.undoAction.triggered.connect(self.undo_action)
+        self.redoAction.triggered.connect(self.redo_action)
         self.prevPageButton.clicked.connect(self.prev_button_action)
         self.nextPageButton.clicked.connect(self.next_button_action)
         self.idDialogButton.clicked.connect(self.id_dialog_button_action)
         self.currentPageEdit.returnPressed.connect(self.current_page_action)
+        self.clusterAction.triggered.connect(self.cluster_action)
+        self.nextClusterAction.triggered.connect(lambda: self.go_to_face(self.cluster_review.step_cluster(1)))
+        self.prevClusterAction.triggered.connect(lambda: self.go_to_face(self.cluster_review.step_cluster(-1)))
+        self.nextMemberAction.triggered.connect(lambda: self.go_to_face(self.cluster_review.step_member(1)))
+        self.prevMemberAction.triggered.connect(lambda: self.go_to_face(self.cluster_review.step_member(-1)))
+        self.assignClusterAction.triggered.connect(self.assign_cluster_action)
+        self.nextUnknownAction.triggered.connect(self.next_unknown_action)
+        self.jumpToIdentityAction.triggered.connect(self.jump_to_identity_action)
+        self.nextIdentityFaceAction.triggered.connect(lambda: self.step_identity_face(1))
+        self.prevIdentityFaceAction.triggered.connect(lambda: self.step_identity_face(-1))
+        self.renameIdsAction.triggered.connect(self.rename_ids_action)
+        self.undoRenameAction.triggered.connect(self.undo_rename_action)
+        self.detectFacesAction.toggled.connect(self.detect_faces_toggled)
+        self.thumbnailsAction.toggled.connect(self.thumbnails_toggled)
         self.fileList.selectionChanged = self.file_selection_changed
         self.idList.selectionChanged = self.id_selection_changed
 
+    def closeEvent(self, event):
+        """Stop background workers when the window is closed."""
+        self.file_scanner.cancel()
+        self.dataset_indexer.cancel()
+        self.detection_queue.stop()
+        self.prefetcher.shutdown()
+        self.tile_loader.shutdown()
+        self.thumbnail_loader.shutdown()
+        self.index_builder.cancel()
+        self.suggestion_ranker.shutdown()
+        self.writer.shutdown()
+        self.close_journal()
+        super().closeEvent(event)
+
+    @instrument.timed()
     def load_action(self):
-        """Open file dialog and get directory of images."""
+        """Open file dialog and scan the directory of images in the background."""
         dir_name = QFileDialog.getExistingDirectory(self)
-        self.img_files = glob.glob(f"{dir_name}/*.jpg")
-        self.img_files.extend(glob.glob(f"{dir_name}/*.png"))
+        if not dir_name:
+            return
 
-        def key(string):
-            key_list = []
-            for c in re.split('([0-9]+)', string):
-                if string.isdigit():
-                    key_list.append(int(string))
-                else:
-                    key_list.append(string.lower())
+        self.file_scanner.cancel()
+        self.index_builder.cancel()
+        self.dataset_indexer.cancel()
+        if self.dataset_index is not None:
+            self.dataset_index.close()
+            self.dataset_index = None
+        self.identity_faces = []
+        self.detection_queue.reset()
+        self.prefetcher.cancel()
+        self.prefetcher.cache.clear()
+        self.tile_loader.clear()
 
-            return key_list
+        self.close_journal()
+        self.recover_edits(dir_name)
+        try:
+            self.journal = EditJournal(dir_name, MainWindow.JOURNAL_SYNC_INTERVAL)
+        except OSError:
+            self.journal = None  # E.g. a read-only directory, edits are only kept in memory then
 
-        self.img_files = sorted(self.img_files, key=key)
-        self.img_file_idx = 0
+        self.img_files = FileListModel(dir_name, self)
+        if self.thumbnailsAction.isChecked():
+            self.img_files.set_thumbnails(self.thumbnail_loader)
+        self.img_file_idx = None
+        self.fileList.setModel(self.img_files)
+        self.clear_image()
+        self.statusLabel.setText("Scanning...")
+        self.file_scanner.start(dir_name)
 
-        self.process_image()
-        self.update_file_list_ui()
-        self.update_ui()
+    def clear_image(self):
+        """Forget the current image until the first scanned batch opens one."""
+        self.img_json_file = ''
+        self.img_json = {}
+        self.img_dirty = False
+        self.img_width = self.img_height = 0
+        self.img_bboxes = None
+        self.img_ids = []
+        self.img_bbox_idx = None
+        self.img_suggestions = None
+        self.color_change = []
+        self.undo_stack = []
+        self.redo_stack = []
+        self.shown_img_file = None
+        self.imgWidget.clear_image()
+        self.update_id_list_ui()
+        self.currentPageEdit.clear()
+        self.totalPageLabel.clear()
+
+    @instrument.timed()
+    def files_found(self, entries):
+        """Add a batch of scanned files, the first batch opens the first image."""
+        current = self.img_files[self.img_file_idx] if self.img_file_idx is not None else None
+        self.img_files.add_files(entries)
+
+        if current is None:
+            self.img_file_idx = 0
+            self.process_image()
+            self.update_ui()
+        else:
+            # Files sorting before the current one shift it down
+            self.img_file_idx = self.img_files.index_of(current)
+            self.update_page_ui()
+        self.thumbnail_timer.start()
+
+    def scan_finished(self, count):
+        """Index the embeddings and faces of the complete directory."""
+        self.index_builder.start(self.img_files)
+        self.statusLabel.setText(f"{count} images" if count else "No images found")
+        if self.bootstrapAction.isChecked():
+            self.bootstrap_task.start(self.img_files)
+
+        try:
+            self.dataset_index = DatasetIndex.for_directory(self.img_files.dir_name)
+        except sqlite3.Error:
+            # E.g. a read-only directory, navigation by index is not available then
+            self.dataset_index = None
+            return
+        self.start_dataset_indexer()
+
+    def recover_edits(self, dir_name):
+        """Offer to replay the unsaved edits that earlier sessions left in the journals of dir_name."""
+        journals = []
+        unsaved = {}  # JSON path -> (base, edits, journal)
+        for path in find_journals(dir_name):
+            try:
+                files = read_journal(path)
+            except OSError:
+                continue  # Left alone, maybe readable next time
+            journals.append(path)
+            # A file edited by several sessions keeps the edits of the latest one, which was
+            # made against the file on disk
+            unsaved.update((json_file, (base, edits, path)) for json_file, (base, edits) in files.items())
+        count = sum(len(edits) for _, edits, _ in unsaved.values())
+        if not count:
+            for path in journals:
+                retire_journal(path)
+            return
+
+        answer = QMessageBox.question(
+            self, "Recover Edits", f"{count} unsaved edit(s) of {len(unsaved)} image(s) from an earlier session "
+                                   f"were found. Recover them?",
+            QMessageBox.Yes | QMessageBox.Discard | QMessageBox.Cancel, QMessageBox.Yes)
+        if answer == QMessageBox.Cancel:
+            return  # Asked again next time
+
+        errors = {}  # JSON path -> error message
+        if answer == QMessageBox.Yes:
+            for json_file, (base, edits, _) in unsaved.items():
+                try:
+                    self.writer.submit(json_file, recover_file(json_file, base, edits))
+                except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+                    errors[json_file] = str(e)
+            self.writer.flush()
+            errors.update((json_file, error) for json_file, error in self.writer.failed_writes().items()
+                          if json_file in unsaved)
+
+        # A journal goes only once all of its edits are on disk, otherwise it is kept as the last copy
+        failed = {unsaved[json_file][2] for json_file in errors}
+        kept = []
+        for path in journals:
+            if path not in failed:
+                retire_journal(path)
+            else:
+                kept.append(path + FAILED_SUFFIX if retire_journal(path, failed=True) else path)
+        if errors:
+            details = "\n".join(f"{json_file}: {error}" for json_file, error in errors.items())
+            QMessageBox.warning(self, "Recover Edits", f"{len(errors)} image(s) could not be recovered, their edits "
+                                                       f"are kept in {', '.join(kept)}:\n{details}")
+
+    def close_journal(self):
+        """Mark the files saved since the last write notification and close the journal."""
+        if self.journal is None:
+            return
+        self.writer.flush()
+        failed = self.writer.failed_writes()
+        for json_file, seq in self.saved_seq.items():
+            if json_file not in failed:
+                self.journal.saved(json_file, seq)
+        self.saved_seq.clear()
+        self.journal.close()
+        self.journal = None
+
+    def thumbnails_toggled(self, checked):
+        """Show thumbnails with boxes in the file list or only file names."""
+        size = MainWindow.THUMBNAIL_SIZE if checked else 0
+        self.fileList.setIconSize(QSize(size, size))
+        if self.img_files:
+            self.img_files.set_thumbnails(self.thumbnail_loader if checked else None)
+        self.thumbnail_timer.start()
+
+    def request_visible_thumbnails(self):
+        """Load the thumbnails of the file list rows in view, dropping requests for rows scrolled past."""
+        if not self.thumbnailsAction.isChecked() or not self.img_files:
+            return
+        viewport = self.fileList.viewport().rect()
+        first = self.fileList.indexAt(viewport.topLeft())
+        last = self.fileList.indexAt(viewport.bottomLeft())
+        first_row = first.row() if first.isValid() else 0
+        last_row = last.row() if last.isValid() else len(self.img_files) - 1
+        self.thumbnail_loader.request([self.img_files[row] for row in range(first_row, last_row + 1)])
+
+    def start_dataset_indexer(self):
+        """Bring the dataset index up to date with the files on disk."""
+        if self.dataset_index is not None:
+            self.dataset_indexer.start(self.dataset_index.db_path, self.img_files, self.id_registry.name_set)
+
+    def bootstrap_finished(self, created, errors):
+        """Report the annotations created on load and index them."""
+        text = f"Created {created} annotation(s)"
+        if errors:
+            text += f", {len(errors)} failed"
+            self.statusLabel.setToolTip("\n".join(f"{img_file}: {error}" for img_file, error in errors))
+        self.statusLabel.setText(text)
+        if created:
+            self.start_dataset_indexer()
+
+    def detect_faces_toggled(self, checked):
+        """Start or stop detecting faces in images that have no boxes yet."""
+        if not checked:
+            self.detection_queue.stop()
+            return
+
+        options = dict(MainWindow.DETECTOR_OPTIONS)
+        if MainWindow.DETECT_THRESHOLD is not None:
+            options['threshold'] = MainWindow.DETECT_THRESHOLD
+        try:
+            self.detection_queue.start(MainWindow.DETECTOR, options)
+        except Exception as e:  # cv2.error, missing model files or invalid options
+            self.detectFacesAction.setChecked(False)
+            self.statusLabel.setText("Face detector not available")
+            self.statusLabel.setToolTip(str(e))
+            return
+        if self.img_files:
+            self.detection_queue.request(self.img_files, self.img_file_idx)
+
+    def faces_detected(self, img_file, boxes, algorithm, model, error):
+        """Store the detected boxes of an image that was neither detected nor labeled before."""
+        if error:
+            self.statusLabel.setText(f"Face detection failed for {os.path.basename(img_file)}")
+            self.statusLabel.setToolTip(error)
+            return
+
+        json_file = json_path_for(img_file)
+        if json_file == self.img_json_file:
+            # Shown right now, the boxes are saved along with the user's edits
+            if self.img_dirty or not needs_detection(self.img_json):
+                return
+            set_detection(self.img_json, boxes, algorithm, model)
+            self.img_ids = face_result(self.img_json)['ids']
+            self.img_bboxes = BBoxStore.from_normalized(boxes, self.img_ids, self.img_width, self.img_height)
+            for i, (box, name) in enumerate(zip(boxes, self.img_ids)):
+                self.record_edit({'op': 'insert', 'index': i, 'box': list(box), 'id': name})
+            self.color_change = len(self.img_bboxes) * [False]
+            self.img_suggestions = None
+            self.update_id_list_ui()
+            self.mark_dirty()
+            self.update_ui()
+            return
 
+        pending_json = self.writer.pending_document(json_file)
+        doc = snapshot(pending_json) if pending_json is not None else self.prefetcher.take_annotation(json_file)
+        try:
+            if doc is None:
+                doc = load_annotation(json_file) if os.path.exists(json_file) else new_annotation(img_file)
+        except (OSError, ValueError) as e:
+            self.statusLabel.setText(f"Face detection failed for {os.path.basename(img_file)}")
+            self.statusLabel.setToolTip(str(e))
+            return
+        if needs_detection(doc):
+            set_detection(doc, boxes, algorithm, model)
+            self.writer.submit(json_file, doc)
+
+    def dataset_indexed(self, updated):
+        self.statusLabel.setText(f"Indexed {updated} changed file(s)")
+
+    def annotation_written(self, json_file):
+        """Keep the journal, dataset index and thumbnails up to date with files saved in the background."""
+        # The latest save may still be queued behind this write
+        if json_file in self.saved_seq and self.writer.pending_document(json_file) is None:
+            self.journal.saved(json_file, self.saved_seq.pop(json_file))
+
+        img_file = self.dataset_index.image_for_json(json_file) if self.dataset_index is not None else None
+        if img_file is None and json_file == self.img_json_file:
+            img_file = self.img_files[self.img_file_idx]
+        if img_file is None:
+            return
+        self.thumbnail_loader.invalidate(img_file)
+        self.thumbnail_timer.start()
+        if self.dataset_index is not None:
+            self.dataset_indexer.reindex(img_file)
+
+    @instrument.timed()
     def process_image(self):
         """Load json data for current file."""
-        dir_name = os.path.dirname(self.img_files[self.img_file_idx])
-        file_root = os.path.splitext(os.path.basename(self.img_files[self.img_file_idx]))[0]
-        self.img_json_file = os.path.join(dir_name, f"{file_root}.json")
-
-        if not os.path.exists(self.img_json_file):
-            cv2_img = cv2.imread(self.img_files[self.img_file_idx])
-            cv2_img_width = cv2_img.shape[1]
-            cv2_img_height = cv2_img.shape[0]
-            img_size = os.path.getsize(self.img_files[self.img_file_idx])
-
-            self.img_json = {
-                "dataset_info": {
-                    "description": ".",
-                    "dataset_version": "1.0",
-                    "dateset_created": "",
-                    "attributes": {
-                        "image_augmented": "",
-                        "answer_refined": ""
-                    },
-                    "dataset_created": ""
-                },
-                "image_info": {
-                    "image_name": file_root,
-                    "attributes": {
-                        "color": 3,
-                        "image_size": img_size,
-                        "image_width": cv2_img_width,
-                        "image_height": cv2_img_height,
-                        "image_path": self.img_files[self.img_file_idx]
-                    }
-                },
-                "object_info": {
-                    "face": {
-                        "algorithm": {
-                            "face_detect_algorithm": "",
-                            "face_recog_algorithm": "",
-                            "face_age_gender_algorithm": "",
-                            "face_detect_model": "",
-                            "face_recog_model": "",
-                            "face_age_gender_model": ""
-                        },
-                        "result": {
-                            "bboxes": [],
-                            "embeddings": [],
-                            "ids": [],
-                            "ages": [],
-                            "genders": []
-                        }
-                    },
-                    "face_detect_algorithm": "",
-                    "face_recog_algorithm": "",
-                    "face_detect_model": "",
-                    "face_recog_model": "",
-                }
-            }
-            with open(self.img_json_file, 'w', encoding='utf-8') as json_file:
-                json.dump(self.img_json, json_file, ensure_ascii=False, indent=4)
+        self.img_json_file = json_path_for(self.img_files[self.img_file_idx])
+
+        cached_json = self.prefetcher.take_annotation(self.img_json_file)
+        pending_json = self.writer.pending_document(self.img_json_file)
+        if pending_json is not None:
+            # Queued for writing, the file on disk is not up to date yet
+            self.img_json = snapshot(pending_json)
+
+        elif cached_json is not None:
+            self.img_json = cached_json
+
+        elif not os.path.exists(self.img_json_file):
+            self.img_json = new_annotation(self.img_files[self.img_file_idx])
+            write_annotation(self.img_json_file, self.img_json)
 
         else:
-            self.img_json = json.load(codecs.open(self.img_json_file, 'r', 'utf-8-sig'))
+            # Embeddings are never read here; with a sidecar they are only a small reference
+            self.img_json = load_annotation(self.img_json_file)
 
         self.img_ids = self.img_json['object_info']['face']['result']['ids']
         self.img_width = self.img_json['image_info']['attributes']['image_width']
         self.img_height = self.img_json['image_info']['attributes']['image_height']
 
-        # Turn JSON list into list of Points
-        self.img_bboxes = list(map(lambda a: [
-            Point(self.img_width * a[0], self.img_height * a[1]),
-            Point(self.img_width * a[2], self.img_height * a[1]),
-            Point(self.img_width * a[2], self.img_height * a[3]),
-            Point(self.img_width * a[0], self.img_height * a[3])
-        ], self.img_json['object_info']['face']['result']['bboxes']))
+        # Turn JSON list into pixel boxes, sharing the id list with the document
+        self.img_bboxes = BBoxStore.from_normalized(self.img_json['object_info']['face']['result']['bboxes'],
+                                                    self.img_ids, self.img_width, self.img_height)
 
         self.color_change = len(self.img_bboxes) * [False]
+        self.img_dirty = False
+        self.img_suggestions = None
+        self.undo_stack = []
+        self.redo_stack = []
 
         self.img_bbox_idx = 0
         self.update_id_list_ui()
 
+        self.prefetcher.request(self.img_files, self.img_file_idx)
+        self.detection_queue.request(self.img_files, self.img_file_idx)
+
+    @instrument.timed()
     def update_ui(self):
         """Update all ui elements except lists."""
         if not self.img_files:
@@ -163,43 +516,77 @@ class MainWindow(QMainWindow):
 
         self.statusLabel.clear()
 
-        # Update image
-        pix_map_image = QtGui.QPixmap(self.img_files[self.img_file_idx])
-        self.imgWidget.setPixmap(pix_map_image)
-        self.imgWidget.setScaledContents(True)
+        # Update image only when it changed, its tiles are loaded by the widget
+        img_file = self.img_files[self.img_file_idx]
+        if img_file != self.shown_img_file:
+            self.imgWidget.set_image(img_file, self.img_width, self.img_height)
+            self.shown_img_file = img_file
+        self.imgWidget.invalidate_overlay()
 
-        # Update page selection
-        self.currentPageEdit.setText(str(self.img_file_idx + 1))
-        self.currentPageEdit.setValidator(
-            QtGui.QIntValidator(1, len(self.img_files), self))
-        self.totalPageLabel.setText(f"/ {len(self.img_files)}")
+        self.update_page_ui()
 
         # Update list selections
-        self.fileList.setCurrentIndex(
-            self.fileList.model().createIndex(self.img_file_idx if self.img_file_idx else 0, 0))
-
-        self.idList.setCurrentIndex(
-            self.idList.model().createIndex(self.img_bbox_idx if self.img_bbox_idx else 0, 0))
+        self.fileList.setCurrentIndex(self.img_files.index(self.img_file_idx if self.img_file_idx else 0, 0))
 
-    def update_file_list_ui(self):
-        """Update model for file list."""
-        model = QtGui.QStandardItemModel()
-        for img_file in self.img_files:
-            model.appendRow(QtGui.QStandardItem(os.path.basename(img_file)))
+        if self.img_bbox_idx is not None:
+            self.idList.setCurrentIndex(self.idList.model().createIndex(self.img_bbox_idx, 0))
 
-        self.fileList.setModel(model)
+    def update_page_ui(self):
+        """Update page selection."""
+        self.currentPageEdit.setText(str(self.img_file_idx + 1))
+        self.currentPageEdit.setValidator(
+            QtGui.QIntValidator(1, len(self.img_files), self))
+        self.totalPageLabel.setText(f"/ {len(self.img_files)}")
 
+    @instrument.timed()
     def update_id_list_ui(self):
         """Update model for text list."""
         model = QtGui.QStandardItemModel()
-        for name in self.img_ids:
-            model.appendRow(QtGui.QStandardItem(name))
+        for i, name in enumerate(self.img_ids):
+            item = QtGui.QStandardItem(name)
+            suggestions = self.box_suggestions(i)
+            if suggestions:
+                if name not in self.id_registry:
+                    item.setText(f"{name} → {suggestions[0][0]} ({suggestions[0][1]:.2f})")
+                item.setToolTip("\n".join(f"{n} ({score:.2f})" for n, score in suggestions))
+            model.appendRow(item)
 
         self.idList.setModel(model)
 
+    def box_suggestions(self, bbox_idx):
+        """Known IDs ranked by embedding similarity to a box of the current image."""
+        if not self.img_json:
+            return []
+
+        if self.img_suggestions is None:
+            results = self.suggestion_ranker.result(self.img_json_file)
+            if results is None:
+                # Ranked on a thread, suggestions_ranked shows them
+                self.suggestion_ranker.request(self.img_json_file, self.img_json,
+                                               self.id_registry.name_set.__contains__)
+                return []
+            # Added or deleted boxes no longer line up with the stored embeddings
+            self.img_suggestions = results if len(results) == len(self.img_ids) else []
+
+        if bbox_idx is None or bbox_idx >= len(self.img_suggestions):
+            return []
+        return self.img_suggestions[bbox_idx]
+
+    def suggestions_ranked(self, json_file):
+        """Show the suggestions of the current image once they were ranked."""
+        if json_file == self.img_json_file and self.img_suggestions is None:
+            self.update_id_list_ui()
+
+    def embedding_index_changed(self):
+        """Recompute suggestions once the embedding index was (re)built."""
+        self.suggestion_ranker.clear()
+        self.img_suggestions = None
+        if self.img_files:
+            self.update_id_list_ui()
+
     def prev_button_action(self):
         """Go to previous image, do nothing if already at beginning."""
-        if self.img_file_idx > 0:
+        if self.img_file_idx is not None and self.img_file_idx > 0:
             self.save_action()
             self.img_file_idx -= 1
             self.process_image()
@@ -207,7 +594,7 @@ class MainWindow(QMainWindow):
 
     def next_button_action(self):
         """Go to next image, do nothing if already at end."""
-        if self.img_file_idx < len(self.img_files) - 1:
+        if self.img_file_idx is not None and self.img_file_idx < len(self.img_files) - 1:
             self.save_action()
             self.img_file_idx += 1
             self.process_image()
@@ -215,20 +602,102 @@ class MainWindow(QMainWindow):
 
     def current_page_action(self):
         """Go to specific image entered into page selection."""
+        if self.img_file_idx is None:
+            return
         if int(self.currentPageEdit.text()) - 1 != self.img_file_idx:
+            # Neighbours of the old page are of no use anymore. The page is left without
+            # saving, so its cached document may hold unsaved edits
+            self.prefetcher.cancel()
+            self.prefetcher.take_annotation(self.img_json_file)
             self.img_file_idx = int(self.currentPageEdit.text()) - 1
             self.process_image()
             self.update_ui()
 
     def id_dialog_button_action(self):
         try:
-            dialog = IDDialog(self)
-            dialog.exec_()
+            if self.id_dialog is None:
+                self.id_dialog = IDDialog(self)
+            self.id_dialog.edit_box()
         except (TypeError, IndexError):
             self.statusLabel.setText("No Box available")
 
+    def mark_dirty(self):
+        """Remember that bboxes or ids of the current image changed and need saving."""
+        self.img_dirty = True
+
+    def record_edit(self, edit):
+        """Journal an edit of the current image that was applied already, it can be undone from now on."""
+        if self.journal is not None:
+            self.journal.append(self.img_json_file, edit)
+        self.undo_stack.append(edit)
+        self.redo_stack = []
+        self.mark_dirty()
+
+    def record_box_change(self, idx, old_box):
+        """Journal that box idx was moved or resized from old_box (pixels)."""
+        self.record_edit({'op': 'set_box', 'index': idx,
+                          'old': normalize_box(old_box, self.img_width, self.img_height),
+                          'new': normalize_box(self.img_bboxes.boxes[idx], self.img_width, self.img_height)})
+
+    def undo_action(self):
+        """Revert the last edit of the current image."""
+        if not self.undo_stack:
+            self.statusLabel.setText("Nothing to undo")
+            return
+        edit = self.undo_stack.pop()
+        self.replay_edit(inverse(edit))
+        self.redo_stack.append(edit)
+
+    def redo_action(self):
+        """Apply the last undone edit of the current image again."""
+        if not self.redo_stack:
+            self.statusLabel.setText("Nothing to redo")
+            return
+        edit = self.redo_stack.pop()
+        self.replay_edit(edit)
+        self.undo_stack.append(edit)
+
+    def replay_edit(self, edit):
+        """Apply a journaled edit to the current image and journal it again, so replaying the journal ends here too."""
+        apply_edit(self.img_bboxes, edit, self.img_width, self.img_height)
+        if self.journal is not None:
+            self.journal.append(self.img_json_file, edit)
+        self.mark_dirty()
+        self.img_suggestions = None
+
+        self.img_bbox_idx = min(edit['index'], len(self.img_bboxes) - 1) if len(self.img_bboxes) else None
+        self.color_change = len(self.img_bboxes) * [False]
+        if self.img_bbox_idx is not None:
+            self.color_change[self.img_bbox_idx] = True
+        self.update_id_list_ui()
+        self.update_ui()
+
+    def update_write_status(self, pending, failed):
+        """Show pending and failed background writes in the status bar."""
+        text = []
+        if pending:
+            text.append(f"Saving {pending}...")
+        if failed:
+            text.append(f"{failed} failed write(s)")
+        self.writeStatusLabel.setText(" ".join(text))
+        self.writeStatusLabel.setToolTip(
+            "\n".join(f"{path}: {error}" for path, error in self.writer.failed_writes().items()))
+
+    @instrument.timed()
     def save_action(self):
-        """Save data back to json file."""
+        """Save data back to json file.
+
+        Nothing is written if the image was not changed and is already marked as refined.
+        The file itself is written in the background by the AnnotationWriter.
+        """
+        if not self.img_json:
+            return
+
+        refined = self.img_json['dataset_info']['attributes']['answer_refined'] is True
+        if not self.img_dirty and refined:
+            self.statusLabel.setText("No changes")
+            return
+
         try:
             # check if the input can be converted to int
             self.update_id_list_ui()
@@ -237,28 +706,18 @@ class MainWindow(QMainWindow):
 
             self.img_json['object_info']['face']['result']['ids'] = self.img_ids
 
-            # Turn list of Points back into JSON list
-            self.img_json['object_info']['face']['result']['bboxes'] = []
-            for idx1, bbox in enumerate(self.img_bboxes):
-                self.img_json['object_info']['face']['result']['bboxes'].append([0, 0, 0, 0])
-                for idx2, p in enumerate(bbox):
-                    if idx2 == 0:
-                        self.img_json['object_info']['face']['result']['bboxes'][idx1][0] = \
-                            p.x / self.img_width
-                        self.img_json['object_info']['face']['result']['bboxes'][idx1][1] = \
-                            p.y / self.img_height
-
-                    if idx2 == 2:
-                        self.img_json['object_info']['face']['result']['bboxes'][idx1][2] = \
-                            p.x / self.img_width
-                        self.img_json['object_info']['face']['result']['bboxes'][idx1][3] = \
-                            p.y / self.img_height
-
-            original_file = f"{self.img_json_file}~"
-            shutil.copy2(self.img_json_file, original_file)
-
-            with open(self.img_json_file, 'w', encoding='utf-8') as json_file:
-                json.dump(self.img_json, json_file, ensure_ascii=False, indent=4)
+            # Turn pixel boxes back into JSON list
+            self.img_json['object_info']['face']['result']['bboxes'] = \
+                self.img_bboxes.to_normalized(self.img_width, self.img_height)
+
+            self.writer.submit(self.img_json_file, snapshot(self.img_json))
+            if self.journal is not None:
+                self.saved_seq[self.img_json_file] = self.journal.last_seq()
+            self.embedding_index.update_ids(self.img_json_file, self.img_ids)
+            # The labels are examples for the other images
+            self.suggestion_ranker.clear()
+            self.prefetcher.put_annotation(self.img_json_file, self.img_json)
+            self.img_dirty = False
 
             self.statusLabel.setText("Saved!")
         except IndexError:
@@ -266,10 +725,17 @@ class MainWindow(QMainWindow):
 
     def delete_action(self):
         """Delete current selected bbox."""
-        del self.img_bboxes[self.img_bbox_idx]
-        del self.img_ids[self.img_bbox_idx]
+        if not self.img_json or self.img_bbox_idx is None or not 0 <= self.img_bbox_idx < len(self.img_bboxes):
+            return
+        box = normalize_box(self.img_bboxes.boxes[self.img_bbox_idx], self.img_width, self.img_height)
+        name = self.img_ids[self.img_bbox_idx]
+        self.img_bboxes.delete(self.img_bbox_idx)  # Deletes the id as well
+        self.record_edit({'op': 'delete', 'index': self.img_bbox_idx, 'box': box, 'id': name})
+        self.img_suggestions = None
 
-        if self.img_bbox_idx == len(self.img_bboxes):
+        if not len(self.img_bboxes):
+            self.img_bbox_idx = None
+        elif self.img_bbox_idx == len(self.img_bboxes):
             self.img_bbox_idx -= 1
 
         self.update_id_list_ui()
@@ -277,21 +743,25 @@ class MainWindow(QMainWindow):
 
     def new_box_action(self):
         """Add a new box with default size and text."""
-        self.img_bboxes.append([Point(0, 0), Point(100, 0), Point(100, 100), Point(0, 100)])
-        self.img_ids.append("--추가해주세요--")
+        if not self.img_json:
+            return
+        self.img_bboxes.append([0, 0, 100, 100], NEW_BOX_ID)
+        self.record_edit({'op': 'insert', 'index': len(self.img_bboxes) - 1,
+                          'box': normalize_box([0, 0, 100, 100], self.img_width, self.img_height), 'id': NEW_BOX_ID})
+        self.img_bbox_idx = len(self.img_bboxes) - 1
+        self.img_suggestions = None
 
         self.update_id_list_ui()
         self.update_ui()
 
     def entire_image_action(self):
         """Change current bbox to cover entire image."""
+        if not self.img_json:
+            return
         try:
-            self.img_bboxes[self.img_bbox_idx] = [
-                Point(0, 0),
-                Point(self.img_width, 0),
-                Point(self.img_width, self.img_height),
-                Point(0, self.img_height)
-            ]
+            old_box = self.img_bboxes.boxes[self.img_bbox_idx].copy()
+            self.img_bboxes.set_box(self.img_bbox_idx, [0, 0, self.img_width, self.img_height])
+            self.record_box_change(self.img_bbox_idx, old_box)
             self.update_ui()
         except IndexError:
             self.statusLabel.setText("Box unavailable")
@@ -299,10 +769,13 @@ class MainWindow(QMainWindow):
     def file_selection_changed(self, selected, _):
         """Get new file selection and update UI."""
         indexes = selected.indexes()
-        if len(indexes) <= 0:
+        # update_ui selects the current file too, that must not reload it
+        if len(indexes) <= 0 or indexes[0].row() == self.img_file_idx:
             return
 
         self.save_action()
+        if abs(indexes[0].row() - self.img_file_idx) > self.prefetcher.radius:
+            self.prefetcher.cancel()
         self.img_file_idx = indexes[0].row()
 
         self.process_image()
@@ -317,12 +790,311 @@ class MainWindow(QMainWindow):
         if self.img_bboxes:
             self.color_change = len(self.img_bboxes) * [0]
             # Not in list
-            with open('id_cand_list.txt', 'r') as file:
-                items = file.read().splitlines()
             for i, name in enumerate(self.img_ids):
-                if name not in items:
+                if name not in self.id_registry:
                     self.color_change[i] = 2
 
             self.color_change[self.img_bbox_idx] = 1
 
         self.update_ui()
+
+    def id_registry_changed(self):
+        """Recolor boxes and re-rank suggestions after the candidate list file changed."""
+        self.suggestion_ranker.clear()
+        self.img_suggestions = None
+        for i, name in enumerate(self.img_ids):
+            if i < len(self.color_change) and self.color_change[i] != 1:
+                self.color_change[i] = 0 if name in self.id_registry else 2
+        self.imgWidget.invalidate_overlay()
+        if self.dataset_index is not None:
+            self.dataset_indexer.set_candidates(self.id_registry.name_set)
+
+    def cluster_action(self):
+        """Cluster all faces of the loaded directory in the background."""
+        if not self.img_files or self.cluster_review.running():
+            return
+
+        # Clustering reads the files, so everything has to be on disk first
+        self.save_action()
+        self.writer.flush()
+
+        json_files = [json_path_for(img_file) for img_file in self.img_files]
+        self.cluster_review.start(json_files, self.id_registry.name_set.__contains__, MainWindow.CLUSTER_THRESHOLD)
+        self.statusLabel.setText("Clustering...")
+
+    def clustering_finished(self):
+        """Go to the first face of the first cluster."""
+        if not self.cluster_review.result:
+            self.statusLabel.setText("No embeddings to cluster")
+            return
+        self.go_to_face(self.cluster_review.member())
+
+    def clustering_failed(self, error):
+        self.statusLabel.setText("Clustering failed")
+        self.statusLabel.setToolTip(error)
+
+    def go_to_face(self, face):
+        """Open the image of face = (JSON path, face index, id) and select the box."""
+        if face is None:
+            return
+
+        json_file, bbox_idx, _ = face
+        img_idx = self.img_file_idx
+        if json_file != self.img_json_file:
+            img_idx = next((i for i, img_file in enumerate(self.img_files)
+                            if json_path_for(img_file) == json_file), None)
+            if img_idx is None:
+                return
+        self.show_face(img_idx, bbox_idx)
+        self.statusLabel.setText(self.cluster_review.describe())
+
+    def show_face(self, img_idx, bbox_idx):
+        """Open image img_idx, saving the current one, and select box bbox_idx.
+
+        With bbox_idx None the first box with an unknown id is selected.
+        """
+        if img_idx != self.img_file_idx:
+            self.save_action()
+            if abs(img_idx - self.img_file_idx) > self.prefetcher.radius:
+                self.prefetcher.cancel()
+            self.img_file_idx = img_idx
+            self.process_image()
+
+        if bbox_idx is None:
+            bbox_idx = next((i for i, name in enumerate(self.img_ids) if name not in self.id_registry), 0)
+        if bbox_idx < len(self.img_bboxes):
+            self.img_bbox_idx = bbox_idx
+            self.color_change = len(self.img_bboxes) * [0]
+            self.color_change[bbox_idx] = 1
+        self.update_ui()
+
+    def next_unknown_action(self):
+        """Go to the next image (wrapping around) that has a face with an unknown id."""
+        if self.dataset_index is None or not self.img_files:
+            self.statusLabel.setText("Dataset index not available")
+            return
+
+        unknown = self.dataset_index.images_with_unknown()
+        for offset in range(1, len(self.img_files) + 1):
+            img_idx = (self.img_file_idx + offset) % len(self.img_files)
+            if self.img_files[img_idx] in unknown:
+                self.show_face(img_idx, None)
+                self.statusLabel.setText(f"{len(unknown)} image(s) with unknown ids")
+                return
+        self.statusLabel.setText("No images with unknown ids")
+
+    def jump_to_identity_action(self):
+        """Ask for an identity, listed with its counts, and go to its first face."""
+        if self.dataset_index is None:
+            self.statusLabel.setText("Dataset index not available")
+            return
+
+        counts = self.dataset_index.identity_counts()
+        if not counts:
+            self.statusLabel.setText("No faces indexed yet")
+            return
+        items = [f"{name} ({faces} faces in {images} images)" for name, faces, images in counts]
+        item, ok = QInputDialog.getItem(self, "Jump to Identity", "Identity:", items, 0, False)
+        if not ok:
+            return
+
+        name = counts[items.index(item)][0]
+        self.identity_faces = self.dataset_index.faces_of(name)
+        self.identity_face_idx = -1
+        self.step_identity_face(1)
+
+    def step_identity_face(self, delta):
+        """Go to the next/previous face of the identity jumped to last."""
+        if not self.identity_faces:
+            return
+
+        self.identity_face_idx = (self.identity_face_idx + delta) % len(self.identity_faces)
+        img_file, bbox_idx = self.identity_faces[self.identity_face_idx]
+        img_idx = self.img_files.index_of(img_file)
+        if img_idx is None:
+            return
+        self.show_face(img_idx, bbox_idx)
+        self.statusLabel.setText(f"Face {self.identity_face_idx + 1}/{len(self.identity_faces)}")
+
+    def assign_cluster_action(self):
+        """Ask for an ID and assign it to every face of the current cluster."""
+        cluster = self.cluster_review.cluster()
+        if not cluster:
+            self.statusLabel.setText("No cluster selected")
+            return
+
+        names = [cluster['label']] if cluster['label'] else []
+        names += [name for name in self.id_registry.names if name != cluster['label']]
+        name, ok = QInputDialog.getItem(self, "Assign ID to Cluster",
+                                        f"ID for all {len(cluster['members'])} faces:", names, 0, True)
+        if not ok or not name:
+            return
+
+        changes = {}
+        for json_file, face, _ in cluster['members']:
+            changes.setdefault(json_file, {})[face] = name
+        self.apply_id_changes(changes)
+        self.cluster_review.assign(name)
+        self.statusLabel.setText(self.cluster_review.describe())
+
+    def apply_id_changes(self, changes):
+        """Set ids of many images at once, changes maps JSON path -> {face index: id}.
+
+        The current image is changed in memory, all others are written in the background.
+        """
+        for json_file, faces in changes.items():
+            if json_file == self.img_json_file:
+                for face, name in faces.items():
+                    if face < len(self.img_ids) and self.img_ids[face] != name:
+                        self.record_edit({'op': 'set_id', 'index': face, 'old': self.img_ids[face], 'new': name})
+                        self.img_ids[face] = name
+                self.mark_dirty()
+                continue
+
+            pending_json = self.writer.pending_document(json_file)
+            cached_json = self.prefetcher.take_annotation(json_file)
+            if pending_json is not None:
+                doc = snapshot(pending_json)
+            elif cached_json is not None:
+                doc = cached_json
+            else:
+                doc = load_annotation(json_file)
+
+            ids = face_result(doc)['ids']
+            for face, name in faces.items():
+                if face < len(ids):
+                    ids[face] = name
+            doc['dataset_info']['attributes']['answer_refined'] = True
+
+            self.writer.submit(json_file, snapshot(doc))
+            self.prefetcher.put_annotation(json_file, doc)
+            self.embedding_index.update_ids(json_file, ids)
+
+        self.embedding_index.update_ids(self.img_json_file, self.img_ids)
+        self.suggestion_ranker.clear()
+        self.img_suggestions = None
+        self.update_id_list_ui()
+        self.update_ui()
+
+    def rename_ids_action(self):
+        """Ask for an ID and its new name, then report what renaming it in all files would change."""
+        if not self.img_files or self.rename_task.running():
+            return
+
+        if self.dataset_index is not None:
+            names = [name for name, _, _ in self.dataset_index.identity_counts()]
+        else:
+            names = list(self.id_registry.names)
+        old, ok = QInputDialog.getItem(self, "Rename IDs", "ID to rename or merge:", names, 0, True)
+        if not ok or not old:
+            return
+        new, ok = QInputDialog.getItem(self, "Rename IDs", f"Rename {old} in all files to:",
+                                       self.id_registry.names, 0, True)
+        if not ok or not new or new == old:
+            return
+
+        # The files are read by other processes, everything has to be on disk first
+        self.save_action()
+        self.writer.flush()
+
+        self.rename_plan = ({old: new}, None)
+        self.start_rename_task(lambda: self.rename_task.start_rename(
+            [json_path_for(img_file) for img_file in self.img_files], {old: new}, True))
+
+    def undo_rename_action(self):
+        """Revert the last rename."""
+        if self.rename_manifest is None or self.rename_task.running():
+            self.statusLabel.setText("Nothing to undo")
+            return
+
+        try:
+            with open(self.rename_manifest, 'r', encoding='utf-8') as file:
+                entries = json.load(file)['files']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.statusLabel.setText("Cannot read the rename manifest")
+            self.statusLabel.setToolTip(f"{self.rename_manifest}: {e}")
+            return
+
+        self.save_action()
+        self.writer.flush()
+
+        # The current image is reverted in memory, the others on disk
+        faces = {}
+        for entry in entries:
+            if entry['file'] == self.img_json_file:
+                faces = {face: old for face, old, new in entry['faces']
+                         if face < len(self.img_ids) and self.img_ids[face] == new}
+        if faces:
+            self.apply_id_changes({self.img_json_file: faces})
+
+        manifest, self.rename_manifest = self.rename_manifest, None
+        self.start_rename_task(lambda: self.rename_task.start_undo(manifest, {self.img_json_file}))
+
+    def start_rename_task(self, start):
+        self.rename_progress = QProgressDialog("Checking files...", None, 0, 0, self)
+        self.rename_progress.setWindowTitle("Rename IDs")
+        self.rename_progress.setModal(True)
+        self.rename_progress.show()
+        start()
+
+    def rename_progress_changed(self, done, total):
+        if self.rename_progress is not None:
+            self.rename_progress.setMaximum(total)
+            self.rename_progress.setValue(done)
+
+    def rename_failed(self, error):
+        """Close the progress dialog and report a rename or undo that raised."""
+        if self.rename_progress is not None:
+            self.rename_progress.close()
+            self.rename_progress = None
+        self.rename_plan = None
+        self.statusLabel.setText("Renaming IDs failed")
+        self.statusLabel.setToolTip(error)
+
+    def rename_finished(self, results, dry_run):
+        """Ask to apply a dry run, or bring caches and indexes up to date after a rename."""
+        if self.rename_progress is not None:
+            self.rename_progress.close()
+            self.rename_progress = None
+
+        if dry_run:
+            mapping, _ = self.rename_plan
+            changed = [json_file for json_file, changes, _ in results if changes]
+            if not changed:
+                self.statusLabel.setText("No faces to rename")
+                return
+            answer = QMessageBox.question(self, "Rename IDs", f"Rename {summarize(results)}?")
+            if answer != QMessageBox.Yes:
+                return
+            self.rename_plan = (mapping, results)
+
+            # The current image is renamed in memory, all other files by the worker processes
+            others = [json_file for json_file in changed if json_file != self.img_json_file]
+            self.start_rename_task(lambda: self.rename_task.start_rename(others, mapping, False))
+            return
+
+        changes = {json_file: {face: new for face, _, new in faces} for json_file, faces, _ in results if faces}
+        for json_file, faces in changes.items():
+            # Cached documents still point to the replaced files
+            self.prefetcher.take_annotation(json_file)
+            self.embedding_index.relabel(json_file, faces)
+
+        if self.rename_plan is not None and self.rename_plan[1] is not None:
+            # Finished the rename of a confirmed plan, record it for undo
+            mapping, planned = self.rename_plan
+            current = [result for result in planned if result[0] == self.img_json_file and result[1]]
+            for _, faces, _ in current:
+                self.apply_id_changes({self.img_json_file: {face: new for face, _, new in faces}})
+            self.rename_manifest = default_manifest_path(self.img_files.dir_name)
+            try:
+                write_manifest(self.rename_manifest, mapping, results + current)
+            except OSError as e:
+                self.rename_manifest = None
+                QMessageBox.warning(self, "Rename IDs", f"The rename cannot be undone, writing the manifest "
+                                                        f"failed:\n{e}")
+            results = results + current
+        self.rename_plan = None
+
+        self.start_dataset_indexer()
+        self.update_ui()
+        self.statusLabel.setText(summarize(results).splitlines()[0])
@@ -0,0 +1,160 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .annotation import json_path_for, load_annotation
+from .image_pyramid import OVERVIEW_FACTOR
+from .instrument import timed
+
+
+class LRUCache:
+    """Thread-safe least recently used cache bounded by an estimated size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        """Return cached value (marking it as recently used) or None."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def pop(self, key):
+        """Remove and return cached value or None."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            value, size = self._entries.pop(key)
+            self.total_bytes -= size
+            return value
+
+    def put(self, key, value, size, replace=True):
+        """Insert value, evicting least recently used entries until it fits.
+
+        With replace=False an existing entry is kept, which lets background loads
+        never overwrite fresher data put in by the GUI thread.
+        """
+        with self._lock:
+            if key in self._entries:
+                if not replace:
+                    return
+                self.total_bytes -= self._entries.pop(key)[1]
+
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+class Prefetcher:
+    """Decodes images and parses annotations around the current file on a thread pool.
+
+    Images are decoded at the overview level into the tile cache of tile_loader, so the
+    next image shows at once and only its finer tiles are decoded on demand.
+    Annotations are handed out with take_annotation() because the caller edits them;
+    put_annotation() returns the edited document to the cache when moving on.
+    """
+    # Rough factor between JSON file size and the size of the parsed Python objects
+    JSON_SIZE_FACTOR = 4
+
+    def __init__(self, tile_loader, radius=2, workers=2, max_bytes=512 * 1024 * 1024):
+        self.tile_loader = tile_loader
+        self.radius = radius
+        self.cache = LRUCache(max_bytes)
+
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._futures = {}  # image file -> Future
+        self._current = None  # Image file being edited, never overwritten by workers
+        self._generation = 0  # Bumped on cancel so late results from old requests are dropped
+        self._lock = threading.RLock()  # Done callbacks may run inside request()
+
+    def request(self, img_files, idx):
+        """Schedule loading of the neighbours of idx and drop work outside that window."""
+        self._current = img_files[idx]
+        wanted = []
+        for offset in range(1, self.radius + 1):
+            for neighbour in (idx + offset, idx - offset):
+                if 0 <= neighbour < len(img_files):
+                    wanted.append(img_files[neighbour])
+
+        with self._lock:
+            for img_file in list(self._futures):
+                if img_file not in wanted and self._futures[img_file].cancel():
+                    self._futures.pop(img_file, None)
+
+            for img_file in wanted:
+                if img_file in self._futures or (self.tile_loader.has_level(img_file, OVERVIEW_FACTOR) and
+                                                 ('json', json_path_for(img_file)) in self.cache):
+                    continue
+                future = self._executor.submit(self._load, img_file, self._generation)
+                self._futures[img_file] = future
+                future.add_done_callback(lambda done, img_file=img_file: self._done(img_file, done))
+
+    def cancel(self):
+        """Cancel pending work, e.g. when the user jumps to a far away page."""
+        with self._lock:
+            self._generation += 1
+            # Cancelling runs the done callback, which removes the future from the dict
+            for future in list(self._futures.values()):
+                future.cancel()
+            self._futures.clear()
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+    def take_annotation(self, json_file):
+        """Remove and return the parsed annotation of json_file or None."""
+        return self.cache.pop(('json', json_file))
+
+    def put_annotation(self, json_file, doc):
+        """Store the up to date (possibly edited) annotation of json_file."""
+        if os.path.exists(json_file):
+            self.cache.put(('json', json_file), doc, self._json_size(json_file))
+
+    def _json_size(self, json_file):
+        return os.path.getsize(json_file) * Prefetcher.JSON_SIZE_FACTOR
+
+    def _done(self, img_file, future):
+        with self._lock:
+            if self._futures.get(img_file) is future:
+                del self._futures[img_file]
+
+    @timed()
+    def _load(self, img_file, generation):
+        """Worker: decode the overview of the image and parse its annotation if there is one."""
+        if generation != self._generation:
+            return
+        if not self.tile_loader.has_level(img_file, OVERVIEW_FACTOR):
+            self.tile_loader.load_level(img_file, OVERVIEW_FACTOR)
+
+        json_file = json_path_for(img_file)
+        if img_file == self._current or not os.path.exists(json_file):
+            return
+        try:
+            doc = load_annotation(json_file)
+        except (OSError, ValueError):
+            # File is being rewritten right now, it will simply be read again on demand
+            return
+
+        if generation == self._generation and img_file != self._current:
+            self.cache.put(('json', json_file), doc, self._json_size(json_file), replace=False)
@@ -0,0 +1,11 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def process_pool(workers=None):
+    """ProcessPoolExecutor whose workers are spawned instead of forked.
+
+    The GUI starts pools from threads while other threads (writer, prefetcher, Qt)
+    may hold locks; a forked child would inherit those locks in their held state.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
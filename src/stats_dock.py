@@ -0,0 +1,61 @@
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QDockWidget, QFileDialog, QHeaderView, QPushButton, QTableWidget, QTableWidgetItem, \
+    QVBoxLayout, QWidget, QLabel
+
+from . import instrument
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class StatsDock(QDockWidget):
+    """Live table of the operations recorded by instrument, with an export of the trace."""
+    COLUMNS = ("Operation", "Calls", "Mean ms", "p95 ms", "Max ms", "Read", "Written")
+    REFRESH_MS = 1000
+
+    def __init__(self, parent):
+        super().__init__("Performance", parent)
+        self.setObjectName("statsDock")
+
+        self.table = QTableWidget(0, len(StatsDock.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(StatsDock.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.verticalHeader().hide()
+        self.totalsLabel = QLabel(self)
+        self.exportButton = QPushButton("Export Chrome Trace...", self)
+        self.exportButton.clicked.connect(self.export_trace)
+
+        content = QWidget(self)
+        layout = QVBoxLayout(content)
+        layout.addWidget(self.table)
+        layout.addWidget(self.totalsLabel)
+        layout.addWidget(self.exportButton)
+        self.setWidget(content)
+
+        # Only refreshed while visible, a hidden panel costs nothing
+        self._timer = QTimer(self)
+        self._timer.setInterval(StatsDock.REFRESH_MS)
+        self._timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(lambda visible: self._timer.start() if visible else self._timer.stop())
+
+    def refresh(self):
+        rows = instrument.stats()
+        self.table.setRowCount(len(rows))
+        for row, (name, calls, mean, p95, maximum, read, written) in enumerate(rows):
+            values = (name, str(calls), f"{mean:.2f}", f"{p95:.2f}", f"{maximum:.2f}", _format_bytes(read),
+                      _format_bytes(written))
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+        totals = instrument.totals()
+        self.totalsLabel.setText(f"Read {_format_bytes(totals['read'])}, written {_format_bytes(totals['written'])}")
+
+    def export_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Chrome Trace", "face_tool_trace.json", "JSON (*.json)")
+        if path:
+            count = instrument.export_chrome_trace(path)
+            self.totalsLabel.setText(f"Exported {count} event(s) to {path}")
@@ -0,0 +1,147 @@
+"""Thumbnails with the stored boxes drawn on them, kept in an on-disk cache.
+
+Cache entries are JPEG files named after a hash of the image content (its first
+bytes and size) and of the state of its annotation, so a thumbnail is reused after
+moving or reopening a directory and renewed when the boxes are saved. The cache is
+bounded in size; the least recently used files are deleted first.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+from .annotation import face_result, json_path_for, load_annotation
+from .image_probe import image_size
+from .image_pyramid import LEVELS, decode_array
+from .lazy_import import LazyModule
+
+cv2 = LazyModule('cv2')
+np = LazyModule('numpy')
+
+# Bytes of the image file hashed for the cache key
+HASH_BYTES = 64 * 1024
+
+BOX_COLOR = (0, 0, 255)
+JPEG_QUALITY = 85
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'face_tool', 'thumbnails')
+
+
+def thumbnail_key(img_file, size):
+    """Cache key of the thumbnail of img_file with edge length size. Raises OSError."""
+    digest = hashlib.sha1(str(size).encode('ascii'))
+    with open(img_file, 'rb') as file:
+        digest.update(file.read(HASH_BYTES))
+        digest.update(str(os.fstat(file.fileno()).st_size).encode('ascii'))
+    try:
+        stat = os.stat(json_path_for(img_file))
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode('ascii'))
+    except OSError:
+        pass  # No annotation (yet), the thumbnail has no boxes
+    return digest.hexdigest()
+
+
+def render_thumbnail(img_file, size):
+    """BGR array of img_file fitting a size x size square with its boxes drawn, or None."""
+    try:
+        width, height = image_size(img_file)
+    except OSError:
+        return None
+    # Coarsest reduced decoding that still covers the thumbnail
+    factor = max([factor for factor in LEVELS if max(width, height) / factor >= size] or [1])
+    image = decode_array(img_file, factor)
+    if image is None:
+        return None
+
+    scale = size / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, (max(int(image.shape[1] * scale), 1), max(int(image.shape[0] * scale), 1)),
+                           interpolation=cv2.INTER_AREA)
+
+    try:
+        bboxes = face_result(load_annotation(json_path_for(img_file)))['bboxes']
+    except (OSError, ValueError, KeyError):
+        bboxes = []
+    height, width = image.shape[:2]
+    boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4) * [width, height, width, height]
+    for x1, y1, x2, y2 in boxes.round().astype(int):
+        cv2.rectangle(image, (x1, y1), (x2, y2), BOX_COLOR, 1)
+    return image
+
+
+def encode_thumbnail(image):
+    ok, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return data.tobytes() if ok else None
+
+
+class ThumbnailCache:
+    """Directory of encoded thumbnails bounded by max_bytes, safe to use from several threads."""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._total_bytes = None  # Counted on the first put
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.jpg')
+
+    def get(self, key):
+        """Encoded thumbnail or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            # The modification time orders entries for eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return  # A read-only or full cache only costs regenerating thumbnails
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """(mtime, size, path) of every cached file."""
+        entries = []
+        for dir_name, _, file_names in os.walk(self.cache_dir):
+            for name in file_names:
+                path = os.path.join(dir_name, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        """Delete least recently used files until the cache is down to 90% of max_bytes."""
+        entries = sorted(self._entries())
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._total_bytes -= size
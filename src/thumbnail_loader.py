@@ -0,0 +1,79 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5 import QtGui
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .image_pyramid import to_qimage
+from .thumbnail_cache import encode_thumbnail, render_thumbnail, thumbnail_key
+
+
+class ThumbnailLoader(QObject):
+    """Loads thumbnails from the disk cache, or renders them, on a thread pool.
+
+    Decoded thumbnails are kept in an in-memory LRUCache keyed by image file; only the
+    files of the last request() are loaded, queued work for others is dropped.
+    """
+    # Emitted with the image file of a thumbnail that became available
+    thumbnailReady = pyqtSignal(str)
+
+    def __init__(self, disk_cache, memory_cache, size=96, workers=2):
+        super().__init__()
+        self.disk_cache = disk_cache
+        self.memory_cache = memory_cache
+        self.size = size
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._futures = {}  # image file -> Future
+        self._lock = threading.Lock()
+
+    def thumbnail(self, img_file):
+        """Cached QImage of img_file or None."""
+        return self.memory_cache.get(img_file)
+
+    def request(self, img_files):
+        """Load the thumbnails of img_files that are not cached yet."""
+        wanted = set(img_files)
+        with self._lock:
+            for img_file in list(self._futures):
+                if img_file not in wanted and self._futures[img_file].cancel():
+                    del self._futures[img_file]
+
+            for img_file in img_files:
+                if img_file in self._futures or img_file in self.memory_cache:
+                    continue
+                self._futures[img_file] = self._executor.submit(self._load, img_file)
+
+    def invalidate(self, img_file):
+        """Forget the thumbnail of img_file, e.g. after its boxes were saved."""
+        self.memory_cache.pop(img_file)
+
+    def shutdown(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=False)
+
+    def _load(self, img_file):
+        """Worker: take the thumbnail from the disk cache or render and store it."""
+        image = None
+        try:
+            key = thumbnail_key(img_file, self.size)
+        except OSError:
+            key = None
+        data = self.disk_cache.get(key) if key else None
+        if data is not None:
+            image = QtGui.QImage.fromData(data)
+        if image is None or image.isNull():
+            array = render_thumbnail(img_file, self.size)
+            image = to_qimage(array) if array is not None else QtGui.QImage()
+            if array is not None and key:
+                data = encode_thumbnail(array)
+                if data is not None:
+                    self.disk_cache.put(key, data)
+
+        with self._lock:
+            self._futures.pop(img_file, None)
+        # Images that cannot be decoded are cached as null images, so they are not retried
+        self.memory_cache.put(img_file, image, image.byteCount())
+        self.thumbnailReady.emit(img_file)
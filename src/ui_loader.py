@@ -0,0 +1,49 @@
+"""Creation of the widgets described by the .ui files.
+
+``python -m src.build_ui`` compiles the .ui files into Python modules in
+src/compiled_ui, which set up a window without parsing XML at start up. Without them,
+or when a .ui file was edited after compiling, the .ui file is loaded at runtime.
+"""
+import importlib
+import os
+
+# Directory of the .ui files, independent of the working directory
+UI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPILED_PACKAGE = 'compiled_ui'
+
+
+def ui_path(name):
+    return os.path.join(UI_DIR, f"{name}.ui")
+
+
+def compiled_module_name(name):
+    return f"{name}_ui"
+
+
+def _compiled_class(name):
+    """Ui_* class compiled from <name>.ui if it is up to date, otherwise None."""
+    try:
+        module = importlib.import_module(f".{COMPILED_PACKAGE}.{compiled_module_name(name)}", __package__)
+    except ImportError:
+        return None
+    try:
+        if os.path.getmtime(ui_path(name)) > os.path.getmtime(module.__file__):
+            return None
+    except OSError:
+        pass  # Installed without the .ui files, the compiled module is all there is
+    return next((value for key, value in vars(module).items() if key.startswith('Ui_')), None)
+
+
+def setup_ui(widget, name):
+    """Create the child widgets of <name>.ui on widget, like uic.loadUi(<name>.ui, widget)."""
+    ui_class = _compiled_class(name)
+    if ui_class is not None:
+        ui = ui_class()
+        ui.setupUi(widget)
+        # The compiled class keeps the child widgets as its own attributes, loadUi sets them on widget
+        for attr, value in vars(ui).items():
+            setattr(widget, attr, value)
+        return
+
+    from PyQt5 import uic
+    uic.loadUi(ui_path(name), widget)
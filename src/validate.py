@@ -0,0 +1,356 @@
+"""Headless validation of every annotation below a directory before a dataset ships.
+
+Each image is checked on a process pool, its annotation read with json_stream's
+partial parser so embeddings are only counted, never decoded:
+
+    missing_json      the image has no annotation file
+    unreadable        the annotation cannot be parsed or lacks the face result
+    bbox_malformed    a box is not four numbers
+    bbox_out_of_range a box coordinate lies outside [0, 1]
+    bbox_inverted     x2 <= x1 or y2 <= y1, e.g. after dragging a corner past its opposite
+    length_mismatch   bboxes, ids and (if present) embeddings differ in length
+    missing_sidecar   the embeddings sidecar file does not exist
+    stale_size        image_width/image_height differ from the image header
+    image_unreadable  the image size cannot be read
+    unknown_id        an id is not in the candidate list
+    unlabeled         a box still has the id of new boxes
+
+The report is a JSON file with the problems, per-image and per-identity statistics.
+Results are cached in a SQLite file next to the images: files whose annotation and
+image have the same mtime and size as last time are not read again, annotations
+that were only touched are recognized by their SHA-1. The candidate list is applied
+after the cache, so editing it does not invalidate anything.
+
+    python -m src.validate <dir> [--ids id_cand_list.txt] [--report FILE] [--no-cache] [--workers N]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import time
+
+from .annotation import NEW_BOX_ID, face_result, json_path_for, load_annotation
+from .embedding_store import is_sidecar_ref, sidecar_path
+from .image_probe import image_size
+from .json_stream import find_raw
+from .process_pool import process_pool
+
+CACHE_FILE_NAME = '.face_tool_validate.sqlite'
+# Bump when the checks change, so cached results of older checks are not reused
+CACHE_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    stamp TEXT NOT NULL,
+    sha1 TEXT,
+    result TEXT NOT NULL
+);
+"""
+
+
+def find_images(root):
+    """Paths of all images below root, sorted."""
+    # Imported here so the worker processes do not have to load Qt
+    from .file_scanner import is_image
+    img_files = []
+    for dir_name, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if not name.startswith('.')]
+        img_files.extend(os.path.join(dir_name, name) for name in file_names if is_image(name))
+    return sorted(img_files)
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def file_stamp(img_file):
+    """[annotation stamp, image stamp], each [mtime_ns, size] or None if the file is missing."""
+    return [_stamp(json_path_for(img_file)), _stamp(img_file)]
+
+
+def _count_embeddings(json_file, doc, data):
+    """Number of embedding rows of doc, without decoding them. data are the bytes of json_file."""
+    raw = find_raw(doc)
+    if raw is not None:
+        # A list of number lists, so every row opens exactly one bracket
+        return max(data[raw.start:raw.end].count(b'[') - 1, 0)
+    embeddings = face_result(doc)['embeddings']
+    if is_sidecar_ref(embeddings):
+        if not os.path.exists(sidecar_path(json_file, embeddings)):
+            raise FileNotFoundError(embeddings['sidecar'])
+        return embeddings['shape'][0]
+    return len(embeddings)
+
+
+def _check_box(box):
+    """Problem code of a normalized box, or None."""
+    if not isinstance(box, (list, tuple)) or len(box) != 4 \
+            or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in box):
+        return 'bbox_malformed'
+    if not all(0 <= value <= 1 for value in box):
+        return 'bbox_out_of_range'
+    if box[2] <= box[0] or box[3] <= box[1]:
+        return 'bbox_inverted'
+    return None
+
+
+def check_image(img_file, sha1=None, image_stamp=None):
+    """Check the annotation of one image.
+
+    Returns (img_file, stamp, sha1 of the annotation, result), where result is None if the
+    annotation still has sha1 and the image still has image_stamp. Otherwise result is
+    {'width', 'height', 'ids', 'box_px': [longer box side in pixels or None], 'problems': [[code, face, detail]]}
+    with face None for problems of the whole image. Ids are not checked against the
+    candidate list here.
+    """
+    stamp = file_stamp(img_file)
+    json_file = json_path_for(img_file)
+    result = {'width': None, 'height': None, 'ids': [], 'box_px': [], 'problems': []}
+    problems = result['problems']
+    if stamp[0] is None:
+        problems.append(['missing_json', None, None])
+        return img_file, stamp, None, result
+
+    try:
+        with open(json_file, 'rb') as file:
+            data = file.read()
+    except OSError as e:
+        problems.append(['unreadable', None, str(e)])
+        return img_file, stamp, None, result
+    digest = hashlib.sha1(data).hexdigest()
+    if sha1 == digest and stamp[1] == image_stamp:
+        return img_file, stamp, digest, None
+
+    try:
+        doc = load_annotation(json_file)
+        face = face_result(doc)
+        bboxes, ids = list(face['bboxes']), list(face['ids'])
+        attributes = doc['image_info']['attributes']
+        width, height = attributes['image_width'], attributes['image_height']
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        problems.append(['unreadable', None, str(e)])
+        return img_file, stamp, digest, result
+    result.update(width=width, height=height, ids=[str(name) for name in ids])
+
+    try:
+        embeddings = _count_embeddings(json_file, doc, data)
+    except FileNotFoundError as e:
+        problems.append(['missing_sidecar', None, str(e)])
+        embeddings = 0
+    except (KeyError, TypeError, IndexError) as e:
+        problems.append(['unreadable', None, f"embeddings: {e}"])
+        embeddings = 0
+    if len(bboxes) != len(ids) or embeddings not in (0, len(bboxes)):
+        problems.append(['length_mismatch', None, f"{len(bboxes)} bboxes, {len(ids)} ids, {embeddings} embeddings"])
+
+    sized = isinstance(width, (int, float)) and isinstance(height, (int, float))
+    for i, box in enumerate(bboxes):
+        code = _check_box(box)
+        if code:
+            problems.append([code, i, box])
+        result['box_px'].append(round(max(abs(box[2] - box[0]) * width, abs(box[3] - box[1]) * height), 1)
+                                if sized and code != 'bbox_malformed' else None)
+
+    try:
+        actual = list(image_size(img_file))
+        if actual != [width, height]:
+            problems.append(['stale_size', None, f"annotation {width}x{height}, image {actual[0]}x{actual[1]}"])
+    except OSError as e:
+        problems.append(['image_unreadable', None, str(e)])
+    return img_file, stamp, digest, result
+
+
+class ValidationCache:
+    """Results of earlier runs, keyed by image path."""
+
+    def __init__(self, db_path):
+        self._db = sqlite3.connect(db_path, timeout=10)
+        self._db.executescript(_SCHEMA)
+        version = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or int(version[0]) != CACHE_VERSION:
+            self._db.execute("DELETE FROM files")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(CACHE_VERSION),))
+            self._db.commit()
+
+    @classmethod
+    def for_directory(cls, dir_name):
+        return cls(os.path.join(dir_name, CACHE_FILE_NAME))
+
+    def entries(self):
+        """Image path -> (stamp, sha1, result)."""
+        return {path: (json.loads(stamp), sha1, json.loads(result))
+                for path, stamp, sha1, result in self._db.execute("SELECT path, stamp, sha1, result FROM files")}
+
+    def update(self, rows, removed):
+        """Store rows [(path, stamp, sha1, result)] and drop the entries of removed paths."""
+        self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                             ((path, json.dumps(stamp), sha1, json.dumps(result, ensure_ascii=False))
+                              for path, stamp, sha1, result in rows))
+        self._db.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in removed))
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+def check_images(img_files, cache=None, workers=None, progress=None):
+    """Results of check_image for img_files, {image path: result}, reusing and updating cache.
+
+    Returns the results and the number of images that had to be read.
+    """
+    cached = cache.entries() if cache is not None else {}
+    results, todo = {}, []
+    for img_file in img_files:
+        entry = cached.get(img_file)
+        if entry is not None and entry[0] == file_stamp(img_file):
+            results[img_file] = entry[2]
+        else:
+            todo.append((img_file, entry[1], entry[0][1]) if entry is not None else (img_file,))
+
+    rows = []
+    if todo:
+        with process_pool(workers) as pool:
+            checked = pool.map(_check_entry, todo, chunksize=64)
+            for done, (img_file, stamp, sha1, result) in enumerate(checked, 1):
+                if result is None:
+                    result = cached[img_file][2]  # Only touched
+                results[img_file] = result
+                rows.append((img_file, stamp, sha1, result))
+                if progress and done % 1000 == 0:
+                    progress(done, len(todo))
+    if progress and todo:
+        progress(len(todo), len(todo))
+
+    if cache is not None:
+        cache.update(rows, set(cached) - set(img_files))
+    return results, len(todo)
+
+
+def _check_entry(entry):
+    return check_image(*entry)
+
+
+def build_report(root, results, candidates=None):
+    """Report dict of the check results, ids are checked against candidates unless it is None."""
+    images, identities, counts = [], {}, {}
+    faces = unknown_faces = 0
+    for img_file in sorted(results):
+        result = results[img_file]
+        problems = [list(problem) for problem in result['problems']]
+        unknown = 0
+        for i, name in enumerate(result['ids']):
+            if name == NEW_BOX_ID:
+                problems.append(['unlabeled', i, name])
+                unknown += 1
+            elif candidates is not None and name not in candidates:
+                problems.append(['unknown_id', i, name])
+                unknown += 1
+
+            identity = identities.setdefault(name, {'faces': 0, 'images': set(), 'box_px': []})
+            identity['faces'] += 1
+            identity['images'].add(img_file)
+            if i < len(result['box_px']) and result['box_px'][i] is not None:
+                identity['box_px'].append(result['box_px'][i])
+
+        faces += len(result['ids'])
+        unknown_faces += unknown
+        for code, _, _ in problems:
+            counts[code] = counts.get(code, 0) + 1
+        json_file = json_path_for(img_file)
+        images.append({
+            'image': os.path.relpath(img_file, root),
+            'json': os.path.relpath(json_file, root) if result['width'] is not None else None,
+            'width': result['width'],
+            'height': result['height'],
+            'faces': len(result['ids']),
+            'unknown': unknown,
+            'problems': [{'code': code, 'face': face, 'detail': detail} for code, face, detail in problems]
+        })
+
+    return {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'root': os.path.abspath(root),
+        'summary': {
+            'images': len(images),
+            'images_with_problems': sum(1 for image in images if image['problems']),
+            'faces': faces,
+            'unknown_faces': unknown_faces,
+            'identities': len(identities),
+            'problems': dict(sorted(counts.items()))
+        },
+        'images': images,
+        'identities': [{
+            'id': name,
+            'known': name in candidates if candidates is not None else None,
+            'faces': identity['faces'],
+            'images': len(identity['images']),
+            'median_box_px': statistics.median(identity['box_px']) if identity['box_px'] else None
+        } for name, identity in sorted(identities.items(), key=lambda item: (-item[1]['faces'], item[0]))]
+    }
+
+
+def read_candidates(path):
+    """Candidate ids of the list file at path, the GUI's id_cand_list.txt format."""
+    with open(path, 'r', encoding='utf-8') as file:
+        return frozenset(file.read().splitlines())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check every annotation below a directory and report statistics.")
+    parser.add_argument('directory')
+    parser.add_argument('--ids', default='id_cand_list.txt', help="candidate id list (default: id_cand_list.txt)")
+    parser.add_argument('--report', help="report file (default: validation_<time>.json)")
+    parser.add_argument('--no-cache', action='store_true', help=f"check every file, ignoring {CACHE_FILE_NAME}")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        candidates = read_candidates(args.ids)
+    except OSError:
+        print(f"Candidate list {args.ids} not found, ids are not checked", file=sys.stderr)
+        candidates = None
+
+    cache = None
+    if not args.no_cache:
+        try:
+            cache = ValidationCache.for_directory(args.directory)
+        except sqlite3.Error:
+            pass  # E.g. a read-only directory, everything is checked then
+
+    try:
+        img_files = find_images(args.directory)
+        results, checked = check_images(img_files, cache, args.workers,
+                                        lambda done, total: print(f"{done}/{total}", end='\r', file=sys.stderr))
+    finally:
+        if cache is not None:
+            cache.close()
+    if checked:
+        print(file=sys.stderr)
+
+    report = build_report(args.directory, results, candidates)
+    # Not in the directory, where it would pass for an annotation file
+    report_file = args.report or f"validation_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(report_file, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=4)
+
+    summary = report['summary']
+    print(f"Checked {checked} of {summary['images']} image(s), {summary['faces']} face(s) "
+          f"of {summary['identities']} identities")
+    for code, count in summary['problems'].items():
+        print(f"  {code}: {count}")
+    print(f"Report: {report_file}")
+    if summary['images_with_problems']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .annotation import write_annotation
+from .instrument import timed
+
+
+class AnnotationWriter(QObject):
+    """Writes annotation documents on a background thread.
+
+    Documents are written atomically (temporary file + rename). Submitting a file
+    that is still waiting to be written replaces the queued document, so only the
+    latest state ends up on disk.
+
+    Backup policies for the "<file>~" copy:
+        none: never create a backup
+        once: keep the version from before the first save by this tool
+        always: copy the current file before every write
+    """
+    BACKUP_POLICIES = ('none', 'once', 'always')
+
+    # Emitted with the number of pending and failed writes whenever either changes
+    statusChanged = pyqtSignal(int, int)
+    # Emitted with the JSON path after it was written successfully
+    written = pyqtSignal(str)
+
+    def __init__(self, backup_policy='always'):
+        super().__init__()
+        if backup_policy not in AnnotationWriter.BACKUP_POLICIES:
+            raise ValueError(f"Unknown backup policy: {backup_policy}")
+        self.backup_policy = backup_policy
+
+        self._failed = {}  # JSON path -> error message of last failed write, guarded by _cond
+        self._pending = OrderedDict()  # JSON path -> document waiting to be written
+        self._writing = None  # (JSON path, document) currently being written
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="AnnotationWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, json_file, doc):
+        """Queue doc for writing. doc must not be modified afterwards, see annotation.snapshot."""
+        with self._cond:
+            self._pending[json_file] = doc
+            self._pending.move_to_end(json_file)
+            self._cond.notify_all()
+        self._emit_status()
+
+    def pending_document(self, json_file):
+        """Latest document queued or being written for json_file, or None."""
+        with self._cond:
+            if json_file in self._pending:
+                return self._pending[json_file]
+            if self._writing and self._writing[0] == json_file:
+                return self._writing[1]
+            return None
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending) + (self._writing is not None)
+
+    def failed_writes(self):
+        """Copy of {JSON path: error message} of the files whose last write failed."""
+        with self._cond:
+            return dict(self._failed)
+
+    def flush(self, timeout=None):
+        """Block until every queued document is written. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and self._writing is None, timeout)
+
+    def shutdown(self, timeout=None):
+        """Write remaining documents and stop the writer thread."""
+        self.flush(timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _backup(self, json_file):
+        if self.backup_policy == 'none' or not os.path.exists(json_file):
+            return
+
+        backup_file = f"{json_file}~"
+        if self.backup_policy == 'always' or not os.path.exists(backup_file):
+            shutil.copy2(json_file, backup_file)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopped)
+                if not self._pending:
+                    return
+                self._writing = self._pending.popitem(last=False)
+
+            self._write(*self._writing)
+
+            with self._cond:
+                self._writing = None
+                self._cond.notify_all()
+            self._emit_status()
+
+    @timed()
+    def _write(self, json_file, doc):
+        try:
+            self._backup(json_file)
+            write_annotation(json_file, doc)
+        except (OSError, TypeError, ValueError) as error:
+            with self._cond:
+                self._failed[json_file] = str(error)
+            return
+        with self._cond:
+            self._failed.pop(json_file, None)
+        self.written.emit(json_file)
+
+    def _emit_status(self):
+        with self._cond:
+            pending, failed = len(self._pending) + (self._writing is not None), len(self._failed)
+        self.statusChanged.emit(pending, failed)
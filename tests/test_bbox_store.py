@@ -0,0 +1,41 @@
+import pytest
+
+from src.bbox_store import BBoxStore
+
+# (scale, offset) of an image drawn unscaled at the widget origin
+IDENTITY = ([1, 1], [0, 0])
+
+
+@pytest.fixture
+def store():
+    # The second box overlaps the first one's bottom right corner
+    return BBoxStore([[10, 10, 50, 50], [40, 40, 90, 90]], ["1063", "하정우"])
+
+
+def test_hit_test(store):
+    assert store.hit_test((20, 30), 3, *IDENTITY) == (0, None)
+    assert store.hit_test((11, 9), 3, *IDENTITY) == (0, 0)
+    assert store.hit_test((88, 41), 3, *IDENTITY) == (1, 1)
+    assert store.hit_test((95, 20), 3, *IDENTITY) is None
+    # The first box wins where boxes overlap
+    assert store.hit_test((45, 45), 3, *IDENTITY) == (0, None)
+
+
+def test_hit_test_maps_widget_coordinates(store):
+    # Image drawn at half size, shifted by (100, 0)
+    assert store.hit_test((105, 5), 2, [0.5, 0.5], [100, 0]) == (0, 0)
+    assert store.hit_test((20, 30), 2, [0.5, 0.5], [100, 0]) is None
+
+
+def test_insert_and_delete(store):
+    store.insert(1, [0, 0, 5, 5], "조인성")
+    assert store.ids == ["1063", "조인성", "하정우"]
+    assert store.boxes[1].tolist() == [0, 0, 5, 5]
+
+    store.delete(0)
+    assert store.ids == ["조인성", "하정우"]
+    assert len(store) == 2
+    with pytest.raises(IndexError):
+        store.delete(2)
+    with pytest.raises(IndexError):
+        store.set_id(-1, "1063")
@@ -0,0 +1,115 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from src.annotation import face_result, load_annotation
+from src.bbox_store import BBoxStore
+from src.edit_journal import (FAILED_SUFFIX, EditJournal, apply_edit, find_journals, inverse, read_journal,
+                              recover_file, retire_journal)
+
+
+@pytest.fixture
+def json_file(tmp_path):
+    path = tmp_path / 'a.json'
+    doc = {"dataset_info": {"attributes": {"answer_refined": ""}},
+           "object_info": {"face": {"result": {"bboxes": [[0.1, 0.1, 0.2, 0.2], [0.5, 0.5, 0.6, 0.6]],
+                                               "embeddings": [], "ids": ["1063", "7445"]}}}}
+    path.write_text(json.dumps(doc, indent=4), encoding='utf-8')
+    return str(path)
+
+
+def test_unsaved_edits_are_recovered(tmp_path, json_file):
+    journal = EditJournal(str(tmp_path))
+    journal.append(json_file, {'op': 'set_id', 'index': 0, 'old': "1063", 'new': "하정우"})
+    journal.append(json_file, {'op': 'insert', 'index': 2, 'box': [0.7, 0.7, 0.8, 0.8], 'id': "조인성"})
+    journal.append(json_file, {'op': 'delete', 'index': 1, 'box': [0.5, 0.5, 0.6, 0.6], 'id': "7445"})
+    assert journal.unsaved_count() == 3
+    journal.close()
+
+    assert find_journals(str(tmp_path)) == [journal.path]
+    unsaved = read_journal(journal.path)
+    assert list(unsaved) == [json_file]
+    base, edits = unsaved[json_file]
+    assert base == os.stat(json_file).st_mtime_ns
+    assert [edit['seq'] for edit in edits] == [1, 2, 3]
+
+    doc = recover_file(json_file, base, edits)
+    assert doc['dataset_info']['attributes']['answer_refined'] is True
+    result = face_result(doc)
+    assert result['ids'] == ["하정우", "조인성"]
+    np.testing.assert_allclose(result['bboxes'], [[0.1, 0.1, 0.2, 0.2], [0.7, 0.7, 0.8, 0.8]])
+
+
+def test_saved_edits_are_dropped(tmp_path, json_file):
+    journal = EditJournal(str(tmp_path))
+    seq = journal.append(json_file, {'op': 'set_id', 'index': 0, 'old': "1063", 'new': "하정우"})
+    journal.saved(json_file, seq)
+    assert journal.unsaved_count() == 0
+    journal.close()
+
+    # A journal without unsaved edits is deleted on close
+    assert not os.path.exists(journal.path)
+    assert find_journals(str(tmp_path)) == []
+
+
+def test_edits_after_saved_are_kept(tmp_path, json_file):
+    journal = EditJournal(str(tmp_path))
+    seq = journal.append(json_file, {'op': 'set_id', 'index': 0, 'old': "1063", 'new': "하정우"})
+    journal.saved(json_file, seq)
+    journal.append(json_file, {'op': 'set_id', 'index': 1, 'old': "7445", 'new': "조인성"})
+    journal.close()
+
+    base, edits = read_journal(journal.path)[json_file]
+    assert [edit['new'] for edit in edits] == ["조인성"]
+
+
+def test_torn_last_line_is_ignored(tmp_path, json_file):
+    path = tmp_path / '.face_tool_journal_1.jsonl'
+    records = [{'op': 'base', 'file': json_file, 'mtime_ns': None},
+               {'op': 'set_id', 'index': 0, 'old': "1063", 'new': "하정우", 'file': json_file, 'seq': 1}]
+    text = "".join(json.dumps(record) + "\n" for record in records)
+    path.write_text(text + '{"op": "set_id", "ind', encoding='utf-8')
+
+    base, edits = read_journal(str(path))[json_file]
+    assert base is None and len(edits) == 1
+
+
+def test_changed_file_is_not_recovered(json_file):
+    base = os.stat(json_file).st_mtime_ns
+    os.utime(json_file, ns=(base + 10 ** 9, base + 10 ** 9))
+    with pytest.raises(ValueError):
+        recover_file(json_file, base, [{'op': 'set_id', 'index': 0, 'old': "1063", 'new': "하정우"}])
+
+
+def test_edits_that_do_not_fit_raise(json_file):
+    with pytest.raises(IndexError):
+        recover_file(json_file, None, [{'op': 'delete', 'index': 5, 'box': [0, 0, 1, 1], 'id': "1063"}])
+
+
+def test_retire_journal(tmp_path):
+    path = tmp_path / '.face_tool_journal_1.jsonl'
+    path.write_text("", encoding='utf-8')
+    assert retire_journal(str(path), failed=True)
+    assert not path.exists() and os.path.exists(str(path) + FAILED_SUFFIX)
+    # Set aside journals are not offered for recovery again
+    assert find_journals(str(tmp_path)) == []
+
+    assert retire_journal(str(path) + FAILED_SUFFIX)
+    assert not retire_journal(str(path))
+
+
+@pytest.mark.parametrize('edit', [
+    {'op': 'set_box', 'index': 1, 'old': [0.5, 0.5, 0.6, 0.6], 'new': [0.4, 0.4, 0.9, 0.9]},
+    {'op': 'insert', 'index': 0, 'box': [0.7, 0.7, 0.8, 0.8], 'id': "조인성"},
+    {'op': 'delete', 'index': 0, 'box': [0.1, 0.1, 0.2, 0.2], 'id': "1063"},
+    {'op': 'set_id', 'index': 1, 'old': "7445", 'new': "하정우"},
+])
+def test_inverse_undoes_edit(json_file, edit):
+    result = face_result(load_annotation(json_file))
+    store = BBoxStore.from_normalized(result['bboxes'], list(result['ids']), 100, 50)
+    apply_edit(store, edit, 100, 50)
+    apply_edit(store, inverse(edit), 100, 50)
+    np.testing.assert_allclose(store.to_normalized(100, 50), result['bboxes'])
+    assert store.ids == result['ids']
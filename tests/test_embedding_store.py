@@ -0,0 +1,33 @@
+import json
+import os
+
+import numpy as np
+
+from src.annotation import face_result, load_annotation, load_embedding_list
+from src.embedding_store import SIDECAR_SUFFIX, is_sidecar_ref, load_embeddings, to_inline, to_sidecar
+
+EMBEDDINGS = [[0.1, -0.2, 0.30000001], [1.5, 0.0, -1e-05]]
+
+
+def test_sidecar_round_trip(tmp_path):
+    path = str(tmp_path / 'a.json')
+    doc = {"object_info": {"face": {"result": {"bboxes": [[0, 0, 1, 1]] * 2, "embeddings": EMBEDDINGS,
+                                               "ids": ["1063", "하정우"]}}}}
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(doc, file, ensure_ascii=False, indent=4)
+
+    assert to_sidecar(path)
+    assert not to_sidecar(path)
+    doc = load_annotation(path)
+    ref = face_result(doc)['embeddings']
+    assert is_sidecar_ref(ref)
+    assert ref == {'sidecar': f"a{SIDECAR_SUFFIX}", 'dtype': 'float32', 'shape': [2, 3]}
+    assert face_result(doc)['ids'] == ["1063", "하정우"]
+    np.testing.assert_array_equal(load_embeddings(path, doc), np.asarray(EMBEDDINGS, dtype=np.float32))
+
+    assert to_inline(path)
+    assert not os.path.exists(str(tmp_path / f"a{SIDECAR_SUFFIX}"))
+    doc = load_annotation(path)
+    # float32 values come back as their shortest repr
+    assert load_embedding_list(doc) == [[0.1, -0.2, 0.3], [1.5, 0.0, -1e-05]]
+    np.testing.assert_array_equal(load_embeddings(path, doc), np.asarray(EMBEDDINGS, dtype=np.float32))
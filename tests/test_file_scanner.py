@@ -0,0 +1,6 @@
+from src.file_scanner import natural_key
+
+
+def test_natural_key():
+    names = ["img10.jpg", "img2.jpg", "IMG1.jpg", "img02.jpg", "a.jpg"]
+    assert sorted(names, key=natural_key) == ["a.jpg", "IMG1.jpg", "img02.jpg", "img2.jpg", "img10.jpg"]
@@ -0,0 +1,22 @@
+from src.id_search import IDSearchIndex
+
+NAMES = ["하정우", "주지훈", "조인성", "Jung Woo", "1063"]
+
+
+def test_search():
+    index = IDSearchIndex(NAMES)
+    assert list(index.search("")) == list(range(len(NAMES)))
+    assert index.search("정우") == [0]
+    assert index.search("jung") == [3]
+    assert index.search("ㅈ") == [0, 1, 2]
+    assert index.search("xyz") == []
+
+
+def test_search_matches_partial_syllables():
+    index = IDSearchIndex(NAMES)
+    # Typing 하정우 passes through 하저 before the final consonant is added
+    assert index.search("하저") == [0]
+    assert index.search("하정") == [0]
+    assert index.search("하정우") == [0]
+    assert index.search("하") == [0]
+
@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+from src.annotation import dump_annotation, face_result, load_embedding_list, write_annotation
+from src.json_stream import RawJSON, StaleRawJSONError, find_raw, load_partial
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'samples')
+
+# Number formats json.dumps would not reproduce
+EMBEDDINGS = '[\n[1.50000, -0.0, 1e-3],\n[ 2 ,3.25,-1E+2]\n]'
+
+
+def write_doc(path, embeddings=EMBEDDINGS, bom=False):
+    doc = {
+        "image_info": {"image_name": "하정우.jpg"},
+        "object_info": {"face": {"result": {"bboxes": [[0.1, 0.2, 0.3, 0.4]], "embeddings": "EMBEDDINGS",
+                                            "ids": ["하정우", "1063"]}}}
+    }
+    text = json.dumps(doc, ensure_ascii=False, indent=4).replace('"EMBEDDINGS"', embeddings)
+    with open(path, 'wb') as file:
+        file.write((b'\xef\xbb\xbf' if bom else b'') + text.encode('utf-8'))
+    return text.encode('utf-8')
+
+
+def test_round_trip_is_byte_exact(tmp_path):
+    original = write_doc(tmp_path / 'a.json')
+    doc = load_partial(str(tmp_path / 'a.json'))
+    assert isinstance(face_result(doc)['embeddings'], RawJSON)
+    assert face_result(doc)['ids'] == ["하정우", "1063"]
+
+    dump_annotation(str(tmp_path / 'b.json'), doc)
+    assert (tmp_path / 'b.json').read_bytes() == original
+
+
+@pytest.mark.parametrize('name', ['multiface.json', 'multiface copy.json'])
+def test_samples_round_trip(tmp_path, name):
+    doc = load_partial(os.path.join(SAMPLES, name))
+    dump_annotation(str(tmp_path / name), doc)
+    with open(os.path.join(SAMPLES, name), 'rb') as file:
+        assert (tmp_path / name).read_bytes() == file.read()
+
+
+def test_bom_is_accepted_and_dropped(tmp_path):
+    original = write_doc(tmp_path / 'a.json', bom=True)
+    doc = load_partial(str(tmp_path / 'a.json'))
+    assert face_result(doc)['ids'] == ["하정우", "1063"]
+    assert find_raw(doc).read_bytes() == EMBEDDINGS.encode()
+
+    dump_annotation(str(tmp_path / 'b.json'), doc)
+    assert (tmp_path / 'b.json').read_bytes() == original
+
+
+def test_edited_fields_are_written_and_embeddings_copied(tmp_path):
+    path = str(tmp_path / 'a.json')
+    write_doc(path)
+    doc = load_partial(path)
+    face_result(doc)['ids'][1] = "조인성"
+
+    write_annotation(path, doc)
+    data = (tmp_path / 'a.json').read_bytes()
+    assert EMBEDDINGS.encode() in data
+    assert json.loads(data)['object_info']['face']['result']['ids'] == ["하정우", "조인성"]
+    # The raw value now points into the rewritten file
+    raw = find_raw(doc)
+    assert raw.path == path and data[raw.start:raw.end] == EMBEDDINGS.encode()
+    assert load_embedding_list(doc) == [[1.5, -0.0, 0.001], [2, 3.25, -100.0]]
+
+
+def test_stale_raw_json_is_detected(tmp_path):
+    path = str(tmp_path / 'a.json')
+    write_doc(path)
+    doc = load_partial(path)
+    write_doc(path, embeddings='[]')
+
+    with pytest.raises(StaleRawJSONError):
+        find_raw(doc).read_bytes()
+
+
+@pytest.mark.parametrize('embeddings', ['[]', '[ ]', '[[]]', '[[1, [2]], [3]]', '[["a]"], {"b": "]]"}]'])
+def test_embeddings_span(tmp_path, embeddings):
+    write_doc(tmp_path / 'a.json', embeddings=embeddings)
+    doc = load_partial(str(tmp_path / 'a.json'))
+    assert find_raw(doc).read_bytes() == embeddings.encode()
+    assert face_result(doc)['ids'] == ["하정우", "1063"]